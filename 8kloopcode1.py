@@ -1,22 +1,43 @@
 ### To generate 8k peptides in a 3-consecutive-amino-acid motif. For each space in a tripeptide motif, there are 20 possible combinations of peptides that can be generated. 
-### This script automates the generation of 8k peptides by iteratively mutagenizing through each amino acid in the motif so that each of the 8k combinations of peptides that are generated are made. 
-# command on mac: /usr/bin/python3 8kloopcode1.py modelname chain start_pos mid_pos end_pos
-## ex: /usr/bin/python3 8kloopcode1.py rgdfm.pdb A 1 2 3
+### This script automates the generation of 8k peptides by mutagenizing every position of the motif, so that each of the 8k combinations of peptides is made.
+### The variants are spread over a pool of worker processes and variants already written are skipped on restart. Every mutant gets a fresh MODELLER environment
+### (as in PDBgen.py), so a model does not depend on which worker built it or what that worker built before.
+### The library is built as a prefix tree: each intermediate (X1, then X1Y2) is optimised once, checkpointed in Mutants_*/intermediates and reused by every variant that shares it,
+### so a 3-position scan needs 20 + 400 + 8000 refinements instead of 3 x 8000.
+### Refinement profiles: full-md (default, CG + MD as before), cg-only (CG without the MD blocks) and build-only (side chain built from internal
+### coordinates, no restraints or optimisation). Screen the whole library with a cheap profile, then rebuild the top hits with --profile full-md --only hits.txt.
+### Every built structure and its build time are recorded in the run manifest (Mutants_*/manifest.csv).
+# command on mac: /usr/bin/python3 8kloopcode1.py modelname chain start_pos mid_pos end_pos [workers] [--profile full-md] [--only variants.txt]
+## ex: /usr/bin/python3 8kloopcode1.py rgdfm.pdb A 1 2 3 64 --profile cg-only
+## Positions are PDB residue numbers. workers defaults to the number of cores.
 ## Notes: Make sure the python version that modeller was downloaded is compatible with the version of python on your system.
 
 
 
-import sys
 import os
+import csv
+import time
+import argparse
+import itertools
+import shutil
+import tempfile
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from modeller import *
 from modeller.optimizers import MolecularDynamics, ConjugateGradients
 from modeller.automodel import autosched
-import shutil
 
-def optimize(atmsel, sched):
+AMINO_ACIDS = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY",
+               "HIS", "ILE", "LEU", "LYS", "MET", "PHE", "PRO", "SER",
+               "THR", "TRP", "TYR", "VAL"]
+
+REFINEMENT_PROFILES = ("full-md", "cg-only", "build-only")
+
+def optimize(atmsel, sched, md=True):
     for step in sched:
         step.optimize(atmsel, max_iterations=200, min_atom_shift=0.001)
-    refine(atmsel)
+    if md:
+        refine(atmsel)
     cg = ConjugateGradients()
     cg.optimize(atmsel, max_iterations=200, min_atom_shift=0.001)
 
@@ -40,36 +61,7 @@ def make_restraints(mdl1, aln):
         rsr.make(s, restraint_type=typ+'_dihedral', spline_range=4.0,
                  spline_dx=0.3, spline_min_points=5, aln=aln, spline_on_site=True)
 
-def mutate_residue(modelname, chain, positions):
-    amino_acids = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", 
-                   "HIS", "ILE", "LEU", "LYS", "MET", "PHE", "PRO", "SER", 
-                   "THR", "TRP", "TYR", "VAL"]
-    
-    base_model = f"{modelname}.pdb"
-
-    # Create directories for outputs
-    mutants_dir = f"Mutants_{positions[0]}_{positions[1]}_{positions[2]}"
-    os.makedirs(mutants_dir, exist_ok=True)
-
-    # First level mutations
-    for res1 in amino_acids:
-        model1 = f"{modelname}_{res1}{positions[0]}"
-        shutil.copy(base_model, f"{model1}.pdb")
-
-        # Second level mutations
-        for res2 in amino_acids:
-            model2 = f"{model1}_{res2}{positions[1]}"
-            shutil.copy(f"{model1}.pdb", f"{model2}.pdb")
-
-            # Third level mutations
-            for res3 in amino_acids:
-                model3 = f"{model2}_{res3}{positions[2]}"
-                output_file = os.path.join(mutants_dir, f"{model3}.pdb")
-                generate_mutant(f"{model2}.pdb", positions[2], res3, chain, output_file)
-
-                print(f"Generated: {output_file}")
-
-def generate_mutant(input_model, respos, restyp, chain, output_file):
+def make_env():
     env = Environ(rand_seed=-49837)
     env.io.hetatm = True
     env.edat.dynamic_sphere = False
@@ -78,10 +70,206 @@ def generate_mutant(input_model, respos, restyp, chain, output_file):
     env.edat.update_dynamic = 0.39
     env.libs.topology.read(file='$(LIB)/top_heav.lib')
     env.libs.parameters.read(file='$(LIB)/par.lib')
+    return env
+
+# per-process MODELLER environment used to parse the cached wild types,
+# created once by init_worker; every mutant is built in its own environment
+_env = None
+
+def init_worker(scratch):
+    global _env, _scratch
+    _env = make_env()
+    _scratch = scratch
+
+# Mutants are built in memory: parents are copied once per worker into a
+# tmpfs scratch directory, their parsed wild-type model (used for residue
+# numbering) is cached, and the write/read round trip MODELLER needs to
+# refresh the topology stays in that scratch directory. Only the finished
+# structure touches the output (often network) file system.
+_scratch = None                 # set by init_worker
+_wild_types = OrderedDict()     # input file -> (scratch copy, parsed model)
+WILD_TYPE_CACHE_SIZE = 32
+fs_ops = Counter()              # file system operations on the output storage
+
+# shared-storage operations per mutant of the old build: read the input
+# twice, write, read and remove the .tmp file, write the result. The old
+# build only ran MODELLER for the final variants (its first two levels were
+# plain file copies, not counted here), so it is compared per variant built.
+SHARED_OPS_BEFORE = 6
+
+def make_scratch():
+    # RAM-backed where available; owned and removed by the parent process
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return tempfile.mkdtemp(prefix="mutants_", dir=base)
+
+def wild_type(input_model):
+    """Return (scratch copy, parsed model) of an input structure, reading the
+    input file only the first time a worker sees it."""
+    global _env
+    if _env is None:
+        _env = make_env()
+    if input_model in _wild_types:
+        _wild_types.move_to_end(input_model)
+        return _wild_types[input_model]
+    # the scratch directory is shared by all workers: the pid keeps their copies apart
+    local = os.path.join(_scratch, f"wt{os.getpid()}_{fs_ops['shared_reads']}_{os.path.basename(input_model)}")
+    shutil.copyfile(input_model, local)
+    fs_ops["shared_reads"] += 1
+    entry = (local, Model(_env, file=local))
+    _wild_types[input_model] = entry
+    if len(_wild_types) > WILD_TYPE_CACHE_SIZE:
+        old_local, old_model = _wild_types.popitem(last=False)[1]
+        os.remove(old_local)
+    return entry
+
+def variant_name(modelname, positions, residues):
+    return modelname + ''.join(f"_{res}{pos}" for res, pos in zip(residues, positions))
 
-    mdl1 = Model(env, file=input_model)
+def iter_variants(modelname, positions, mutants_dir, amino_acids=AMINO_ACIDS, only=None):
+    # yield (residues, output file) for every variant not written yet,
+    # restricted to the variant names in only if given
+    for residues in itertools.product(amino_acids, repeat=len(positions)):
+        if only is not None and variant_name(modelname, positions, residues) not in only:
+            continue
+        output_file = os.path.join(mutants_dir, variant_name(modelname, positions, residues) + ".pdb")
+        if os.path.isfile(output_file) and os.path.getsize(output_file) > 0:
+            continue
+        yield residues, output_file
+
+def build_node(task):
+    # worker: apply one substitution to an already built parent structure
+    parent_file, chain, respos, restyp, output_file, profile = task
+    partial = output_file + ".part"
+    ops_before = Counter(fs_ops)
+    t0 = time.time()
+    generate_mutant(parent_file, respos, restyp, chain, partial, profile)
+    seconds = time.time() - t0
+    # rename into place so an interrupted run never leaves a partial model
+    os.replace(partial, output_file)
+    return output_file, seconds, fs_ops - ops_before
+
+def plan_tree(modelname, positions, mutants_dir, amino_acids=AMINO_ACIDS, only=None):
+    """Return the prefix-tree nodes that still have to be built.
+
+    A node is a tuple of residues for the first k positions. Leaves (all
+    positions mutated) go to mutants_dir; intermediates such as X1 and X1Y2
+    are optimised once and kept as checkpoints in mutants_dir/intermediates,
+    so every variant sharing that prefix branches from the same structure.
+    Returns ({node: output file}, function mapping a node to its file).
+    """
+    checkpoint_dir = os.path.join(mutants_dir, "intermediates")
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def node_file(node):
+        name = variant_name(modelname, positions, node) + ".pdb"
+        if len(node) == len(positions):
+            return os.path.join(mutants_dir, name)
+        return os.path.join(checkpoint_dir, name)
+
+    needed = {}
+    for residues, output_file in iter_variants(modelname, positions, mutants_dir, amino_acids, only):
+        needed[residues] = output_file
+        parent = residues[:-1]
+        while parent and parent not in needed and not os.path.isfile(node_file(parent)):
+            needed[parent] = node_file(parent)
+            parent = parent[:-1]
+    return needed, node_file
+
+def mutate_residue(modelname, chain, positions, workers=None, profile="full-md", only=None):
+    if modelname.endswith(".pdb"):
+        modelname = modelname[:-4]
+    base_model = os.path.abspath(f"{modelname}.pdb")
+    positions = [str(pos) for pos in positions]
+    if profile not in REFINEMENT_PROFILES:
+        raise ValueError(f"unknown refinement profile {profile}, expected one of {REFINEMENT_PROFILES}")
+
+    # Create directories for outputs; cheaper profiles get their own directory
+    mutants_dir = f"Mutants_{'_'.join(positions)}"
+    if profile != "full-md":
+        mutants_dir += f"_{profile}"
+    os.makedirs(mutants_dir, exist_ok=True)
+
+    needed, node_file = plan_tree(modelname, positions, mutants_dir, only=only)
+    total = len(only) if only is not None else len(AMINO_ACIDS) ** len(positions)
+    leaves = sum(1 for node in needed if len(node) == len(positions))
+    print(f"{total - leaves} of {total} variants already built, {leaves} to go "
+          f"with {len(needed)} refinements ({leaves * len(positions)} without prefix reuse)")
+
+    # a node can start as soon as its parent (the base model for the first
+    # position) exists; children are submitted when their parent finishes
+    children = {}
+    for node in needed:
+        children.setdefault(node[:-1], []).append(node)
+
+    def task(node):
+        parent_file = base_model if len(node) == 1 else node_file(node[:-1])
+        return (parent_file, chain, positions[len(node)-1], node[-1], needed[node], profile)
+
+    manifest_file = os.path.join(mutants_dir, "manifest.csv")
+    new_manifest = not os.path.isfile(manifest_file)
+    manifest = open(manifest_file, "a", newline="")
+    writer = csv.writer(manifest)
+    if new_manifest:
+        writer.writerow(["structure", "position", "residue", "level", "profile", "seconds"])
+    build_times = []
+    variants_built = 0
+    shared_ops = Counter()
+
+    scratch = make_scratch()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(scratch,)) as pool:
+        running = {}
+        for node in needed:
+            if node[:-1] not in needed:
+                running[pool.submit(build_node, task(node))] = node
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                try:
+                    output_file, seconds, ops = future.result()
+                except Exception as e:
+                    print(f"Failed: {needed[node]}: {e}")
+                    continue
+                build_times.append(seconds)
+                shared_ops.update(ops)
+                writer.writerow([os.path.basename(output_file), positions[len(node)-1], node[-1],
+                                 len(node), profile, f"{seconds:.2f}"])
+                manifest.flush()
+                if len(node) == len(positions):
+                    variants_built += 1
+                    print(f"Generated: {output_file}")
+                for child in children.get(node, []):
+                    running[pool.submit(build_node, task(child))] = child
+
+    manifest.close()
+    shutil.rmtree(scratch, ignore_errors=True)
+    if build_times:
+        print(f"Profile {profile}: {len(build_times)} structures, {sum(build_times):.1f} CPU-seconds, "
+              f"{sum(build_times) / len(build_times):.2f} s per structure (manifest: {manifest_file})")
+        used = sum(shared_ops.values())
+        print(f"Shared file system operations: {used} "
+              f"({SHARED_OPS_BEFORE * variants_built - used} saved by building in memory)")
+
+def generate_mutant(input_model, respos, restyp, chain, output_file, profile="full-md"):
+    global _scratch
+    if _scratch is None:
+        # called outside the worker pool: use a scratch directory for this
+        # call only and remove it, with the wild types cached in it, afterwards
+        _scratch = make_scratch()
+        try:
+            return generate_mutant(input_model, respos, restyp, chain, output_file, profile)
+        finally:
+            shutil.rmtree(_scratch, ignore_errors=True)
+            _scratch = None
+            _wild_types.clear()
+    # a fresh environment per mutant keeps the random seed, and therefore
+    # the model, independent of which worker builds it and in what order
+    env = make_env()
+
+    local_input, wt = wild_type(input_model)
+    mdl1 = Model(env, file=local_input)
     ali = Alignment(env)
-    ali.append_model(mdl1, atom_files=input_model, align_codes=input_model)
+    ali.append_model(mdl1, atom_files=local_input, align_codes=input_model)
 
     s = Selection(mdl1.chains[chain].residues[respos])
     s.mutate(residue_type=restyp)
@@ -92,11 +280,20 @@ def generate_mutant(input_model, respos, restyp, chain, output_file):
     mdl1.transfer_xyz(ali)
     mdl1.build(initialize_xyz=False, build_method='INTERNAL_COORDINATES')
 
-    mdl2 = Model(env, file=input_model)
-    mdl1.res_num_from(mdl2, ali)
+    mdl1.res_num_from(wt, ali)
+
+    # build-only keeps the side chain as built from internal coordinates:
+    # no restraints, schedule or optimisation are set up for it
+    if profile == "build-only":
+        mdl1.write(file=output_file)
+        fs_ops["shared_writes"] += 1
+        return
 
-    mdl1.write(file=f"{input_model}.tmp")
-    mdl1.read(file=f"{input_model}.tmp")
+    # MODELLER only refreshes topology-derived data (internal coordinates,
+    # charges, atom types) on reading, so round-trip through scratch memory
+    scratch_file = os.path.join(_scratch, f"{os.getpid()}.tmp")
+    mdl1.write(file=scratch_file)
+    mdl1.read(file=scratch_file)
     make_restraints(mdl1, ali)
 
     mdl1.env.edat.nonbonded_sel_atoms = 1
@@ -107,25 +304,33 @@ def generate_mutant(input_model, respos, restyp, chain, output_file):
     mdl1.restraints.pick(s)
 
     s.energy()
+    md = profile == "full-md"
     s.randomize_xyz(deviation=4.0)
     mdl1.env.edat.nonbonded_sel_atoms = 2
-    optimize(s, sched)
+    optimize(s, sched, md)
     mdl1.env.edat.nonbonded_sel_atoms = 1
-    optimize(s, sched)
+    optimize(s, sched, md)
     s.energy()
 
     mdl1.write(file=output_file)
-    os.remove(f"{input_model}.tmp")
+    fs_ops["shared_writes"] += 1
+    os.remove(scratch_file)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 6:
-        print("Usage: python script.py modelname chain start_pos mid_pos end_pos")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Build the combinatorial mutant library of a 3-residue motif")
+    parser.add_argument("modelname")
+    parser.add_argument("chain")
+    parser.add_argument("positions", type=int, nargs=3, metavar="pos")
+    parser.add_argument("workers", type=int, nargs="?", default=None)
+    parser.add_argument("--profile", choices=REFINEMENT_PROFILES, default="full-md",
+                        help="how much refinement every mutant gets")
+    parser.add_argument("--only", default=None,
+                        help="file with the variant names (one per line, no .pdb) to build, e.g. the top hits of a coarse pass")
+    args = parser.parse_args()
 
-    modelname = sys.argv[1]
-    chain = sys.argv[2]
-    start_pos = int(sys.argv[3])
-    mid_pos = int(sys.argv[4])
-    end_pos = int(sys.argv[5])
+    only = None
+    if args.only:
+        with open(args.only) as f:
+            only = {os.path.splitext(os.path.basename(line.strip()))[0] for line in f if line.strip()}
 
-    mutate_residue(modelname, chain, [start_pos, mid_pos, end_pos])
+    mutate_residue(args.modelname, args.chain, args.positions, args.workers, args.profile, only)
@@ -18,11 +18,15 @@
 # Notes: 
 # Example: pyscript_name.py --pdb_filename my_protein.pdb --mutant_aa V --trials 3
 # This analyzes 'my_protein.pdb', mutate residues to valine, and perform 3 trials.
-# ...may need to take out --PyMOLMover_ip=off 
+# --PyMOLMover_ip=off (default) runs headless; use on or host[:port], plus --PyMOL_every=N, to watch a scan in PyMOL
 ########
 
 from __future__ import print_function
+import csv
+import time
+import zlib
 import optparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from rosetta import *
 from rosetta.protocols.scoring import Interface
@@ -30,97 +34,274 @@ from pyrosetta import *
 from pyrosetta.rosetta.protocols import docking
 from pyrosetta import protocols
 from pyrosetta.rosetta.protocols.minimization_packing import PackRotamersMover
+from pyrosetta.rosetta.protocols.rigid import RigidBodyTransMover
+from pyrosetta.rosetta.core.select.residue_selector import ResidueIndexSelector, NotResidueSelector
+from pyrosetta.rosetta.numeric.random import rg
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:    # scipy is optional, NeighbourIndex falls back to NumPy
+    cKDTree = None
+from pymol_view import setup_pymol, show_pose
 # importing in programs needed for amino acid scanning
 
 init() # (extra options = "-seed ####") also an option
 scorefxn = get_fa_scorefxn()
 print(scorefxn)
-import os; os.chdir('.test.output')
+import os
+
 
 def scanning(pdb_filename, partners, mutant_aa_list = ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y'], 
         interface_cutoff = 8.0, output = False,
-        trials = 1, trial_output = ''):
-## performs the scanning, repacks the necessary residues, and subtracts the score of the pose along with the partners of the docking    
-    for mutant_aa in mutant_aa_list:
-        
-        pose = Pose()
-        pose_from_file(pose, pdb_filename)
-            
-        dock_jump = 1
-        movable_jumps = Vector1([dock_jump])
-        
-        docking.setup_foldtree(pose, partners, movable_jumps)
-
-
-        scorefxn = get_fa_scorefxn() #  create_score_function('standard')
-        pack_scorefxn = get_fa_scorefxn() #add pack_scorefxn definition here
-        
-        scorefxn(pose)    # needed for proper Interface calculation
-
-        ddG_scorefxn = ScoreFunction()
-        ddG_scorefxn.set_weight(core.scoring.fa_atr, 0.44)
-        ddG_scorefxn.set_weight(core.scoring.fa_rep, 0.07)
-        ddG_scorefxn.set_weight(core.scoring.fa_sol, 1.0)
-        ddG_scorefxn.set_weight(core.scoring.hbond_bb_sc, 0.5)
-        ddG_scorefxn.set_weight(core.scoring.hbond_sc, 1.0)
+        trials = 1, trial_output = '', workers = None, pymol_ip = 'off', pymol_every = 1,
+        interface_source = 'rosetta', contact_cutoff = 5.0, seed = 0):
+## performs the scanning, repacks the necessary residues, and subtracts the score of the pose along with the partners of the docking
+## The pose is loaded and set up once. The wild-type binding energy of each interface position does not depend on the
+## mutant, so it is computed once per position; the (position, amino acid, trial) grid then runs on a pool of workers,
+## each holding its own copy of the pose. Workers only talk to PyMOL when pymol_ip is set (see setup_pymol).
+## interface_source = 'numpy' picks the positions with interface.py (residues with an atom within contact_cutoff
+## of the partner) instead of Rosetta's Interface, the same prefilter used ahead of mutant building and PRODIGY/DockQ.
+## Every task reseeds the Rosetta random number generator from seed and its (position, amino acid, trial) cell
+## (see seed_task), so trials differ from each other and a result does not depend on which worker computed it.
+    setup_pymol(pymol_ip, pymol_every)
+    pose, movable_jumps, scorefxn, pack_scorefxn = setup_pose(pdb_filename, partners)
 
+    ## for visualization
+    show_pose(pose, always = True)
 
-        interface = Interface(dock_jump)
+    if interface_source == 'numpy':
+        positions = numpy_interface_positions(pose, pdb_filename, partners, contact_cutoff)
+    else:
+        interface = Interface(movable_jumps[1])
         interface.distance(interface_cutoff)
         interface.calculate(pose)
+        positions = [i for i in range(1, pose.total_residue() + 1) if interface.is_interface(i)]
+    print( 'Scanning', len(positions), 'interface positions x', len(mutant_aa_list), 'amino acids x', trials, 'trials' )
+
+    ## results are appended to one table as they arrive; cells already in it are not redone
+    store = ResultStore(trial_output + '_ddG.csv', seed, interface_cutoff)
+    labels = {i: (pose.sequence()[i - 1], str(pose.pdb_info().number(i)) + pose.pdb_info().chain(i))
+              for i in positions}
+    todo = [(i, mutant_aa, trial) for i in positions for mutant_aa in mutant_aa_list
+            for trial in range(1, trials + 1) if (i, mutant_aa, trial) not in store.done]
+    print( len(store.done), 'results already in', store.filename + ',', len(todo), 'to go' )
+
+    wt_scores = dict(store.wt_scores)
+    pending = {}    # mutant results waiting for the wild type of their position
+    with ProcessPoolExecutor(workers, initializer = init_worker,
+            initargs = (pdb_filename, partners, pymol_ip, pymol_every, seed)) as pool:
+        futures = {}
+        for i in sorted(set(cell[0] for cell in todo) - set(wt_scores)):
+            futures[pool.submit(score_wild_type, i, interface_cutoff)] = (i, None, None)
+        for i, mutant_aa, trial in todo:
+            filename = ''
+            if output:
+                filename = pose.pdb_info().name()[:-4] + '_' + pose.sequence()[i-1] + str(pose.pdb_info().number(i)) + '->' + mutant_aa
+                if trials > 1:
+                    filename += '_' + str(trial)
+            futures[pool.submit(score_mutant, i, mutant_aa, trial, interface_cutoff, filename)] = (i, mutant_aa, trial)
+        for future in as_completed(futures):
+            i, mutant_aa, trial = futures[future]
+            if mutant_aa is None:
+                wt_scores[i] = future.result()
+                for cell, result in pending.pop(i, []):
+                    store.add(cell, labels[i], wt_scores[i], result)
+            elif i in wt_scores:
+                store.add((i, mutant_aa, trial), labels[i], wt_scores[i], future.result())
+            else:
+                pending.setdefault(i, []).append(((i, mutant_aa, trial), future.result()))
+    store.close()
 
-    ## for visualization
-        pymover = PyMOLMover()
-        pymover.keep_history(True)    # for multiple trajectories
-        pymover.apply(pose)
-        pymover.send_energy(pose)
-
-
-        for trial in range( trials ):
-
-            ddG_mutants = {}
-            for i in range(1, pose.total_residue() + 1): 
-
-                if interface.is_interface(i):
-                    filename = ''
-                    if output:
-                        filename = pose.pdb_info().name()[:-4] + '_' + pose.sequence()[i-1] + str(pose.pdb_info().number(i)) + '->' + mutant_aa
-
-                    ddG_mutants[i] = interface_ddG(pose, i, mutant_aa,
-                        movable_jumps, scorefxn, interface_cutoff, filename, pack_scorefxn ) # Pass pack_scorefxn here
 ## determines interface score changes upon mutation
-            # output results
-            print( '='*80 )
-            print( 'Trial', str( trial + 1 ) )
-            print( 'Mutants (PDB numbered)\t\"ddG\" (interaction dependent score change)' )
-            residues = list( ddG_mutants.keys() )  # list(...) conversion is for python3 compatbility
-            residues.sort()    # easier to read
-            display = [pose.sequence()[i - 1] +
-                str(pose.pdb_info().number(i)) + mutant_aa + '\t' +
-                str(ddG_mutants[i]) + '\n'
-                for i in residues]
-            print( ''.join(display)[:-1] )
-            print( '='*80 )
-
-            # write to file
-            f = open(trial_output + '_' + str(trial + 1) + "_" + str(mutant_aa) + '.txt' , 'w' )
-            f.writelines(display)
-            f.close()
-
-
-        print( 'Likely Hotspot Residues' )
-        for hotspot in scanning_analysis(trial_output):
-            print( hotspot )
-        print( '='*80 )
+    print( '='*80 )
+    print( 'Position\tmean ddG\tstd\t(over mutants and trials)' )
+    for position, stats in sorted(store.by_position.items()):
+        print( position + '\t' + '%.3f' % stats.mean + '\t' + '%.3f' % stats.std )
+    print( '='*80 )
+    print( 'Likely Hotspot Residues' )
+    for hotspot in store.hotspots():
+        print( hotspot )
+    print( '='*80 )
+
+
+class RunningStats:
+## mean and (population) standard deviation updated one value at a time (Welford)
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self):
+        return (self.m2 / self.n) ** .5 if self.n else 0.0
+
+
+class ResultStore:
+## One row per (position, mutant, trial) cell, appended and flushed as results arrive.
+## Reopening an existing table loads its cells (so a scan can resume) and its wild-type
+## scores, and replays them into the per-position and per-mutant statistics. Each row
+## records the seed and interface cutoff it was computed with; resuming a table with
+## different ones is refused, since the old and new trials would not be comparable.
+## A last row cut short by a crash is dropped (and cut from the file) before appending.
+## readonly = True only loads the table, for analysis; settings are then not checked.
+    COLUMNS = ['position', 'pdb_residue', 'wt', 'mutant', 'trial', 'ddG',
+               'wt_score', 'mut_score', 'wt_seconds', 'mut_seconds', 'seed', 'cutoff']
+
+    def __init__(self, filename, seed = 0, cutoff = 8.0, readonly = False):
+        self.filename = filename
+        self.settings = (str(seed), repr(float(cutoff)))
+        self.done = set()
+        self.wt_scores = {}
+        self.by_position = {}    # e.g. 'D45B' -> RunningStats over mutants and trials
+        self.by_mutant = {}      # e.g. 'D45BA' -> RunningStats over trials
+        self.file = None
+        good = self._load(readonly) if os.path.isfile(filename) else 0
+        if readonly:
+            return
+        if os.path.isfile(filename) and os.path.getsize(filename) > good:
+            print( 'Dropping the incomplete last row of', filename )
+            os.truncate(filename, good)
+        self.file = open(filename, 'a', newline = '')
+        self.writer = csv.writer(self.file)
+        if good == 0:
+            self.writer.writerow(self.COLUMNS)
+
+    def _load(self, readonly):
+        ## replays the complete rows and returns the size in bytes of the part of the file they fill
+        filename = self.filename
+        with open(filename, newline = '') as f:
+            lines = f.readlines()
+        if not lines or len(lines) == 1 and ','.join(self.COLUMNS).startswith(lines[0].rstrip('\r\n')) \
+                and not lines[0].endswith('\n'):
+            return 0    # empty, or cut short while writing the header
+        header = next(csv.reader(lines[:1]))
+        if header != self.COLUMNS:
+            raise ValueError('%s has columns %s, expected %s' % (filename, ','.join(header), ','.join(self.COLUMNS)))
+        good = len(lines[0].encode())
+        for number, line in enumerate(lines[1:], 2):
+            try:
+                if not line.endswith('\n'):
+                    raise ValueError('no line end')
+                fields = next(csv.reader([line]))
+                if len(fields) != len(self.COLUMNS):
+                    raise ValueError('%d of %d fields' % (len(fields), len(self.COLUMNS)))
+                row = dict(zip(self.COLUMNS, fields))
+                cell = (int(row['position']), row['mutant'], int(row['trial']))
+                wt_score = (float(row['wt_score']), float(row['wt_seconds']))
+                ddg = float(row['ddG'])
+            except ValueError as error:
+                if number < len(lines):
+                    raise ValueError('%s line %d is malformed (%s)' % (filename, number, error))
+                break    # last row, cut short by a crash
+            if not readonly and (row['seed'], row['cutoff']) != self.settings:
+                raise ValueError('%s was computed with seed %s and cutoff %s, not seed %s and cutoff %s; '
+                                 'use another --trial_output or the same settings to resume it'
+                                 % ((filename, row['seed'], row['cutoff']) + self.settings))
+            self.done.add(cell)
+            self.wt_scores[cell[0]] = wt_score
+            self._update(row['wt'], row['pdb_residue'], row['mutant'], ddg)
+            good += len(line.encode())
+        return good
+
+    def _update(self, wt, pdb_residue, mutant, ddg):
+        position = wt + pdb_residue
+        self.by_position.setdefault(position, RunningStats()).add(ddg)
+        self.by_mutant.setdefault(position + mutant, RunningStats()).add(ddg)
+
+    def add(self, cell, label, wt_result, mut_result):
+        i, mutant_aa, trial = cell
+        (wt, pdb_residue), (wt_score, wt_seconds), (mut_score, mut_seconds) = label, wt_result, mut_result
+        ddg = mut_score - wt_score
+        self.writer.writerow([i, pdb_residue, wt, mutant_aa, trial, ddg,
+                              wt_score, mut_score, '%.3f' % wt_seconds, '%.3f' % mut_seconds] + list(self.settings))
+        self.file.flush()
+        self.done.add(cell)
+        self._update(wt, pdb_residue, mutant_aa, ddg)
+
+    def hotspots(self):
+        ## mutations whose trial-averaged ddG is more than one std away from the mean over all mutations
+        means = RunningStats()
+        for stats in self.by_mutant.values():
+            means.add(stats.mean)
+        return [mutation for mutation, stats in sorted(self.by_mutant.items())
+                if abs(stats.mean - means.mean) > means.std]
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def numpy_interface_positions(pose, pdb_filename, partners, cutoff = 5.0):
+## pose indices of the residues of both partners found by interface.py
+    from interface import interface_positions
+    group_a, group_b = [','.join(side) for side in partners.split('_')]
+    side_a, side_b = interface_positions(pdb_filename, group_a, group_b, cutoff)
+    positions = []
+    for chain, resi, resn in side_a + side_b:
+        number, icode = (resi[:-1], resi[-1]) if resi[-1].isalpha() else (resi, ' ')
+        i = pose.pdb_info().pdb2pose(chain, int(number), icode)
+        if i:
+            positions.append(i)
+    return sorted(positions)
+
+
+def setup_pose(pdb_filename, partners):
+## loads the complex and sets up the docking fold tree and score functions
+    pose = Pose()
+    pose_from_file(pose, pdb_filename)
+
+    dock_jump = 1
+    movable_jumps = Vector1([dock_jump])
+
+    docking.setup_foldtree(pose, partners, movable_jumps)
+
+    scorefxn = get_fa_scorefxn() #  create_score_function('standard')
+    pack_scorefxn = get_fa_scorefxn() #add pack_scorefxn definition here
+
+    scorefxn(pose)    # needed for proper Interface calculation
+    return pose, movable_jumps, scorefxn, pack_scorefxn
+
+
+## per-worker copy of the set-up pose, loaded once by init_worker
+_worker = {}
+
+def init_worker(pdb_filename, partners, pymol_ip = 'off', pymol_every = 1, seed = 0):
+    setup_pymol(pymol_ip, pymol_every)
+    _worker['seed'] = seed
+    _worker['pose'], _worker['movable_jumps'], _worker['scorefxn'], _worker['pack_scorefxn'] = \
+        setup_pose(pdb_filename, partners)
+    _worker['neighbours'] = NeighbourIndex(_worker['pose'])
+
+## forked workers start with the same Rosetta random state, so each task reseeds it from its own cell
+def seed_task(mutant_position, mutant_aa = '', trial = 0):
+    cell = '%d:%d:%s:%d' % (_worker['seed'], mutant_position, mutant_aa, trial)
+    rg().set_seed(zlib.crc32(cell.encode()) & 0x7fffffff)
+
+## both return (score, seconds)
+def score_wild_type(mutant_position, cutoff):
+    seed_task(mutant_position)
+    t0 = time.time()
+    score = calc_binding_energy(_worker['pose'], _worker['scorefxn'],
+        mutant_position, cutoff, _worker['pack_scorefxn'], _worker['neighbours'])
+    return score, time.time() - t0
+
+def score_mutant(mutant_position, mutant_aa, trial, cutoff, out_filename):
+    seed_task(mutant_position, mutant_aa, trial)
+    t0 = time.time()
+    score = mutant_binding_energy(_worker['pose'], mutant_position, mutant_aa,
+        _worker['scorefxn'], cutoff, out_filename, _worker['pack_scorefxn'], _worker['neighbours'])
+    return score, time.time() - t0
 
 
 def interface_ddG( pose, mutant_position, mutant_aa, movable_jumps, scorefxn = None,
-        cutoff = 8.0, out_filename = '', pack_scorefxn=None):
-    # 1. create a reference copy of the pose
-    wt = Pose()    # the "wild-type"
-    wt.assign(pose)
-
-    # 2. setup a specific default ScoreFunction
+        cutoff = 8.0, out_filename = '', pack_scorefxn=None, wt_score = None):
+    # 1. setup a specific default ScoreFunction
     if not scorefxn:
         scorefxn = get_fa_scorefxn()
 
@@ -131,38 +312,72 @@ def interface_ddG( pose, mutant_position, mutant_aa, movable_jumps, scorefxn = N
         scorefxn.set_weight(hbond_bb_sc, 0.5)
         scorefxn.set_weight(hbond_sc, 1.0)
 
+    # 2. the wild-type binding energy can be passed in when it is shared
+    #    by several mutations at the same position
+    neighbours = NeighbourIndex(pose)
+    if wt_score is None:
+        wt_score = calc_binding_energy(pose, scorefxn,
+            mutant_position, cutoff, pack_scorefxn, neighbours)
+    mut_score = mutant_binding_energy(pose, mutant_position, mutant_aa,
+        scorefxn, cutoff, out_filename, pack_scorefxn, neighbours)
 
-    mutant = Pose()
-    mutant.assign(pose)
+    ddg = mut_score - wt_score
 
+    return ddg
 
-    mutant = mutate_residue(mutant, mutant_position, mutant_aa,
-        0.0, pack_scorefxn)
 
+def mutant_binding_energy(pose, mutant_position, mutant_aa, scorefxn,
+        cutoff = 8.0, out_filename = '', pack_scorefxn = None, neighbours = None):
+    # mutate_residue works on a copy, so the pose is left untouched
+    if neighbours is None:
+        neighbours = NeighbourIndex(pose)
+    mutant = mutate_residue(pose, mutant_position, mutant_aa,
+        0.0, pack_scorefxn, neighbours)
 
-    wt_score = calc_binding_energy(wt, scorefxn,
-        mutant_position, cutoff, pack_scorefxn)
     mut_score = calc_binding_energy(mutant, scorefxn,
-        mutant_position, cutoff, pack_scorefxn)
-
-    ddg = mut_score - wt_score
+        mutant_position, cutoff, pack_scorefxn, neighbours)
 
     mutant.pdb_info().name( pose.sequence()[mutant_position -1] +
         str( pose.pdb_info().number(mutant_position)) +
         mutant.sequence()[mutant_position - 1])
-    pymover = PyMOLMover()
-    scorefxn(mutant)
-    pymover.apply(mutant)
-    pymover.send_energy(mutant)
+    show_pose(mutant, scorefxn)
 
     if out_filename:
         mutant.dump_pdb(out_filename)
 
-    return ddg
+    return mut_score
+
+
+class NeighbourIndex:
+## Spatial index over the neighbour atoms (nbr_atom_xyz) of every residue, built once per pose and
+## reused for every repack shell. Mutating or repacking one residue leaves the neighbour atoms of all
+## the others in place, so the index of the wild-type pose also serves its mutants: queries take the
+## current center coordinates and callers always include the center residue itself.
+## Uses scipy's cKDTree when available, otherwise one vectorised NumPy distance scan per query.
+    def __init__(self, pose):
+        self.xyz = np.array([[v.x, v.y, v.z] for v in
+                             (pose.residue(i).nbr_atom_xyz() for i in range(1, pose.total_residue() + 1))])
+        self.tree = cKDTree(self.xyz) if cKDTree is not None else None
+
+    def within(self, center, cutoff):
+        ## pose (1-based) indices of the residues whose neighbour atom is within cutoff of center
+        center = np.array([center.x, center.y, center.z])
+        if self.tree is not None:
+            hits = self.tree.query_ball_point(center, cutoff)
+        else:
+            hits = np.flatnonzero(((self.xyz - center) ** 2).sum(axis = 1) <= cutoff ** 2)
+        return set(int(i) + 1 for i in hits)
+
+    def mask(self, residues):
+        ## residue set as the vector1_bool PackerTask.restrict_to_residues expects
+        flags = rosetta.utility.vector1_bool()
+        for i in range(1, len(self.xyz) + 1):
+            flags.append(i in residues)
+        return flags
 
 
 def mutate_residue(pose, mutant_position, mutant_aa,
-        pack_radius = 0.0, pack_scorefxn = None):
+        pack_radius = 0.0, pack_scorefxn = None, neighbours = None):
 
 
 
@@ -195,13 +410,12 @@ def mutate_residue(pose, mutant_position, mutant_aa,
     task.nonconst_residue_task(mutant_position
         ).restrict_absent_canonical_aas(aa_bool)
 
-    
-    center = pose.residue(mutant_position).nbr_atom_xyz()
-    for i in range(1, pose.total_residue() + 1):
-        # only pack the mutating residue and any within the pack_radius
-        if not i == mutant_position or center.distance_squared(
-                test_pose.residue(i).nbr_atom_xyz()) > pack_radius**2:
-            task.nonconst_residue_task(i).prevent_repacking()
+    # only pack the mutating residue and any within the pack_radius
+    if neighbours is None:
+        neighbours = NeighbourIndex(pose)
+    shell = neighbours.within(pose.residue(mutant_position).nbr_atom_xyz(), pack_radius)
+    shell.add(mutant_position)
+    task.restrict_to_residues(neighbours.mask(shell))
 
 
     ## packer = protocols.simple_moves.PackRotamersMover(pack_scorefxn, task) from original script
@@ -210,7 +424,7 @@ def mutate_residue(pose, mutant_position, mutant_aa,
 
     return test_pose
 
-def calc_binding_energy(pose, scorefxn, center, cutoff = 8.0, pack_scorefxn=None):
+def calc_binding_energy(pose, scorefxn, center, cutoff = 8.0, pack_scorefxn=None, neighbours=None, dock_jump=1):
     # create a copy of the pose for manipulation
     if pack_scorefxn is None: 
         pack_scorefxn = get_fa_scorefxn()
@@ -223,18 +437,16 @@ def calc_binding_energy(pose, scorefxn, center, cutoff = 8.0, pack_scorefxn=None
     tf.push_back(core.pack.task.operation.RestrictToRepacking())    # restrict it to repacking
 
 
-    prevent_repacking = core.pack.task.operation.PreventRepacking()
-
-    
-    center = test_pose.residue(center).nbr_atom_xyz()
-    for i in range(1, test_pose.total_residue() + 1):
-        
-        if center.distance_squared(
-                test_pose.residue(i).nbr_atom_xyz()) > cutoff**2:
-            prevent_repacking.include_residue(i)
+    # residues outside the cutoff are not repacked
+    if neighbours is None:
+        neighbours = NeighbourIndex(test_pose)
+    shell = neighbours.within(test_pose.residue(center).nbr_atom_xyz(), cutoff)
+    shell.add(center)
+    outside = NotResidueSelector(ResidueIndexSelector(','.join(str(i) for i in sorted(shell))))
 
     # apply these settings to the TaskFactory
-    tf.push_back(prevent_repacking)
+    tf.push_back(core.pack.task.operation.OperateOnResidueSubset(
+        core.pack.task.operation.PreventRepackingRLT(), outside))
 
     # setup a PackRotamersMover, optimizes side-chain conformations
     ## packer = protocols.simple_moves.PackRotamersMover(scorefxn) from og script
@@ -247,17 +459,11 @@ def calc_binding_energy(pose, scorefxn, center, cutoff = 8.0, pack_scorefxn=None
 
     before = scorefxn(test_pose)
 
-    xyz = rosetta.numeric.xyzVector_double_t()    # a Vector for coordinates
-    xyz.x = 500.0    # arbitrary separation magnitude, in the x direction; may need to be adjusted?
-    xyz.y = 0.0    #...I didn't have this and it defaulted to 1e251...?
-    xyz.z = 0.0    #...btw thats like 1e225 light years,
-                   #    over 5e245 yrs at Warp Factor 9.999 (thanks M. Pacella)
-
-    chain2starts = len(pose.chain_sequence(1)) + 1
-    for r in range(chain2starts, test_pose.total_residue() + 1):
-        for a in range(1, test_pose.residue(r).natoms() + 1):
-            test_pose.residue(r).set_xyz(a,
-                test_pose.residue(r).xyz(a) + xyz)
+    # separate the partners by an arbitrary 500 A in one rigid-body move along the docking
+    # jump (set up by setup_pose), instead of a set_xyz call for every atom of chain 2
+    separate = RigidBodyTransMover(test_pose, dock_jump)
+    separate.step_size(500.0)
+    separate.apply(test_pose)
 
     
     packer.apply(test_pose)
@@ -265,88 +471,78 @@ def calc_binding_energy(pose, scorefxn, center, cutoff = 8.0, pack_scorefxn=None
     # return the change in score
     return before - scorefxn(test_pose)
 
-## Averages ddg values gives mutations >1 Std away from the mean
+## Averages ddg values over trials, gives mutations >1 Std away from the mean
 def scanning_analysis(trial_output):
-
-    # extract all files
-    filenames = os.listdir(os.getcwd())
-    
-    filenames =[i for i in filenames if trial_output in i]
-
-
-    filename = filenames[0]
-    f = open(filename , 'r')
-    data = f.readlines()
-    data = [i.strip() for i in data]    # remove "\n"
-    f.close()
-
-
-    mutants = [i.split('\t')[0] for i in data]
-    ddg = [float(i.split('\t')[1]) for i in data]
-
-
-    for filename in filenames[1:]:
-        f = open( filename , 'r' )
-        data = f.readlines()
-        data = [i.strip() for i in data]
-        f.close()
-
-        ddg = [float(data[i].split('\t')[1])+ddg[i] for i in range(len(data))]
-
-
-    ddg = [i/len(filenames) for i in ddg]
-
-
-    mean = sum(ddg)/len(ddg)
-
-    std = [(i-mean)**2 for i in ddg]
-    std = (sum(std)/len(std))**.5
-
-    significant = [i for i in range(len(ddg)) if abs(ddg[i]-mean)>std]
-
-    hotspots = [mutants[i] for i in significant]
-
-    return hotspots
-
-parser = optparse.OptionParser()
-parser.add_option('--pdb_filename', dest = 'pdb_filename',
-    default = '../test/data/test_dock.pdb',    # default example PDB
-    help = 'the PDB file containing the protein to refine')
-
-parser.add_option('--partners', dest = 'partners',
-    default = 'A_B',    # default for the example test_dock.pdb
-    help = 'the relative chain partners for docking')
-# scanning options
-# parser.add_option('--mutant_aa', dest = 'mutant_aa',
-#     default = 'A',    # default to alanine, A
-#     help = 'the amino acid to mutate all residues to')
-parser.add_option('--interface_cutoff', dest = 'interface_cutoff',
-    default = '8.0',    # default to 8.0 Angstroms
-    help = 'the distance (in Angstroms) to detect residues for repacking\
-        near the interface')
-parser.add_option('--output', dest = 'output',
-    default = '',    # default off, do now write to file
-    help = 'if True, mutant structures are written to PDB files')
-# trials options
-parser.add_option('--trials', dest='trials',
-    default = '1',    # default to single trial for speed
-    help = 'the number of trials to perform')
-parser.add_option('--trial_output', dest = 'trial_output',
-    default = 'ddG_out',    # if a specific output name is desired
-    help = 'the name preceding all output files')
-(options,args) = parser.parse_args()
-
-# PDB file option
-pdb_filename = options.pdb_filename
-partners = options.partners
-# scanning options
-# mutant_aa = options.mutant_aa
-mutantList=['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
-interface_cutoff = float(options.interface_cutoff)
-output = bool(options.output)
-# trials options
-trials = int(options.trials)
-trial_output = options.trial_output
-
-scanning(pdb_filename, partners, mutantList,
-    interface_cutoff, output, trials, trial_output)
\ No newline at end of file
+    store = ResultStore(trial_output + '_ddG.csv', readonly = True)
+    return store.hotspots()
+
+if __name__ == '__main__':
+    os.chdir('.test.output')
+
+    parser = optparse.OptionParser()
+    parser.add_option('--pdb_filename', dest = 'pdb_filename',
+        default = '../test/data/test_dock.pdb',    # default example PDB
+        help = 'the PDB file containing the protein to refine')
+
+    parser.add_option('--partners', dest = 'partners',
+        default = 'A_B',    # default for the example test_dock.pdb
+        help = 'the relative chain partners for docking')
+    # scanning options
+    # parser.add_option('--mutant_aa', dest = 'mutant_aa',
+    #     default = 'A',    # default to alanine, A
+    #     help = 'the amino acid to mutate all residues to')
+    parser.add_option('--interface_cutoff', dest = 'interface_cutoff',
+        default = '8.0',    # default to 8.0 Angstroms
+        help = 'the distance (in Angstroms) to detect residues for repacking\
+            near the interface')
+    parser.add_option('--output', dest = 'output',
+        default = '',    # default off, do now write to file
+        help = 'if True, mutant structures are written to PDB files')
+    # trials options
+    parser.add_option('--trials', dest='trials',
+        default = '1',    # default to single trial for speed
+        help = 'the number of trials to perform')
+    parser.add_option('--trial_output', dest = 'trial_output',
+        default = 'ddG_out',    # if a specific output name is desired
+        help = 'the name of the results table, <trial_output>_ddG.csv; an existing table is resumed')
+    parser.add_option('--interface', dest = 'interface',
+        default = 'rosetta',    # Rosetta Interface(dock_jump) with interface_cutoff
+        help = 'rosetta, or numpy to pick the positions to scan with interface.py')
+    parser.add_option('--contact_cutoff', dest = 'contact_cutoff',
+        default = '5.0',    # atom-atom contact distance for --interface=numpy
+        help = 'the atom-atom distance (in Angstroms) defining interface residues with --interface=numpy')
+    parser.add_option('--seed', dest = 'seed',
+        default = '0',    # same results on every run
+        help = 'base seed of the per-task Rosetta random number generator')
+    parser.add_option('--workers', dest = 'workers',
+        default = '0',    # default to one worker per core
+        help = 'the number of worker processes scoring mutations in parallel')
+    parser.add_option('--PyMOLMover_ip', dest = 'PyMOLMover_ip',
+        default = 'off',    # default headless, nothing is sent to PyMOL
+        help = 'off, on (local PyMOL) or host[:port] of the PyMOL listener')
+    parser.add_option('--PyMOL_every', dest = 'PyMOL_every',
+        default = '1',    # with PyMOL on, send every mutant
+        help = 'send only every Nth mutant to PyMOL')
+    (options,args) = parser.parse_args()
+
+    # PDB file option
+    pdb_filename = options.pdb_filename
+    partners = options.partners
+    # scanning options
+    # mutant_aa = options.mutant_aa
+    mutantList=['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y']
+    interface_cutoff = float(options.interface_cutoff)
+    output = bool(options.output)
+    # trials options
+    trials = int(options.trials)
+    trial_output = options.trial_output
+    workers = int(options.workers) or None
+    pymol_ip = options.PyMOLMover_ip
+    pymol_every = int(options.PyMOL_every)
+    interface_source = options.interface
+    contact_cutoff = float(options.contact_cutoff)
+    seed = int(options.seed)
+
+    scanning(pdb_filename, partners, mutantList,
+        interface_cutoff, output, trials, trial_output, workers, pymol_ip, pymol_every,
+        interface_source, contact_cutoff, seed)
@@ -4,6 +4,8 @@
 ## Make sure ADCP is accessible: Ensure that the adcp executable is in your system's PATH, or modify the adcp_command list in the run_adcp_on_trg function with the correct path to your adcp executable.
 ## Run the script: Execute the script from the command line using python ADCPdock.py.
 ## This comprehensive script will first generate .trg files from your .pdbqt files and then loop through each .trg file, running the ADCP docking simulation on each one. It provides error handling and clearer organization than previous attempts. Remember to adjust the directory paths to match your setup.
+## Campaign mode: python ADCPdock.py --campaign --maxCores 64 runs every (target, run) pair from one core pool and writes each ligand's runs to <results_dir>/<ligand>/.
+## Check of the .out log parsing (see parse_final_energy): python -m doctest ADCPdock.py
 ## adapted from: Michel F. SANNER https://github.com/ccsb-scripps/ADCP/blob/master/runADCP.py
 
 import os
@@ -12,11 +14,442 @@ import subprocess
 import glob
 import shutil
 import csv
-from time import time, sleep
+from time import time
 import argparse
 import random
+import signal
+import zlib
 import numpy
 import datetime
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+try:
+    import fcntl
+except ImportError:    # Windows: the map cache is used without a lock
+    fcntl = None
+
+class ADCPScheduler:
+    """Run ADCP child processes on at most ncores cores.
+
+    Every core is served by a thread that blocks on its child's exit, so the
+    next queued run is started the moment a running one finishes instead of
+    on the next tick of a polling loop. Runs start in submission order.
+    """
+
+    def __init__(self, ncores, shell=True):
+        self.ncores = ncores
+        self.shell = shell
+        self._pool = ThreadPoolExecutor(max_workers=ncores)
+        self._running = set()
+        self._terminating = False
+
+    def submit(self, command, cwd, tag):
+        # the future resolves to (tag, returncode, start time, end time)
+        return self._pool.submit(self._run, command, cwd, tag)
+
+    def _run(self, command, cwd, tag):
+        started = time()
+        # each run gets its own process group, so terminate() also reaches
+        # the adcp started by the shell
+        process = subprocess.Popen(command,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL,
+                                   shell=self.shell, cwd=cwd,
+                                   start_new_session=(os.name == 'posix'))
+        self._running.add(process)
+        if self._terminating:
+            # started while terminate() was running
+            self._kill(process)
+        try:
+            returncode = process.wait()
+        finally:
+            self._running.discard(process)
+        return tag, returncode, started, time()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def terminate(self):
+        # drop the queued runs and kill the running ones
+        self._terminating = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for process in list(self._running):
+            self._kill(process)
+        self._pool.shutdown(wait=True)
+
+    def _kill(self, process):
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGTERM)
+            else:
+                process.terminate()
+        except OSError:
+            pass
+
+def adcp_options(cyclic=False, cystein=False):
+    ADCPDefaultOptions = "-p Bias=NULL,external=5,con,1.0,1.0"
+    if cyclic:
+        ADCPDefaultOptions += ",external2=4,con14,1.0,1.0"
+    if cystein:
+        ADCPDefaultOptions += ",SSbond=80,2.2,20,0.5"
+    ADCPDefaultOptions += ",Opt=1,0.25,0.75,0.0"
+    return ADCPDefaultOptions
+
+def seed_commands(argv, seed, nbRuns, jobName):
+    # argv ends with the ['-s', seed, '-o', output, redirect] placeholders
+    argv = list(argv)
+    commands = []
+    for jobNum in range(1, nbRuns+1):
+        if seed == -1:
+            argv[-4] = str(random.randint(1,999999))
+        else:
+            argv[-4] = str(seed+jobNum-1)
+        argv[-2] = '%s_%d.pdb'%(jobName,jobNum)
+        argv[-1] = '> %s_%d.out 2>&1'%(jobName,jobNum)
+        commands.append(' '.join(argv))
+    return commands
+
+def parse_final_energy(ln):
+    """Energy of the 'best target energy' line an ADCP run writes to its .out
+    log when it finishes, None for any other line.
+
+    This is the only line of the log whose format is relied on: ADCP's own
+    runADCP.py reads the run's energy from it the same way (fourth field).
+
+    >>> parse_final_energy('best target energy -28.402\\n')
+    -28.402
+    >>> parse_final_energy('best target energy    -7.150')
+    -7.15
+    >>> parse_final_energy('best energy so far -3.0') is None
+    True
+    """
+    if not ln.startswith('best target energy'):
+        return None
+    return float(ln.rstrip().split()[3])
+
+class ADCPOutFollower:
+    """Incrementally parse the %s_%d.out log of one ADCP run while it grows.
+
+    update() only reads the bytes appended since the previous call, so a log
+    is read exactly once however often it is polled, and large -N 200 logs
+    are never held in memory. final (and best) is the 'best target energy'
+    of a finished run (see parse_final_energy), nbLines the number of lines
+    written so far. Intermediate lines are not parsed, as their format is
+    not documented, so progress is only known once the run finished.
+    """
+
+    def __init__(self, path, numSteps=None):
+        self.path = path
+        self.numSteps = numSteps
+        self.best = 999.
+        self.final = None
+        self.nbLines = 0
+        self._file = None
+        self._partial = ''
+
+    @property
+    def progress(self):
+        # 1.0 for a finished run, None while it runs
+        return 1.0 if self.final is not None else None
+
+    @property
+    def energy(self):
+        # final energy of a finished run, 999. when none was reported
+        return self.final if self.final is not None else 999.
+
+    def update(self):
+        # parse newly written lines, return True if anything changed
+        if self._file is None:
+            if not os.path.isfile(self.path):
+                return False
+            self._file = open(self.path)
+        chunk = self._file.read()
+        if not chunk:
+            return False
+        lines = (self._partial + chunk).split('\n')
+        self._partial = lines.pop()
+        for ln in lines:
+            self._parse(ln)
+        return True
+
+    def finish(self):
+        # read what is left once the run has exited, including an unterminated last line
+        self.update()
+        if self._partial:
+            self._parse(self._partial)
+            self._partial = ''
+        self.close()
+        return self.energy
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _parse(self, ln):
+        self.nbLines += 1
+        energy = parse_final_energy(ln)
+        if energy is not None:
+            self.final = energy
+            self.best = min(self.best, energy)
+
+def follow_out_files(paths, numSteps=None, interval=1.0, until=None):
+    """Yield (path, follower) whenever one of the ADCP logs grows.
+
+    Stops once every log reported its final energy, or when until() returns
+    True. Works on logs of runs started elsewhere, e.g. the -N 200 jobs of
+    scriptmaker.sh.
+    """
+    from time import sleep
+    followers = [ADCPOutFollower(path, numSteps) for path in paths]
+    while True:
+        for follower in followers:
+            if follower.final is None and follower.update():
+                yield follower.path, follower
+        if all(f.final is not None for f in followers) or (until is not None and until()):
+            break
+        sleep(interval)
+    for follower in followers:
+        follower.close()
+
+class ConvergenceMonitor:
+    """Decide when the best energies of a docking job have converged.
+
+    add() is called with the energy of every finished run. The job counts as
+    converged once at least minRuns runs finished and none of the topK best
+    energies moved by more than tolerance kcal/mol over the last patience
+    runs, at which point the seeds not started yet can be dropped.
+    """
+
+    def __init__(self, topK=5, tolerance=0.5, minRuns=10, patience=5):
+        self.topK = topK
+        self.tolerance = tolerance
+        self.minRuns = max(minRuns, topK)
+        self.patience = patience
+        self.energies = []
+        self._history = []
+
+    def add(self, energy):
+        self.energies.append(energy*0.59219)
+        self._history.append(sorted(self.energies)[:self.topK])
+        return self.converged()
+
+    def converged(self):
+        if len(self.energies) < self.minRuns or len(self._history) <= self.patience:
+            return False
+        before = self._history[-1-self.patience]
+        if len(before) < self.topK:
+            return False
+        now = self._history[-1]
+        return max(abs(a-b) for a, b in zip(now, before)) <= self.tolerance
+
+def extract_target(targetFile, tmpDir, destDir):
+    # unzip a .trg and put its maps, translation points and transpoints in destDir
+    import zipfile
+    with zipfile.ZipFile(targetFile, 'r') as zip_ref:
+        zip_ref.extractall(tmpDir)
+        # the folder inside the archive keeps the name the target was built
+        # with, which differs from the file name for cached targets
+        trgName = os.path.dirname([n for n in zip_ref.namelist()
+                                   if n.endswith('translationPoints.npy')][0])
+    for element in ['C','A','SA','N','NA','OA','HD','d','e']:
+        try:
+            shutil.copy(os.path.join(tmpDir,trgName,'rigidReceptor.%s.map'%element),destDir)
+        except IOError:
+            print("WARNING: cannot locate map file for %s"%element)
+    shutil.copy(os.path.join(tmpDir,trgName,'translationPoints.npy'),destDir)
+    ttt = numpy.load(os.path.join(destDir,'translationPoints.npy'))
+    fff = open(os.path.join(destDir,'transpoints'),'w+')
+    fff.write('%s\n'%len(ttt))
+    numpy.savetxt(fff,ttt,fmt='%7.3f')
+    fff.close()
+
+class TargetMapCache:
+    """Content-addressed store of extracted .trg targets shared by all jobs.
+
+    Each target is unzipped once into <root>/<sha256 of the .trg>/, together
+    with its transpoints file, and jobs get hard links (symlinks across file
+    systems) to those files instead of private copies. Entries are evicted
+    least recently used first once the store grows past max_bytes; entries
+    whose files are still linked from a job directory are kept.
+
+    Publishing, linking and eviction hold an exclusive lock on <root>/.lock,
+    so one process can never evict an entry another is linking from.
+    Extraction itself happens outside the lock, in a staging directory
+    <key>.<pid>.<random>.<host> that is renamed into place; staging
+    directories left by dead processes are removed on eviction.
+    """
+
+    files = ['rigidReceptor.%s.map'%element for element in ['C','A','SA','N','NA','OA','HD','d','e']] + \
+            ['translationPoints.npy', 'transpoints']
+    # written into every entry: the files it holds, and the symlinks pointing into it
+    contentsFile = '.contents'
+    symlinksFile = '.symlinks'
+    # staging directories older than this are removed even if their owner cannot be checked
+    staleStagingSeconds = 6*3600
+
+    def __init__(self, root=None, max_bytes=None):
+        if root is None:
+            root = os.environ.get('ADCP_MAP_CACHE', os.path.expanduser('~/.adcp_map_cache'))
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('ADCP_MAP_CACHE_GB', '20'))*1024**3)
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, targetFile):
+        return file_digest(targetFile)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        with open(os.path.join(self.root, '.lock'), 'a') as lockFile:
+            if fcntl is not None:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockFile, fcntl.LOCK_UN)
+
+    def _extract(self, targetFile, entryDir):
+        # unzip into a private staging directory; returns its path
+        import socket
+        staging = '%s.%d.%d.%s'%(entryDir, os.getpid(), random.randint(0, 999999), socket.gethostname())
+        os.makedirs(staging)
+        extract_target(targetFile, os.path.join(staging, 'unzipped'), staging)
+        shutil.rmtree(os.path.join(staging, 'unzipped'), ignore_errors=True)
+        with open(os.path.join(staging, self.contentsFile), 'w') as f:
+            f.write('\n'.join(name for name in self.files if os.path.isfile(os.path.join(staging, name))))
+        return staging
+
+    def _contents(self, entryDir):
+        # the files the entry was extracted with, or None if it is damaged
+        try:
+            with open(os.path.join(entryDir, self.contentsFile)) as f:
+                names = f.read().split()
+        except OSError:
+            return None
+        if not all(os.path.isfile(os.path.join(entryDir, name)) for name in names):
+            return None
+        return names
+
+    def link(self, targetFile, destDir):
+        # link the target files into destDir and return the created paths
+        entryDir = os.path.join(self.root, self.key(targetFile))
+        for attempt in range(2):
+            staging = None
+            if not os.path.isdir(entryDir):
+                staging = self._extract(targetFile, entryDir)
+            with self._lock():
+                if staging is not None:
+                    try:
+                        os.rename(staging, entryDir)
+                    except OSError:
+                        # another job extracted the same target first
+                        shutil.rmtree(staging, ignore_errors=True)
+                names = self._contents(entryDir)
+                if names is None:
+                    # damaged or from an older version of this cache: extract it again
+                    shutil.rmtree(entryDir, ignore_errors=True)
+                    continue
+                linked = self._link_files(entryDir, names, destDir)
+                os.utime(entryDir)
+                self._evict(keep=entryDir)
+                return linked
+        raise RuntimeError('could not extract %s into the map cache %s'%(targetFile, self.root))
+
+    def _link_files(self, entryDir, names, destDir):
+        linked = []
+        symlinked = []
+        for name in names:
+            src = os.path.join(entryDir, name)
+            dst = os.path.join(destDir, name)
+            if os.path.lexists(dst):
+                os.remove(dst)
+            try:
+                os.link(src, dst)
+            except OSError:
+                os.symlink(os.path.abspath(src), dst)
+                symlinked.append(os.path.abspath(dst))
+            linked.append(dst)
+        if symlinked:
+            # symlinks do not raise the link count, so record them for _evict
+            with open(os.path.join(entryDir, self.symlinksFile), 'a') as f:
+                f.write(''.join(path + '\n' for path in symlinked))
+        return linked
+
+    def _symlinked(self, entryDir):
+        # True if a recorded symlink still points into the entry; forgets the ones that are gone
+        path = os.path.join(entryDir, self.symlinksFile)
+        try:
+            with open(path) as f:
+                links = f.read().split('\n')
+        except OSError:
+            return False
+        target = os.path.abspath(entryDir) + os.sep
+        alive = [link for link in links
+                 if link and os.path.islink(link) and os.readlink(link).startswith(target)]
+        if len(alive) != len([link for link in links if link]):
+            with open(path, 'w') as f:
+                f.write(''.join(link + '\n' for link in alive))
+        return bool(alive)
+
+    def _stale_staging(self, name):
+        import socket
+        parts = name.split('.', 3)
+        try:
+            if time() - os.stat(os.path.join(self.root, name)).st_mtime > self.staleStagingSeconds:
+                return True
+        except FileNotFoundError:
+            return False
+        if len(parts) == 4 and parts[3] == socket.gethostname():
+            try:
+                os.kill(int(parts[1]), 0)
+            except ProcessLookupError:
+                return True
+            except (OSError, ValueError):
+                pass
+        return False
+
+    def evict(self, keep=None):
+        with self._lock():
+            self._evict(keep)
+
+    def _evict(self, keep=None):
+        # call with the lock held
+        entries = []
+        total = 0
+        for name in os.listdir(self.root):
+            entryDir = os.path.join(self.root, name)
+            if not os.path.isdir(entryDir):
+                continue
+            if '.' in name:
+                if self._stale_staging(name):
+                    shutil.rmtree(entryDir, ignore_errors=True)
+                continue
+            size = 0
+            inUse = False
+            try:
+                for fname in os.listdir(entryDir):
+                    st = os.stat(os.path.join(entryDir, fname))
+                    size += st.st_size
+                    inUse = inUse or (st.st_nlink > 1 and not fname.startswith('.'))
+                mtime = os.stat(entryDir).st_mtime
+            except FileNotFoundError:
+                # removed behind our back, e.g. by hand
+                continue
+            inUse = inUse or self._symlinked(entryDir)
+            total += size
+            entries.append((mtime, entryDir, size, inUse))
+        for mtime, entryDir, size, inUse in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entryDir == keep or inUse:
+                continue
+            shutil.rmtree(entryDir, ignore_errors=True)
+            total -= size
 
 class runADCP:
 
@@ -25,56 +458,68 @@ class runADCP:
         if newline:
             sys.stdout.write('\n')
 
+    def cleanup(self):
+        # the workspace only holds links and this job's own files, so
+        # removing it never touches maps other jobs are using
+        if self.workDir is not None:
+            print("clean up job workspace")
+            shutil.rmtree(self.workDir, ignore_errors=True)
+            self.workDir = None
+
     def myexit(self):
-        if self.targetFile is not None:
-            print("clean up unzipped map files")
-            try:
-                shutil.rmtree('./tmp_%s'%self.jobName)
-            except OSError:
-                pass        
-            for element in ['C','A','SA','N','NA','OA','HD','d','e']:
-                if os.path.isfile('rigidReceptor.%s.map'%element):
-                    os.remove('rigidReceptor.%s.map'%element)
-            if os.path.isfile('transpoints'):
-                os.remove('transpoints')
-            if os.path.isfile('translationPoints.npy'):
-                os.remove('translationPoints.npy')
-            if os.path.isfile('con'):
-                os.remove('con')
+        self.cleanup()
         sys.exit(0)
 
+    def collect(self, names):
+        # move output files from the workspace back to the caller
+        if self.workDir is None:
+            return
+        for name in names:
+            src = os.path.join(self.workDir, name)
+            if os.path.isfile(src):
+                shutil.move(src, os.path.join(self.outputDir, name))
+
     def __init__(self):
         import multiprocessing
         self.ncpu = multiprocessing.cpu_count()
-        import platform, subprocess
+        import platform
         system_info = platform.uname()
         _platform = system_info[0]
 
         if _platform == 'Windows':
             self.shell=False
-            self._argv = ['./adcp -t 2']
+            self._binary = 'adcp'
         else:
             self.shell=True
-            self._argv = ['./adcp_Linux-x86_64 -t 2']
+            self._binary = 'adcp_Linux-x86_64'
 
         self.completedJobs = 0    
         self.numberOfJobs = 0
         self.outputBaseName = None
         self.jobName = 'NoName'
         self.targetFile = None
+        self.mapCache = TargetMapCache()
+        self.workDir = None
+        self.outputDir = None
+        self.followInterval = 1.0
+        self.followers = []
      
     def __call__(self, **kw):
-        import subprocess, datetime
-        dataDict = {}
-        
+        """Run one docking job in a private scratch workspace.
+
+        The receptor files, con and the ADCP runs live in a temporary
+        directory (under kw['scratchDir'] if given) and every run's
+        %s_%d.pdb/.out is moved to kw['outputDir'] (default: the current
+        directory) as soon as it finishes, so several jobs can share one
+        directory, one node or one process. Use one instance per job.
+        Returns the best energy of every run.
+        """
+        import tempfile
         seed = None
         rncpu= None
         nbRuns = 50
-        numSteps = 2500000
         jobName = 'NoName'
 
-        skip = False
-
         rncpu = kw.pop('maxCores')
 
         if rncpu is None:
@@ -94,7 +539,7 @@ class runADCP:
         seed = kw.pop('seedValue')
 
         if seed is None:
-            seed = str(random.randint(1,999999))
+            seed = random.randint(1,999999)
 
         if not os.path.isfile("ramaprob.data"):
             print("ERROR: cannot find probability data for ramachandra plot")
@@ -103,36 +548,44 @@ class runADCP:
         if kw['jobName'] is not None:
             self.jobName = jobName = kw.pop('jobName')
 
+        self.outputDir = os.path.abspath(kw.pop('outputDir', None) or os.getcwd())
+        self.workDir = tempfile.mkdtemp(prefix='adcp_%s_'%jobName, dir=kw.pop('scratchDir', None))
+        try:
+            return self._dock(kw, ncores, nbRuns, seed, jobName)
+        finally:
+            # also on errors and interrupts: move back what the runs wrote, then drop the workspace
+            self.collect(['%s_%d%s'%(jobName, i+1, ext) for i in range(nbRuns) for ext in ('.pdb', '.out')])
+            self.cleanup()
+
+    def _dock(self, kw, ncores, nbRuns, seed, jobName):
+        # the part of __call__ that runs inside the workspace
+        outputDir, workDir = self.outputDir, self.workDir
+        numSteps = 2500000
+        os.symlink(os.path.abspath("ramaprob.data"), os.path.join(workDir, "ramaprob.data"))
+
         self.targetFile = targetFile = kw.pop('target')
         if targetFile is None and not os.path.isfile("transpoints"):
             print("ERROR: no receptor files found")
             self.myexit()
         elif targetFile is not None:
-            import zipfile
-            with zipfile.ZipFile(targetFile, 'r') as zip_ref:
-                zip_ref.extractall('./tmp_%s/'%jobName)
-            for element in ['C','A','SA','N','NA','OA','HD','d','e']:
-                try:
-                    shutil.copy(os.path.join('./tmp_%s/'%jobName,targetFile[:-4],'rigidReceptor.%s.map'%element),os.getcwd())
-                except IOError:
-                    print("WARNING: cannot locate map file for %s"%element)
-            shutil.copy(os.path.join('./tmp_%s/'%jobName,targetFile[:-4],'translationPoints.npy'),os.getcwd())
-            ttt = numpy.load('translationPoints.npy')
-            fff = open('transpoints','w+')
-            fff.write('%s\n'%len(ttt))
-            numpy.savetxt(fff,ttt,fmt='%7.3f')
-            fff.close()
+            self.mapCache.link(targetFile, workDir)
         else:
+            for name in ['transpoints', 'translationPoints.npy']:
+                if os.path.isfile(name):
+                    os.symlink(os.path.abspath(name), os.path.join(workDir, name))
             for element in ['C','A','SA','N','NA','OA','HD','d','e']:
                 if not os.path.isfile("rigidReceptor.%s.map"%element):
                     print("WARNING: cannot locate map file rigidReceptor.%s.map"%element)
+                else:
+                    os.symlink(os.path.abspath("rigidReceptor.%s.map"%element),
+                               os.path.join(workDir, "rigidReceptor.%s.map"%element))
 
-        fff = open('con','w+')
+        fff = open(os.path.join(workDir, 'con'),'w+')
         fff.write('1\n')
         fff.close()
 
         for i in range(nbRuns):
-            if os.path.isfile('%s_%d.pdb'%(jobName,i+1)):
+            if os.path.isfile(os.path.join(outputDir, '%s_%d.pdb'%(jobName,i+1))):
                 if not kw['overwriteFiles']:
                     print("ERROR: output file exists %s_%d.pdb"%(jobName,i+1))
                     self.myexit()
@@ -141,7 +594,7 @@ class runADCP:
 
         self.dryRun = kw.pop('dryRun')
 
-        argv = self._argv
+        argv = ['%s -t 2'%os.path.abspath(self._binary)]
 
         if kw['sequence'] is None:
             if kw['input'] is None or kw['input'][-3:] != 'pdb':
@@ -149,7 +602,7 @@ class runADCP:
                 self.myexit()
             else:
                 argv.append('-f')
-                argv.append('%s'%kw['input'])                
+                argv.append('%s'%os.path.abspath(kw['input']))
         else:
                 argv.append('%s'%kw['sequence'])
 
@@ -158,119 +611,215 @@ class runADCP:
             numSteps = kw['numSteps']        
         argv.append('1x%s'%numSteps)
 
-        ADCPDefaultOptions = "-p Bias=NULL,external=5,con,1.0,1.0"
-        if kw['cyclic']:
-            ADCPDefaultOptions += ",external2=4,con14,1.0,1.0"
-        if kw['cystein']:
-            ADCPDefaultOptions += ",SSbond=80,2.2,20,0.5"
-        ADCPDefaultOptions += ",Opt=1,0.25,0.75,0.0"
-        argv.append(ADCPDefaultOptions)
+        argv.append(adcp_options(kw['cyclic'], kw['cystein']))
 
         argv.extend(['-s', '-1', '-o', jobName,' '])
-        jobs = {}
+
+        # build the command of every run up front so the seed sequence does
+        # not depend on the order in which runs finish
+        commands = seed_commands(argv, seed, nbRuns, jobName)
+
+        if self.dryRun:
+            print('\n*************** command ***************************\n')
+            print(commands[0])
+            print()
+            self.myexit()
 
         t0 = time()
         runStatus = [None]*(nbRuns)
 
         runEnergies = [999.]*(nbRuns)
-        procToRun = {}
-        nbStart = 0
-        nbDone = 0
 
         self.myprint("Performing search (%d ADCP runs with %d steps each) ..."%(nbRuns, numSteps))
         print("0%   10   20   30   40   50   60   70   80   90   100%")
         print("|----|----|----|----|----|----|----|----|----|----|")
 
-        for jobNum in range(1,min(nbRuns,ncores)+1):
-            if seed == -1:
-                argv[-4] = str(random.randint(1,999999))
-            else:
-                argv[-4] = str(seed+jobNum-1)
-            argv[-2] = '%s_%d.pdb'%(jobName,jobNum)
-            argv[-1] = '> %s_%d.out 2>&1'%(jobName,jobNum)
-            if self.dryRun:
-                print('\n*************** command ***************************\n')
-                print(' '.join(argv))
-                print()
-                self.myexit()
-                
-            process = subprocess.Popen(' '.join(argv),
-                                       stdout=subprocess.PIPE , 
-                                       stderr=subprocess.PIPE, 
-                                       bufsize = 1, shell=self.shell, cwd=os.getcwd())
-            procToRun[process] = jobNum-1
-            nbStart += 1
-
-        while nbDone < nbRuns:
-            for proc, jnum in list(procToRun.items()):
-                if proc.poll() is not None:
-                    if proc.returncode !=0:
+        scheduler = ADCPScheduler(ncores, shell=self.shell)
+        try:
+            futures = [scheduler.submit(cmd, workDir, jnum)
+                       for jnum, cmd in enumerate(commands)]
+
+            # each run's log is followed while it is written; monitor, if given,
+            # is called as monitor(jobName, run index, follower) on every change
+            monitor = kw.pop('monitor', None)
+            # adaptive mode stops starting new seeds once the best energies converged
+            convergence = None
+            if kw.pop('adaptive', False):
+                convergence = ConvergenceMonitor(topK=kw.pop('topK', 5), tolerance=kw.pop('tolerance', 0.5),
+                                                 minRuns=kw.pop('minRuns', 10), patience=kw.pop('patience', 5))
+            self.followers = followers = [ADCPOutFollower(os.path.join(workDir, '%s_%d.out'%(jobName,jnum+1)), numSteps)
+                                          for jnum in range(nbRuns)]
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=self.followInterval if monitor is not None else None,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    jnum, returncode, started, finished = future.result()
+                    follower = followers[jnum]
+                    follower.finish()
+                    if monitor is not None:
+                        monitor(jobName, jnum, follower)
+                    self.collect(['%s_%d.pdb'%(jobName,jnum+1), '%s_%d.out'%(jobName,jnum+1)])
+                    if returncode !=0:
                         runStatus[jnum] = ('Error', '%s%04d'%(jobName, jnum+1))
-                        error = '\n'.join(runStatus[jnum][1])
-                        status = 'FAILED'
                     else:
-                        status = 'OK'
-                        error = ''
                         runStatus[jnum] = ('OKAY', '%s%04d'%(jobName, jnum+1))
-                        f = open('%s_%d.out'%(jobName,jnum+1))
-                        lines = f.readlines()
-                        f.close()
-                        for ln in lines:
-                            if ln.startswith('best target energy'):
-                                runEnergies[jnum] = float(ln.rstrip().split()[3])
-
-                    nbDone += 1
-                    del procToRun[proc]
+                        runEnergies[jnum] = follower.energy
+                        if follower.final is None:
+                            print("\nWARNING: no 'best target energy' line in %s_%d.out"%(jobName, jnum+1))
 
-                    self._jobStatus[jobNum-1] = 2
+                    self._jobStatus[jnum] = 2
                     self.completedJobs += 1
+
+                    if convergence is not None and returncode == 0 and convergence.add(runEnergies[jnum]):
+                        # hand the cores of the unstarted seeds back to the pool
+                        cancelled = [f for f in pending if f.cancel()]
+                        pending -= set(cancelled)
+                        if cancelled:
+                            self.numberOfJobs -= len(cancelled)
+                            print('\nConverged after %d runs, skipping %d remaining runs'%(self.completedJobs, len(cancelled)))
+                        convergence = None
+
                     percent = float(self.completedJobs)/self.numberOfJobs
                     sys.stdout.write('%s\r' % ('*'*int(50*percent)))
                     sys.stdout.flush()
 
-                    if nbStart < nbRuns:
-                        jobNum += 1
-                        if seed == -1:
-                            argv[-4] = str(random.randint(1,999999))
-                        else:
-                            argv[-4] = str(seed+jobNum-1)
-                        argv[-2] = '%s_%d.pdb'%(jobName,jobNum)
-                        argv[-1] = '> %s_%d.out 2>&1'%(jobName,jobNum)
-                        try:
-                            os.remove(argv[-1])
-                        except OSError:
-                            pass
-
-                        process = subprocess.Popen(' '.join(argv),
-                                                   stdout=subprocess.PIPE , 
-                                                   stderr=subprocess.PIPE, 
-                                                   bufsize = 1, shell=self.shell, cwd=os.getcwd())
-                        procToRun[process] = jobNum-1
-                        nbStart += 1
-            sleep(1)
+                if monitor is not None:
+                    for jnum, follower in enumerate(followers):
+                        if self._jobStatus[jnum] is None and follower.update():
+                            monitor(jobName, jnum, follower)
+        except BaseException:
+            # failed or interrupted: stop the runs still queued or running
+            scheduler.terminate()
+            for follower in self.followers:
+                follower.close()
+            raise
+
+        scheduler.shutdown()
 
         dt = time()-t0
         h,m,s = str(datetime.timedelta(seconds=dt)).split(':')
         self.myprint('Docking performed in %.2f seconds, i.e. %s hours %s minutes %s seconds '%(dt, h, m, s))
         
         sort_index = numpy.argsort(runEnergies)
-        for i in range(5):
+        for i in range(min(5, nbRuns)):
             self.myprint('No. %d energy found is %3.1f kcal/mol at %s_%d.pdb '%(i+1, runEnergies[sort_index[i]]*0.59219, jobName, sort_index[i]+1))
-        self.myexit()
+        return runEnergies
+
+def ligand_box(pdbqt_file, padding=4.0, snap=1.0):
+    """Return the AGFR box (centre, size) around a ligand, snapped to a grid.
+
+    The centre is rounded to a multiple of snap and the size is grown by snap
+    and rounded up, so the snapped box always contains the padded ligand and
+    ligands whose box centre only moves slightly map to the same box.
+    Raises ValueError if the file has no ATOM/HETATM records.
+    """
+    coords = []
+    with open(pdbqt_file) as f:
+        for line in f:
+            if line.startswith(('ATOM', 'HETATM')):
+                coords.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    if not coords:
+        raise ValueError("no ATOM/HETATM records in %s"%pdbqt_file)
+    coords = numpy.array(coords)
+    lo = coords.min(axis=0) - padding
+    hi = coords.max(axis=0) + padding
+    centre = numpy.round((lo + hi) / 2 / snap) * snap
+    size = numpy.ceil((hi - lo + snap) / snap) * snap
+    return tuple(round(float(x), 3) for x in centre), tuple(round(float(x), 3) for x in size)
+
+def file_digest(path):
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def target_key(receptor_digest, box, agfr_options):
+    # receptor_digest is file_digest(receptor), computed once for all ligands
+    import hashlib
+    h = hashlib.sha256(receptor_digest.encode())
+    h.update(repr((box, tuple(agfr_options))).encode())
+    return h.hexdigest()[:24]
+
+def _build_target(receptor_file, box, agfr_options, output_name):
+    # worker: build one target into output_name.trg. AGFR writes under a
+    # private name that is only renamed into place after a clean build, so a
+    # failed or interrupted build never looks like a cache entry.
+    (cx, cy, cz), (sx, sy, sz) = box
+    building = '%s_tmp%d'%(output_name, os.getpid())
+    command = ['agfr', '-r', receptor_file, '-b', 'user',
+               str(cx), str(cy), str(cz), str(sx), str(sy), str(sz),
+               '-o', building] + list(agfr_options)
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode == 0 and os.path.isfile(building + '.trg'):
+        os.replace(building + '.trg', output_name + '.trg')
+    for leftover in glob.glob(building + '*'):
+        if os.path.isdir(leftover):
+            shutil.rmtree(leftover, ignore_errors=True)
+        else:
+            os.remove(leftover)
+    return result.returncode, result.stdout
+
+def generate_trg_files(pdbqt_dir, trg_dir, receptor_file="4g1m_ab.pdbqt",
+                       agfr_options=(), padding=4.0, snap=1.0, max_workers=None):
+    """Build one .trg per ligand with AGFR, in parallel and through a cache.
+
+    Each target is keyed on a hash of (receptor bytes, snapped ligand box,
+    AGFR options) and built once into trg_dir/agfr_cache/<key>.trg. Ligands
+    whose boxes snap to the same box, e.g. point mutants of one peptide,
+    share that build, and keys already in the cache are never rebuilt.
+    trg_dir/<ligand>.trg is a hard link (or copy) of its cache entry.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    cache_dir = os.path.join(trg_dir, 'agfr_cache')
+    os.makedirs(cache_dir, exist_ok=True)
 
-def generate_trg_files(pdbqt_dir, trg_dir):
     pdbqt_files = glob.glob(os.path.join(pdbqt_dir, '*.pdbqt'))
-    receptor_file = "4g1m_ab.pdbqt"
+    ligands_by_key = {}
+    boxes = {}
+    receptor_digest = file_digest(receptor_file)
     for pdbqt_file in pdbqt_files:
-        base_name = os.path.splitext(os.path.basename(pdbqt_file))[0]
-        output_name = os.path.join(trg_dir, base_name)
-        
-        if os.path.exists(pdbqt_file):
-            subprocess.run(['agfr', '-r', receptor_file, '-l', pdbqt_file, '-o', output_name])
-        else:
-            print(f"Missing file: {pdbqt_file}")
+        try:
+            box = ligand_box(pdbqt_file, padding, snap)
+        except ValueError as e:
+            print(f"Skipping {pdbqt_file}: {e}")
+            continue
+        key = target_key(receptor_digest, box, agfr_options)
+        ligands_by_key.setdefault(key, []).append(pdbqt_file)
+        boxes[key] = box
+
+    to_build = [key for key in ligands_by_key
+                if not os.path.isfile(os.path.join(cache_dir, key + '.trg'))]
+    print(f"{len(pdbqt_files)} ligands, {len(ligands_by_key)} distinct targets, "
+          f"{len(to_build)} to build")
 
-def run_adcp_on_trg(trg_file):
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_build_target, receptor_file, boxes[key], agfr_options,
+                               os.path.join(cache_dir, key)): key for key in to_build}
+        for future in as_completed(futures):
+            key = futures[future]
+            returncode, log = future.result()
+            if returncode != 0 or not os.path.isfile(os.path.join(cache_dir, key + '.trg')):
+                print(f"AGFR failed for {ligands_by_key[key][0]}:\n{log}")
+
+    for key, ligands in ligands_by_key.items():
+        cached = os.path.join(cache_dir, key + '.trg')
+        if not os.path.isfile(cached):
+            continue
+        for pdbqt_file in ligands:
+            base_name = os.path.splitext(os.path.basename(pdbqt_file))[0]
+            output_file = os.path.join(trg_dir, base_name + '.trg')
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            try:
+                os.link(cached, output_file)
+            except OSError:
+                shutil.copy(cached, output_file)
+
+def run_adcp_on_trg(trg_file, sequence='sscsscplsk', nbRuns=20, numSteps=500000,
+                    maxCores=None, seed=None):
     base_name = os.path.splitext(os.path.basename(trg_file))[0]
     ligand_file = f"{base_name}.pdbqt"
     output_prefix = f"{base_name}_redocking"
@@ -278,26 +827,222 @@ def run_adcp_on_trg(trg_file):
     adcp_command = [
         'adcp',
         '-t', trg_file,
-        '-s', 'sscsscplsk',
-        '-N', '20',
-        '-n', '500000',
+        '-s', sequence,
+        '-N', str(nbRuns),
+        '-n', str(numSteps),
         '-cyc',
         '-o', output_prefix,
         '-ref', ligand_file,
         '-nc', '0.8'
     ]
-    
+    if maxCores is not None:
+        adcp_command += ['-c', str(maxCores)]
+    # adcp picks a random seed itself when none is given
+    if seed is not None and seed != -1:
+        adcp_command += ['-S', str(seed)]
+
     subprocess.run(adcp_command)
 
+def target_seed(seed, base_name, nbRuns):
+    # first seed of a target: derived from its name, so it does not depend
+    # on the order the targets are listed in (-1 keeps seeds random)
+    if seed == -1:
+        return seed
+    return seed + zlib.crc32(base_name.encode()) % 100000 * nbRuns
+
+def run_adcp_campaign(trg_files, results_dir, sequences, maxCores=None,
+                      nbRuns=20, numSteps=500000, seed=None, cyclic=True,
+                      cystein=False, adcp_binary='adcp_Linux-x86_64',
+                      ramaprob='ramaprob.data', adaptive=None):
+    """Dock every .trg from one core pool, one work unit per (target, run).
+
+    sequences maps each target's base name to its peptide sequence (a single
+    string is used for all targets). Runs of all targets share the pool, so
+    the tail of one target overlaps with the start of the next and every core
+    stays busy until the last run of the campaign. Results of each target go
+    to results_dir/<base_name>/, with the energies of all runs, and the exit
+    code of failed ones, summarised in <base_name>_energies.csv.
+
+    Runs are handed to the pool as cores free up, target by target. A
+    target's maps are linked from the map cache when its first run starts
+    and unlinked after its last run, so only the targets being docked pin
+    cache entries.
+
+    adaptive, a dict of ConvergenceMonitor options (or True for the
+    defaults), stops starting new runs of a target once its best energies
+    converged; the cores go to the runs of the remaining targets.
+
+    The seeds of a target are derived from seed and its name (see
+    target_seed), so they do not change with the order of trg_files.
+    """
+    ncpu = os.cpu_count()
+    ncores = ncpu if maxCores is None else min(ncpu, maxCores)
+    if seed is None:
+        seed = random.randint(1,999999)
+    adcp_binary = os.path.abspath(adcp_binary)
+    ramaprob = os.path.abspath(ramaprob)
+    # check before anything is submitted, instead of every run failing with exit code 127
+    if not os.path.isfile(adcp_binary):
+        raise FileNotFoundError(f"ADCP binary not found: {adcp_binary}")
+    if not os.path.isfile(ramaprob):
+        raise FileNotFoundError(f"Ramachandran probability data not found: {ramaprob}")
+
+    map_cache = TargetMapCache()
+    scheduler = ADCPScheduler(ncores)
+    # runs in dispatch order; a target's commands are built when its first run is dispatched
+    queue = deque((trg_file, jnum) for trg_file in trg_files for jnum in range(nbRuns))
+    commands = {}
+    linked = {}
+    energies = {}
+    failed = {}
+    started = {}
+    finished = {}
+    stopped = set()
+    convergence = {}
+    followers = {}
+    running = {}
+
+    def start_target(trg_file, base_name):
+        # link the maps and write the per-target files; returns the run commands
+        if isinstance(sequences, str):
+            sequence = sequences
+        else:
+            sequence = sequences[base_name]
+        ligand_dir = os.path.join(results_dir, base_name)
+        os.makedirs(ligand_dir, exist_ok=True)
+        linked[base_name] = map_cache.link(trg_file, ligand_dir)
+        ramaprob_link = os.path.join(ligand_dir, 'ramaprob.data')
+        if os.path.islink(ramaprob_link) and not os.path.isfile(ramaprob_link):
+            os.remove(ramaprob_link)    # broken link left by an earlier run
+        if not os.path.isfile(ramaprob_link):
+            os.symlink(ramaprob, ramaprob_link)
+        with open(os.path.join(ligand_dir, 'con'), 'w') as f:
+            f.write('1\n')
+        argv = [adcp_binary, '-t', '2', sequence, '-r', '1x%s'%numSteps,
+                adcp_options(cyclic, cystein), '-s', '-1', '-o', base_name, ' ']
+        energies[base_name] = [999.]*nbRuns
+        failed[base_name] = {}
+        started[base_name] = finished[base_name] = 0
+        if adaptive:
+            convergence[base_name] = ConvergenceMonitor(**(adaptive if isinstance(adaptive, dict) else {}))
+        return seed_commands(argv, target_seed(seed, base_name, nbRuns), nbRuns, base_name)
+
+    def dispatch():
+        # keep every core busy, without queueing runs (and linking targets) ahead of them
+        while len(running) < ncores and queue:
+            trg_file, jnum = queue.popleft()
+            base_name = os.path.splitext(os.path.basename(trg_file))[0]
+            if base_name in stopped:
+                continue
+            if jnum == 0:
+                commands[base_name] = start_target(trg_file, base_name)
+            ligand_dir = os.path.join(results_dir, base_name)
+            followers[(base_name, jnum)] = ADCPOutFollower(
+                os.path.join(ligand_dir, '%s_%d.out'%(base_name, jnum+1)), numSteps)
+            running[scheduler.submit(commands[base_name][jnum], ligand_dir, (base_name, jnum))] = (base_name, jnum)
+            started[base_name] += 1
+
+    def finish_target(base_name):
+        ligand_dir = os.path.join(results_dir, base_name)
+        with open(os.path.join(ligand_dir, f"{base_name}_energies.csv"), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['run', 'energy_kcal_mol', 'output', 'status'])
+            for i in numpy.argsort(energies[base_name]):
+                if i >= started[base_name] or i in failed[base_name]:
+                    continue
+                writer.writerow([i+1, '%.1f'%(energies[base_name][i]*0.59219),
+                                 '%s_%d.pdb'%(base_name, i+1), 'ok'])
+            for i, status in sorted(failed[base_name].items()):
+                writer.writerow([i+1, '', '%s_%d.pdb'%(base_name, i+1), status])
+        for path in linked.pop(base_name):
+            os.remove(path)
+        del commands[base_name]
+        print(f"Finished {base_name}: best energy {min(energies[base_name])*0.59219:.1f} kcal/mol"
+              + (f", {len(failed[base_name])} failed runs" if failed[base_name] else ""))
+
+    print(f"Campaign: {len(trg_files)} targets x {nbRuns} runs on {ncores} cores")
+    t0 = time()
+    try:
+        dispatch()
+        while running:
+            done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                base_name, jnum = running.pop(future)
+                _, returncode, run_started, run_finished = future.result()
+                follower = followers.pop((base_name, jnum))
+                energy = follower.finish()
+                finished[base_name] += 1
+                if returncode != 0:
+                    failed[base_name][jnum] = f"failed (exit code {returncode})"
+                    print(f"Run {jnum+1} of {base_name} failed with exit code {returncode}")
+                elif follower.final is None:
+                    failed[base_name][jnum] = "no 'best target energy' in the log"
+                    print(f"Run {jnum+1} of {base_name}: no 'best target energy' line in its log")
+                else:
+                    energies[base_name][jnum] = energy
+                    if base_name in convergence and convergence[base_name].add(energy):
+                        # the remaining runs of this target are not dispatched
+                        stopped.add(base_name)
+                        del convergence[base_name]
+                        print(f"{base_name} converged, skipping {nbRuns - started[base_name]} runs")
+                if finished[base_name] == started[base_name] and (base_name in stopped or started[base_name] == nbRuns):
+                    finish_target(base_name)
+            # read the logs of the runs still going, so finishing one only reads its tail
+            for follower in followers.values():
+                follower.update()
+            dispatch()
+    except BaseException:
+        # failed or interrupted: stop the runs still queued or running
+        scheduler.terminate()
+        raise
+    scheduler.shutdown()
+    print(f"Campaign finished in {time()-t0:.1f} seconds")
+    return energies
+
 def main():
-    pdbqt_dir = "/home/dilrana/Desktop/adcp/RGDmut/PDBQT_1_2_3"
-    trg_dir = "/home/dilrana/Desktop/adcp/RGDmut/RGDtrg"
+    parser = argparse.ArgumentParser(description='Build .trg targets with AGFR and dock them with ADCP')
+    parser.add_argument('--pdbqt_dir', default="/home/dilrana/Desktop/adcp/RGDmut/PDBQT_1_2_3")
+    parser.add_argument('--trg_dir', default="/home/dilrana/Desktop/adcp/RGDmut/RGDtrg")
+    parser.add_argument('--receptor', default="4g1m_ab.pdbqt")
+    parser.add_argument('--agfr_workers', type=int, default=None,
+                        help='number of AGFR processes building targets in parallel')
+    parser.add_argument('--campaign', action='store_true',
+                        help='run every (target, run) pair from one core pool instead of one adcp job per target')
+    parser.add_argument('--results_dir', default='campaign_results',
+                        help='campaign mode: per-ligand result directories are created here')
+    parser.add_argument('--sequence', default='sscsscplsk', help='peptide sequence')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='campaign mode: stop starting runs of a target once its 5 best energies are stable')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='adaptive mode: largest change (kcal/mol) of the best energies counted as stable')
+    parser.add_argument('--maxCores', type=int, default=None, help='cores used by adcp (default: all)')
+    parser.add_argument('--nbRuns', type=int, default=20, help='ADCP runs per target')
+    parser.add_argument('--numSteps', type=int, default=500000, help='Monte Carlo steps per run')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='first seed; campaign mode offsets it per target from its name (-1 for random seeds)')
+    parser.add_argument('--adcp_binary', default='adcp_Linux-x86_64', help='campaign mode: path to the ADCP executable')
+    parser.add_argument('--ramaprob', default='ramaprob.data', help='campaign mode: path to ramaprob.data')
+    args = parser.parse_args()
+
+    if args.campaign:
+        for path, what in ((args.adcp_binary, '--adcp_binary'), (args.ramaprob, '--ramaprob')):
+            if not os.path.isfile(path):
+                print(f"ERROR: {path} not found, set {what}")
+                sys.exit(1)
 
-    generate_trg_files(pdbqt_dir, trg_dir)
+    generate_trg_files(args.pdbqt_dir, args.trg_dir, receptor_file=args.receptor,
+                       max_workers=args.agfr_workers)
 
-    trg_files = glob.glob(os.path.join(trg_dir, "*.trg"))
-    for trg_file in trg_files:
-        run_adcp_on_trg(trg_file)
+    trg_files = glob.glob(os.path.join(args.trg_dir, "*.trg"))
+    if args.campaign:
+        run_adcp_campaign(trg_files, args.results_dir, args.sequence, maxCores=args.maxCores,
+                          nbRuns=args.nbRuns, numSteps=args.numSteps, seed=args.seed,
+                          adcp_binary=args.adcp_binary, ramaprob=args.ramaprob,
+                          adaptive={'tolerance': args.tolerance} if args.adaptive else None)
+    else:
+        for trg_file in trg_files:
+            run_adcp_on_trg(trg_file, args.sequence, nbRuns=args.nbRuns, numSteps=args.numSteps,
+                            maxCores=args.maxCores, seed=args.seed)
 
 if __name__=='__main__':
-    main()
\ No newline at end of file
+    main()
@@ -2,7 +2,7 @@
 ### credit to https://graylab.jhu.edu/pyrosetta/downloads/scripts/toolbox/mutants.py
 ### Step 1: Initialize or activate the environment: 
 
-conda activate py39_env
+### conda activate py39_env
 
 ### Step 2: Ensure the pdb file of interest and the python script are in the same directory. Also, make a subdirectory called ".test.output."
 ### Step 3: Make sure PyRosetta is installed
@@ -18,7 +18,7 @@ conda activate py39_env
 # Notes: 
 # Example: pyscript_name.py --pdb_filename my_protein.pdb --mutant_aa V --trials 3
 # This analyzes 'my_protein.pdb', mutate residues to valine, and perform 3 trials.
-# may need to take out --PyMOLMover_ip=off 
+# --PyMOLMover_ip=off (default) runs headless; use on or host[:port], plus --PyMOL_every=N, to watch a scan in PyMOL
 ########
 
 from __future__ import print_function
@@ -30,6 +30,7 @@ from pyrosetta import *
 from pyrosetta.rosetta.protocols import docking
 from pyrosetta import protocols
 from pyrosetta.rosetta.protocols.minimization_packing import PackRotamersMover
+from pymol_view import setup_pymol, show_pose
 # importing in programs needed for amino acid scanning
 
 init() # (extra options = "-seed ####") also an option
@@ -38,6 +39,7 @@ print(scorefxn)
 import os; os.chdir('.test.output')
 ##need to mkdir .test.output
 
+
 def scanning(pdb_filename, partners, mutant_aa = 'A', 
         interface_cutoff = 8.0, output = False,
         trials = 1, trial_output = ''):
@@ -70,10 +72,7 @@ def scanning(pdb_filename, partners, mutant_aa = 'A',
     interface.calculate(pose)
 
 ## for visualization
-    pymover = PyMOLMover()
-    pymover.keep_history(True)    # for multiple trajectories
-    pymover.apply(pose)
-    pymover.send_energy(pose)
+    show_pose(pose, always = True)
 
 
     for trial in range( trials ):
@@ -150,10 +149,7 @@ def interface_ddG( pose, mutant_position, mutant_aa, movable_jumps, scorefxn = N
     mutant.pdb_info().name( pose.sequence()[mutant_position -1] +
         str( pose.pdb_info().number(mutant_position)) +
         mutant.sequence()[mutant_position - 1])
-    pymover = PyMOLMover()
-    scorefxn(mutant)
-    pymover.apply(mutant)
-    pymover.send_energy(mutant)
+    show_pose(mutant, scorefxn)
 
     if out_filename:
         mutant.dump_pdb(out_filename)
@@ -334,6 +330,12 @@ parser.add_option('--trials', dest='trials',
 parser.add_option('--trial_output', dest = 'trial_output',
     default = 'ddG_out',    # if a specific output name is desired
     help = 'the name preceding all output files')
+parser.add_option('--PyMOLMover_ip', dest = 'PyMOLMover_ip',
+    default = 'off',    # default headless, nothing is sent to PyMOL
+    help = 'off, on (local PyMOL) or host[:port] of the PyMOL listener')
+parser.add_option('--PyMOL_every', dest = 'PyMOL_every',
+    default = '1',    # with PyMOL on, send every mutant
+    help = 'send only every Nth mutant to PyMOL')
 (options,args) = parser.parse_args()
 
 # PDB file option
@@ -346,6 +348,7 @@ output = bool(options.output)
 # trials options
 trials = int(options.trials)
 trial_output = options.trial_output
+setup_pymol(options.PyMOLMover_ip, options.PyMOL_every)
 
 scanning(pdb_filename, partners, mutant_aa,
     interface_cutoff, output, trials, trial_output)
\ No newline at end of file
@@ -1,52 +1,56 @@
 #
-#  mutate_model.py
+#  PDBgen.py (based on mutate_model.py)
 #
-#     Usage:   python mutate_model.py modelname respos resname chain > logfile
+#     Usage:   python PDBgen.py modelname respos[,respos...] chain [--workers N] [--profile full-md]
 #
-#     Example: python mutate_model.py 1t29 1699 LEU A > 1t29.log
+#     Example: python PDBgen.py 1t29.pdb 1699,1700 A --workers 8
 #
 #
-#  Creates a single in silico point mutation to sidechain type and at residue position
-#  input by the user, in the structure whose file is modelname.pdb
-#  The conformation of the mutant sidechain is optimized by conjugate gradient and
-#  refined using some MD.
+#  Saturation mutagenesis: builds all 20 side-chain types at every residue position
+#  given, in the structure whose file is modelname.
+#  The conformation of each mutant sidechain is optimized by conjugate gradient and
+#  refined using some MD (see --profile for cheaper settings).
+#
+#  Mutants are built in parallel worker processes. Each mutant writes its MODELLER
+#  output to its own log file, Logs_<pos>/<model>_<res><pos>.log, and the structure
+#  to Mutants_<pos>/<model>_<res><pos>.pdb. Mutants already written are skipped.
+#  Every built mutant and its build time are recorded in the run manifest
+#  (Mutants_<pos>/manifest.csv).
+#  The input is read from the shared file system once per worker (see wild_type);
+#  the number of file system operations saved is reported at the end of the run.
 #
 #  Note: if the model has no chain identifier, specify "" for the chain argument.
 
 import sys
 import os
+import csv
+import time
+import shutil
+import argparse
+import tempfile
+from collections import Counter
+from contextlib import contextmanager, redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from modeller import *
 from modeller.optimizers import MolecularDynamics, ConjugateGradients
 from modeller.automodel import autosched
 
 
+AMINO_ACIDS = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+               "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL"]
 
-def generate_mutants(modelname, respos, chain):
-    amino_acids = ["ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE", "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL"]
-    
-    # Create a new directory for mutants
-##    output_dir = f"Mutants_{respos}"
-##    os.makedirs(output_dir, exist_ok=True)
-
-    mutants_dir = f"Mutants_{respos}"
-    logs_dir = f"Logs_{respos}"
-    os.makedirs(mutants_dir, exist_ok=True)
-    os.makedirs(logs_dir, exist_ok=True)
-
-    for restyp in amino_acids:
-        log_file = os.path.join(logs_dir, f"{modelname}_{restyp}{respos}.log")
-        sys.stdout = open(log_file, 'w')  # Redirect stdout to log file
-        
-        try:
-        # ... (mutation process remains the same)        
+# full-md: CG + MD (default), cg-only: CG without the MD blocks,
+# build-only: side chain built from internal coordinates, no restraints or optimisation
+REFINEMENT_PROFILES = ("full-md", "cg-only", "build-only")
 
-def optimize(atmsel, sched):
+def optimize(atmsel, sched, md=True):
     #conjugate gradient
     for step in sched:
         step.optimize(atmsel, max_iterations=200, min_atom_shift=0.001)
     #md
-    refine(atmsel)
+    if md:
+        refine(atmsel)
     cg = ConjugateGradients()
     cg.optimize(atmsel, max_iterations=200, min_atom_shift=0.001)
 
@@ -78,116 +82,257 @@ def make_restraints(mdl1, aln):
                 spline_dx=0.3, spline_min_points = 5, aln=aln,
                 spline_on_site=True)
 
-#first argument
-modelname, respos, restyp, chain, = sys.argv[1:]
-
-
-log.verbose()
-
-# Set a different value for rand_seed to get a different final model
-env = Environ(rand_seed=-49837)
-
-env.io.hetatm = True
-#soft sphere potential
-env.edat.dynamic_sphere=False
-#lennard-jones potential (more accurate)
-env.edat.dynamic_lennard=True
-env.edat.contact_shell = 4.0
-env.edat.update_dynamic = 0.39
-
-# Read customized topology file with phosphoserines (or standard one)
-env.libs.topology.read(file='$(LIB)/top_heav.lib')
-
-# Read customized CHARMM parameter library with phosphoserines (or standard one)
-env.libs.parameters.read(file='$(LIB)/par.lib')
-
-
-# Read the original PDB file and copy its sequence to the alignment array:
-mdl1 = Model(env, file=modelname)
-ali = Alignment(env)
-ali.append_model(mdl1, atom_files=modelname, align_codes=modelname)
-
-#set up the mutate residue selection segment
-s = Selection(mdl1.chains[chain].residues[respos])
-
-#perform the mutate residue operation
-s.mutate(residue_type=restyp)
-#get two copies of the sequence.  A modeller trick to get things set up
-ali.append_model(mdl1, align_codes=modelname)
-
-# Generate molecular topology for mutant
-mdl1.clear_topology()
-mdl1.generate_topology(ali[-1])
-
 
-# Transfer all the coordinates you can from the template native structure
-# to the mutant (this works even if the order of atoms in the native PDB
-# file is not standard):
-#here we are generating the model by reading the template coordinates
-mdl1.transfer_xyz(ali)
-
-# Build the remaining unknown coordinates
-mdl1.build(initialize_xyz=False, build_method='INTERNAL_COORDINATES')
-
-#yes model2 is the same file as model1.  It's a modeller trick.
-mdl2 = Model(env, file=modelname)
-
-#required to do a transfer_res_numb
-#ali.append_model(mdl2, atom_files=modelname, align_codes=modelname)
-#transfers from "model 2" to "model 1"
-mdl1.res_num_from(mdl2,ali)
-
-#It is usually necessary to write the mutated sequence out and read it in
-#before proceeding, because not all sequence related information about MODEL
-#is changed by this command (e.g., internal coordinates, charges, and atom
-#types and radii are not updated).
-
-mdl1.write(file=modelname+restyp+respos+'.tmp')
-mdl1.read(file=modelname+restyp+respos+'.tmp')
-
-#set up restraints before computing energy
-#we do this a second time because the model has been written out and read in,
-#clearing the previously set restraints
-make_restraints(mdl1, ali)
-
-#a non-bonded pair has to have at least as many selected atoms
-mdl1.env.edat.nonbonded_sel_atoms=1
-
-sched = autosched.loop.make_for_model(mdl1)
-
-#only optimize the selected residue (in first pass, just atoms in selected
-#residue, in second pass, include nonbonded neighboring atoms)
-#set up the mutate residue selection segment
-s = Selection(mdl1.chains[chain].residues[respos])
-
-mdl1.restraints.unpick_all()
-mdl1.restraints.pick(s)
-
-s.energy()
-
-s.randomize_xyz(deviation=4.0)
-
-mdl1.env.edat.nonbonded_sel_atoms=2
-optimize(s, sched)
-
-#feels environment (energy computed on pairs that have at least one member
-#in the selected)
-mdl1.env.edat.nonbonded_sel_atoms=1
-optimize(s, sched)
+def make_env():
+    log.verbose()
+
+    # Set a different value for rand_seed to get a different final model
+    env = Environ(rand_seed=-49837)
+
+    env.io.hetatm = True
+    #soft sphere potential
+    env.edat.dynamic_sphere=False
+    #lennard-jones potential (more accurate)
+    env.edat.dynamic_lennard=True
+    env.edat.contact_shell = 4.0
+    env.edat.update_dynamic = 0.39
+
+    # Read customized topology file with phosphoserines (or standard one)
+    env.libs.topology.read(file='$(LIB)/top_heav.lib')
+
+    # Read customized CHARMM parameter library with phosphoserines (or standard one)
+    env.libs.parameters.read(file='$(LIB)/par.lib')
+    return env
+
+
+# RAM-backed scratch directory shared by the workers, set by init_worker.
+# Each worker copies the input structure there and parses it once (see wild_type).
+_scratch = None
+_wild_types = {}        # input file -> (scratch copy, parsed model)
+fs_ops = Counter()      # file system operations on the output storage
+
+# shared-storage operations per mutant of the old build: read the input
+# twice, write, read and remove the .tmp file, write the result
+SHARED_OPS_BEFORE = 6
+
+def make_scratch():
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    return tempfile.mkdtemp(prefix="mutants_", dir=base)
+
+def init_worker(scratch):
+    global _scratch
+    _scratch = scratch
+
+def wild_type(modelname):
+    """Return (scratch copy, parsed model) of the input structure, reading the
+    input file only the first time a worker sees it."""
+    if modelname not in _wild_types:
+        local = os.path.join(_scratch, f"{os.getpid()}_{os.path.basename(modelname)}")
+        shutil.copyfile(modelname, local)
+        fs_ops["shared_reads"] += 1
+        _wild_types[modelname] = (local, Model(make_env(), file=local))
+    return _wild_types[modelname]
+
+
+@contextmanager
+def log_to(log_file):
+    # send this process' output to log_file: MODELLER's own messages are
+    # written to file descriptor 1, print() goes through sys.stdout
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(log_file, 'w') as log_fh:
+        os.dup2(log_fh.fileno(), 1)
+        try:
+            with redirect_stdout(log_fh):
+                yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
 
-s.energy()
 
-#give a proper name
-## mdl1.write(file=modelname+restyp+respos+'.pdb')
+def generate_mutant(modelname, respos, restyp, chain, output_file, profile="full-md"):
+    # a fresh environment per mutant keeps the random seed, and therefore
+    # the model, independent of which worker builds it
+    env = make_env()
+    local_model, wt = wild_type(modelname)
+
+    # Read the original PDB file and copy its sequence to the alignment array:
+    mdl1 = Model(env, file=local_model)
+    ali = Alignment(env)
+    ali.append_model(mdl1, atom_files=local_model, align_codes=modelname)
 
-        # Change the output file path
-output_file = os.path.join(mutants_dir, f"{modelname}_{restyp}
-{respos}.pdb")
-mdl1.write(file=output_file)
+    #set up the mutate residue selection segment
+    s = Selection(mdl1.chains[chain].residues[respos])
+
+    #perform the mutate residue operation
+    s.mutate(residue_type=restyp)
+    #get two copies of the sequence.  A modeller trick to get things set up
+    ali.append_model(mdl1, align_codes=modelname)
+
+    # Generate molecular topology for mutant
+    mdl1.clear_topology()
+    mdl1.generate_topology(ali[-1])
+
+    # Transfer all the coordinates you can from the template native structure
+    # to the mutant (this works even if the order of atoms in the native PDB
+    # file is not standard):
+    #here we are generating the model by reading the template coordinates
+    mdl1.transfer_xyz(ali)
+
+    # Build the remaining unknown coordinates
+    mdl1.build(initialize_xyz=False, build_method='INTERNAL_COORDINATES')
+
+    #transfers the residue numbering of the (cached) wild type to "model 1"
+    mdl1.res_num_from(wt,ali)
+
+    # build-only keeps the side chain as built from internal coordinates:
+    # no restraints, schedule or optimisation are set up for it
+    if profile == "build-only":
+        mdl1.write(file=output_file)
+        fs_ops["shared_writes"] += 1
+        return
+
+    #It is usually necessary to write the mutated sequence out and read it in
+    #before proceeding, because not all sequence related information about MODEL
+    #is changed by this command (e.g., internal coordinates, charges, and atom
+    #types and radii are not updated).
+    scratch_file = os.path.join(_scratch, f"{os.getpid()}_{restyp}{respos}.tmp")
+    mdl1.write(file=scratch_file)
+    mdl1.read(file=scratch_file)
+
+    #set up restraints before computing energy
+    #we do this a second time because the model has been written out and read in,
+    #clearing the previously set restraints
+    make_restraints(mdl1, ali)
+
+    #a non-bonded pair has to have at least as many selected atoms
+    mdl1.env.edat.nonbonded_sel_atoms=1
+
+    sched = autosched.loop.make_for_model(mdl1)
+
+    #only optimize the selected residue (in first pass, just atoms in selected
+    #residue, in second pass, include nonbonded neighboring atoms)
+    #set up the mutate residue selection segment
+    s = Selection(mdl1.chains[chain].residues[respos])
+
+    mdl1.restraints.unpick_all()
+    mdl1.restraints.pick(s)
+
+    s.energy()
+
+    md = profile == "full-md"
+    s.randomize_xyz(deviation=4.0)
+
+    mdl1.env.edat.nonbonded_sel_atoms=2
+    optimize(s, sched, md)
+
+    #feels environment (energy computed on pairs that have at least one member
+    #in the selected)
+    mdl1.env.edat.nonbonded_sel_atoms=1
+    optimize(s, sched, md)
+
+    s.energy()
+
+    mdl1.write(file=output_file)
+    fs_ops["shared_writes"] += 1
+
+    #delete the temporary file
+    os.remove(scratch_file)
+
+
+def mutant_paths(modelname, respos, restyp):
+    name = os.path.splitext(os.path.basename(modelname))[0]
+    output_file = os.path.join(f"Mutants_{respos}", f"{name}_{restyp}{respos}.pdb")
+    log_file = os.path.join(f"Logs_{respos}", f"{name}_{restyp}{respos}.log")
+    return output_file, log_file
+
+
+def build_mutant(task):
+    # runs in a worker process; returns (output file, seconds, shared file system operations)
+    modelname, respos, restyp, chain, profile = task
+    output_file, log_file = mutant_paths(modelname, respos, restyp)
+    partial = output_file + ".part"
+    ops_before = Counter(fs_ops)
+    t0 = time.time()
+    with log_to(log_file):
+        generate_mutant(modelname, respos, restyp, chain, partial, profile)
+    # rename into place so an interrupted run never leaves a partial model
+    os.replace(partial, output_file)
+    return output_file, time.time() - t0, fs_ops - ops_before
+
+
+def generate_mutants(modelname, positions, chain, workers=None, profile="full-md", amino_acids=AMINO_ACIDS):
+    # build every residue type in amino_acids at each position (a residue
+    # number or a list of them); mutants already written are skipped
+    if profile not in REFINEMENT_PROFILES:
+        raise ValueError(f"unknown refinement profile {profile}, expected one of {REFINEMENT_PROFILES}")
+    if isinstance(positions, (str, int)):
+        positions = [positions]
+    positions = [str(respos) for respos in positions]
+
+    tasks = []
+    for respos in positions:
+        os.makedirs(f"Mutants_{respos}", exist_ok=True)
+        os.makedirs(f"Logs_{respos}", exist_ok=True)
+        for restyp in amino_acids:
+            if not os.path.isfile(mutant_paths(modelname, respos, restyp)[0]):
+                tasks.append((modelname, respos, restyp, chain, profile))
+    total = len(positions) * len(amino_acids)
+    print(f"{total - len(tasks)} of {total} mutants already built, {len(tasks)} to go")
+
+    # one run manifest per position, appended to by every run
+    manifests, writers = {}, {}
+    for respos in positions:
+        manifest_file = os.path.join(f"Mutants_{respos}", "manifest.csv")
+        new_manifest = not os.path.isfile(manifest_file)
+        manifests[respos] = open(manifest_file, "a", newline="")
+        writers[respos] = csv.writer(manifests[respos])
+        if new_manifest:
+            writers[respos].writerow(["structure", "position", "residue", "profile", "seconds"])
+
+    scratch = make_scratch()
+    failed = []
+    built = 0
+    shared_ops = Counter()
+    try:
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(scratch,)) as pool:
+            futures = {pool.submit(build_mutant, task): task for task in tasks}
+            for future in as_completed(futures):
+                respos, restyp = futures[future][1:3]
+                try:
+                    output_file, seconds, ops = future.result()
+                except Exception as e:
+                    log_file = mutant_paths(modelname, respos, restyp)[1]
+                    print(f"Failed: {restyp}{respos}: {e} (see {log_file})")
+                    failed.append((respos, restyp))
+                    continue
+                built += 1
+                shared_ops.update(ops)
+                writers[respos].writerow([os.path.basename(output_file), respos, restyp,
+                                          profile, f"{seconds:.2f}"])
+                manifests[respos].flush()
+                print(f"Generated: {output_file} ({seconds:.1f} s)")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        for manifest in manifests.values():
+            manifest.close()
+    if built:
+        used = sum(shared_ops.values())
+        print(f"Shared file system operations: {used} "
+              f"({SHARED_OPS_BEFORE * built - used} saved by building in memory)")
+    return failed
 
-#delete the temporary file
-os.remove(modelname+restyp+respos+'.tmp')
 
 if __name__ == "__main__":
-    modelname, respos, chain = sys.argv[1:4]
-    generate_mutants(modelname, respos, chain)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build all 20 side-chain types at one or more residue positions")
+    parser.add_argument("modelname")
+    parser.add_argument("respos", help="residue number, or a comma-separated list of them")
+    parser.add_argument("chain")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: number of cores)")
+    parser.add_argument("--profile", choices=REFINEMENT_PROFILES, default="full-md",
+                        help="how much refinement every mutant gets")
+    args = parser.parse_args()
+
+    failed = generate_mutants(args.modelname, args.respos.split(","), args.chain, args.workers, args.profile)
+    sys.exit(1 if failed else 0)
@@ -1,81 +1,128 @@
+## Fixes every PDB file with PDBFixer and converts it to .mol with Open Babel, as one streaming pipeline:
+## the fixing workers (batch_pdbfixer.fix_directory) hand each fixed structure to a pool of conversion workers
+## as soon as it is ready, so the first .mol files appear while the rest are still being fixed.
+## At most queue_size fixed structures wait for conversion; when the queue is full the fixing pauses, which keeps
+## memory bounded. With keep_fixed_pdb = False the fixed structures are not written to fixed_pdb_dir; the fix cache
+## in fixed_pdb_dir/.fix_cache still keeps one copy, so a rerun does not fix unchanged inputs again. Set
+## cache_fixed_pdb = False as well to pass the fixed structures from one stage to the next in memory only.
+
 import os
-import subprocess
-from openmm.app import PDBFile
-from openmm.unit import nanometer
-from pdbfixer import PDBFixer
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from openbabel import openbabel    # Open Babel 3
+except ImportError:
+    import openbabel                   # Open Babel 2
+
+from batch_pdbfixer import fix_directory, MANIFEST
 
 # === USER CONFIGURATION ===
 
 # Input directory containing original PDB files to fix
-input_dir = '/Users/dilrana/Desktop/Kuczera/RGDdockedtop10PRODIGY/targets'   
+input_dir = '/Users/dilrana/Desktop/Kuczera/RGDdockedtop10PRODIGY/targets'
 
-# Temporary directory to save fixed PDB files before conversion
-fixed_pdb_dir = '/Users/dilrana/Desktop/Kuczera/RGDdockedtop10PRODIGY/fixedtargets' 
-os.makedirs(fixed_pdb_dir, exist_ok=True)
+# Directory for the fixed PDB files (and the fix cache and manifest)
+fixed_pdb_dir = '/Users/dilrana/Desktop/Kuczera/RGDdockedtop10PRODIGY/fixedtargets'
 
 # Output directory for final .mol files
-mol_output_dir = '/Users/dilrana/Desktop/Kuczera/RGDdockedtop10PRODIGY/molfiles'  
-os.makedirs(mol_output_dir, exist_ok=True)
+mol_output_dir = '/Users/dilrana/Desktop/Kuczera/RGDdockedtop10PRODIGY/molfiles'
 
 # PDBFixer settings
 add_missing_residues = True                 # Fix missing residues in middle of chains
 keep_heterogens_option = True               # True to keep water?, False for none
 ph_value = 7.4                             # pH for adding hydrogens
+ligand_chain = None                         # chain ID of the docked peptide, e.g. 'B': the shared receptor is
+                                            # fixed once and only the peptide and its interface per complex
+interface_cutoff = 5.0                      # receptor residues within this distance (A) of the peptide are refixed
+
+# Pipeline settings
+keep_fixed_pdb = True                       # False: no fixed structures written to fixed_pdb_dir
+cache_fixed_pdb = True                      # False: new fixed structures not added to the fix cache (reruns refix them)
+convert_workers = 1                         # Open Babel conversion processes (conversion is fast next to fixing)
+fix_workers = max(1, (os.cpu_count() or 1) - convert_workers)   # PDBFixer processes
+queue_size = 8                              # fixed structures waiting for conversion at most
 
 # Add water box/ion options here (optional)------------------------
 
-# Step 1: Batch fix PDB files using PDBFixer
-for filename in os.listdir(input_dir):
-    if not filename.lower().endswith('.pdb'):
-        continue
-    
-    input_file = os.path.join(input_dir, filename)
-    fixed_file = os.path.join(fixed_pdb_dir, filename)
-    print(f"Fixing {filename} ...")
-    
-    fixer = PDBFixer(filename=input_file)
-    
-    if add_missing_residues:
-        fixer.findMissingResidues()
-        # Remove terminal missing residues (optionally)
-        chains = list(fixer.topology.chains())
-        keys_to_delete = []
-        for key in fixer.missingResidues.keys():
-            chain = chains[key[0]]
-            if key[1] == 0 or key[1] == len(list(chain.residues())):
-                keys_to_delete.append(key)
-        for key in keys_to_delete:
-            del fixer.missingResidues[key]
-    
-    fixer.findNonstandardResidues()
-    fixer.replaceNonstandardResidues()
-    
-    fixer.removeHeterogens(keep_heterogens_option)  # True keeps water only
-    
-    fixer.findMissingAtoms()
-    fixer.addMissingAtoms()
-    
-    fixer.addMissingHydrogens(ph_value)
-    
-    # Optional: Code for Adding water box and ions goes here
-    
-    # Save fixed PDB
-    with open(fixed_file, 'w') as out_file:
-        PDBFile.writeFile(fixer.topology, fixer.positions, out_file)
-    
-    print(f"Fixed PDB saved as {fixed_file}")
-
-print("\n✅ All PDB files fixed successfully.\n")
-
-# Step 2: Convert fixed PDB files to MOL format using Open Babel
-for filename in os.listdir(fixed_pdb_dir):
-    if not filename.lower().endswith('.pdb'):
-        continue
-    fixed_file = os.path.join(fixed_pdb_dir, filename)
-    mol_file = os.path.join(mol_output_dir, os.path.splitext(filename)[0] + '.mol')
-    
-    cmd = ['obabel', '-ipdb', fixed_file, '-omol', '-O', mol_file]
-    print(f"Converting {filename} → {os.path.basename(mol_file)}")
-    subprocess.run(cmd, check=True)
-
-print(f"\n✅ Conversion complete. All .mol files saved in: {mol_output_dir}")
+# per-process converter, created once by init_converter (same as obabel -ipdb -omol)
+_converter = None
+
+def init_converter():
+    global _converter
+    openbabel.obErrorLog.SetOutputLevel(openbabel.obError)
+    _converter = openbabel.OBConversion()
+    _converter.SetInAndOutFormats("pdb", "mol")
+
+def convert_to_mol(task):
+    # runs in a conversion worker; returns (PDB file name, mol file, error message or None)
+    filename, pdb_text, mol_file = task
+    try:
+        mol = openbabel.OBMol()
+        if not _converter.ReadString(mol, pdb_text) or mol.NumAtoms() == 0:
+            return filename, mol_file, "could not read the fixed structure"
+        partial = mol_file + ".part"
+        if not _converter.WriteFile(mol, partial):
+            return filename, mol_file, "could not write MOL"
+        _converter.CloseOutFile()
+        os.replace(partial, mol_file)
+    except Exception as e:
+        return filename, mol_file, str(e)
+    return filename, mol_file, None
+
+def run_pipeline():
+    os.makedirs(mol_output_dir, exist_ok=True)
+    t0 = time.time()
+    converting = set()
+    converted = []
+    failed_conversions = []
+
+    def collect(futures):
+        for future in futures:
+            converting.discard(future)
+            filename, mol_file, error = future.result()
+            if error:
+                print(f"❌ Could not convert {filename}: {error}")
+                failed_conversions.append(filename)
+                continue
+            if not converted:
+                print(f"First .mol file after {time.time() - t0:.1f} s")
+            converted.append(filename)
+            print(f"Converted {filename} → {os.path.basename(mol_file)}")
+
+    with ProcessPoolExecutor(convert_workers, initializer=init_converter) as converter_pool:
+        def convert(filename, pdb_text):
+            # called by fix_directory as each structure is fixed; blocks while the queue is full
+            collect([future for future in converting if future.done()])
+            while len(converting) >= queue_size:
+                done, _ = wait(converting, return_when=FIRST_COMPLETED)
+                collect(done)
+            mol_file = os.path.join(mol_output_dir, os.path.splitext(filename)[0] + '.mol')
+            converting.add(converter_pool.submit(convert_to_mol, (filename, pdb_text, mol_file)))
+
+        # Fix PDB files using PDBFixer (parallel; unchanged inputs come from the cache) and convert them
+        # to MOL format using Open Babel as they come in
+        failed_fixes = fix_directory(input_dir, fixed_pdb_dir, fix_workers,
+                                     on_fixed=convert, keep_output=keep_fixed_pdb,
+                                     cache_results=cache_fixed_pdb,
+                                     ph=ph_value,
+                                     keep_heterogens="water" if keep_heterogens_option else "none",
+                                     missing_residues="internal" if add_missing_residues else "none",
+                                     replace_nonstandard=True,
+                                     ligand_chain=ligand_chain,
+                                     interface_cutoff=interface_cutoff)
+        while converting:
+            done, _ = wait(converting, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    print(f"\nConverted {len(converted)} files in {time.time() - t0:.1f} s")
+    if failed_fixes:
+        print(f"{len(failed_fixes)} PDB files could not be fixed, see {MANIFEST} in {fixed_pdb_dir}")
+    if failed_conversions:
+        print(f"{len(failed_conversions)} fixed files could not be converted")
+    if not failed_fixes and not failed_conversions:
+        print(f"✅ Conversion complete. All .mol files saved in: {mol_output_dir}")
+    return failed_fixes + failed_conversions
+
+if __name__ == "__main__":
+    run_pipeline()
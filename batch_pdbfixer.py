@@ -1,46 +1,504 @@
+## Function: fixes every PDB file in a directory with PDBFixer (missing residues and atoms, hydrogens at a given pH)
+## Files are fixed in a process pool. Every result is kept in a cache under a key hashed from the input bytes and the
+## fixing settings (pH, heterogens, missing-residue policy, nonstandard residues), so a rerun only fixes the files that
+## changed or were fixed with other settings; everything else is copied straight from the cache.
+## Per-file status, timings and errors are written to fix_manifest.csv in the output directory.
+## Receptor template mode (--ligand_chain): for complexes that share one receptor (e.g. 4g1m plus different docked
+## peptides) the receptor is fixed once and cached as a template; each complex then only fixes its ligand chain and
+## the receptor residues within --interface_cutoff of it, and those are merged back into the template. The fixing
+## cost of a complex then depends on the peptide, not on the receptor.
+# Command: python batch_pdbfixer.py [input_dir] [output_dir] [--workers N] [--ph 7.4] [--keep_heterogens all|water|none]
+#          [--missing_residues all|internal|none] [--replace_nonstandard] [--cache_dir DIR] [--no_cache]
+#          [--ligand_chain B] [--interface_cutoff 5.0]
+
+import io
 import os
+import csv
 import sys
+import time
+import shutil
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import openmm
+from openmm.app import PDBFile, Topology
+from openmm.unit import nanometer
 from pdbfixer import PDBFixer
-from openmm.app import PDBFile
+
+from interface import contact_pairs
 
 # Define input and output directories
 INPUT_DIR = "./pdb"
 OUTPUT_DIR = "./fixed_pdb_files"
 
-# Ensure output directory exists
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+MANIFEST = "fix_manifest.csv"
+MANIFEST_FIELDS = ("file", "key", "status", "seconds", "error")
 
-# List all PDB files in the directory
-pdb_files = [f for f in os.listdir(INPUT_DIR) if f.endswith(".pdb")]
+# bump when fix_structure changes, so results made by the old code are not served from the cache
+FIX_VERSION = 2
 
-if not pdb_files:
-    print("❌ No PDB files found in", INPUT_DIR)
-    sys.exit(1)
+# the fix_settings entries that fix_structure takes
+STRUCTURE_SETTINGS = ("ph", "keep_heterogens", "missing_residues", "replace_nonstandard")
 
-# Loop through each PDB file and process it
-for pdb_file in pdb_files:
-    input_path = os.path.join(INPUT_DIR, pdb_file)
-    output_path = os.path.join(OUTPUT_DIR, pdb_file)
+AMINO_ACIDS = {"ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE",
+               "LEU", "LYS", "MET", "PHE", "PRO", "SER", "THR", "TRP", "TYR", "VAL"}
 
-    print(f"🔄 Processing {pdb_file}...")
+def fix_settings(ph=7.4, keep_heterogens="all", missing_residues="all", replace_nonstandard=False,
+                 ligand_chain=None, interface_cutoff=5.0):
+    # keep_heterogens: all, water (removes everything else) or none
+    # missing_residues: all, internal (no missing tails at the chain ends) or none
+    # ligand_chain: chain ID of the docked ligand; switches on receptor template mode
+    if keep_heterogens not in ("all", "water", "none"):
+        raise ValueError(f"keep_heterogens must be all, water or none, not {keep_heterogens!r}")
+    if missing_residues not in ("all", "internal", "none"):
+        raise ValueError(f"missing_residues must be all, internal or none, not {missing_residues!r}")
+    if ligand_chain is not None and len(ligand_chain) != 1:
+        raise ValueError(f"ligand_chain must be a single chain ID, not {ligand_chain!r}")
+    settings = {"ph": float(ph), "keep_heterogens": keep_heterogens,
+                "missing_residues": missing_residues, "replace_nonstandard": bool(replace_nonstandard),
+                "ligand_chain": ligand_chain}
+    if ligand_chain is not None:
+        settings["interface_cutoff"] = float(interface_cutoff)
+    return settings
 
-    try:
-        # Load the PDB file into PDBFixer
-        fixer = PDBFixer(filename=input_path)
+def structure_settings(settings):
+    return {name: settings[name] for name in STRUCTURE_SETTINGS}
+
+def fix_key(data, settings):
+    # cache key of one input: its bytes plus everything that changes the fixed structure
+    h = hashlib.sha256(data)
+    h.update(repr((FIX_VERSION, openmm.__version__, sorted(settings.items()))).encode())
+    return h.hexdigest()
+
+def fix_structure(pdb_text, ph=7.4, keep_heterogens="all", missing_residues="all", replace_nonstandard=False):
+    # fixes one structure given as PDB text and returns the fixed PDB text
+    fixer = PDBFixer(pdbfile=io.StringIO(pdb_text))
 
-        # Add missing heavy atoms and hydrogens
+    if missing_residues == "none":
+        fixer.missingResidues = {}
+    else:
         fixer.findMissingResidues()
-        fixer.findMissingAtoms()
-        fixer.addMissingAtoms()
-        fixer.addMissingHydrogens(pH=7.4)  # Adjust pH if needed
+        if missing_residues == "internal":
+            # leave out missing residues at the start or end of a chain
+            chains = list(fixer.topology.chains())
+            for key in list(fixer.missingResidues):
+                chain = chains[key[0]]
+                if key[1] == 0 or key[1] == len(list(chain.residues())):
+                    del fixer.missingResidues[key]
+
+    if replace_nonstandard:
+        fixer.findNonstandardResidues()
+        fixer.replaceNonstandardResidues()
+    if keep_heterogens != "all":
+        fixer.removeHeterogens(keep_heterogens == "water")
+
+    fixer.findMissingAtoms()
+    fixer.addMissingAtoms()
+    fixer.addMissingHydrogens(ph)
+
+    out = io.StringIO()
+    PDBFile.writeFile(fixer.topology, fixer.positions, out)
+    return out.getvalue()
+
+## Receptor template mode
+
+def is_hydrogen(line):
+    # same rule as interface.read_complex: element column, else the atom name without leading digits
+    element = line[76:78].strip()
+    if element:
+        return element == "H"
+    return line[12:16].strip().lstrip("0123456789").startswith("H")
+
+def split_complex(pdb_text, ligand_chain):
+    # (receptor text, ligand lines, whether the ligand comes before the receptor)
+    receptor, ligand = [], []
+    last = None
+    ligand_first = None
+    for line in pdb_text.splitlines():
+        record = line[:6]
+        if record in ("ATOM  ", "HETATM", "ANISOU"):
+            last = ligand if line[21:22] == ligand_chain else receptor
+            if ligand_first is None and record != "ANISOU":
+                ligand_first = last is ligand
+            last.append(line)
+        elif record == "SEQRES":
+            if line[11:12] != ligand_chain:
+                receptor.append(line)
+        elif line.startswith("TER") and last is not None:
+            last.append(line)
+    if not any(line[:6] in ("ATOM  ", "HETATM") for line in ligand):
+        raise ValueError(f"no atoms in ligand chain {ligand_chain}")
+    if not any(line[:6] in ("ATOM  ", "HETATM") for line in receptor):
+        raise ValueError("no receptor atoms outside the ligand chain")
+    return "\n".join(receptor + ["END", ""]), ligand, bool(ligand_first)
+
+def receptor_key(receptor_text, settings):
+    # atom serial numbers are left out, so complexes written by tools that renumber atoms share one template
+    lines = []
+    for line in receptor_text.splitlines():
+        if line[:6] in ("ATOM  ", "HETATM"):
+            lines.append(line[:6] + line[12:54] + line[76:78])
+        elif line[:6] == "SEQRES":
+            lines.append(line)
+    return fix_key(("receptor\n" + "\n".join(lines)).encode(), structure_settings(settings))
+
+def interface_segments(topology, xyz, ligand_xyz, cutoff):
+    """Receptor residues to refix next to the ligand, and the runs of consecutive
+    residues (the refixed ones plus one flanking residue on each side) to cut
+    out of the template for them. The flanking residues only make sure the
+    refixed ones are not treated as chain termini; their fixed atoms are not used.
+    Disulfide cysteines and heterogens keep their template atoms."""
+    residues = list(topology.residues())
+    heavy = np.array([atom.index for atom in topology.atoms() if atom.element is not None and atom.element.symbol != "H"])
+    i, _ = contact_pairs(xyz[heavy] * 10, ligand_xyz, cutoff)
+    atoms = list(topology.atoms())
+    near = {atoms[heavy[k]].residue.index for k in np.unique(i)}
+
+    refix = set()
+    for r in near:
+        residue = residues[r]
+        names = {atom.name for atom in residue.atoms()}
+        if residue.name in AMINO_ACIDS and not (residue.name == "CYS" and "HG" not in names):
+            refix.add(r)
+
+    members = set()
+    for r in refix:
+        for k in (r - 1, r, r + 1):
+            if 0 <= k < len(residues) and residues[k].chain is residues[r].chain and residues[k].name in AMINO_ACIDS:
+                members.add(k)
+    runs = []
+    for k in sorted(members):
+        if runs and runs[-1][-1] == k - 1 and residues[k].chain is residues[k - 1].chain:
+            runs[-1].append(k)
+        else:
+            runs.append([k])
+    return refix, runs
+
+def fix_with_template(pdb_text, template, settings):
+    """Fix one complex against the fixed receptor template (topology, positions
+    in nm): the ligand chain and the receptor residues within interface_cutoff
+    of it are fixed together, then merged into a copy of the template."""
+    topology, xyz = template
+    ligand_chain = settings["ligand_chain"]
+    _, ligand_lines, ligand_first = split_complex(pdb_text, ligand_chain)
+    ligand_xyz = np.array([[float(line[30:38]), float(line[38:46]), float(line[46:54])] for line in ligand_lines
+                           if line[:6] in ("ATOM  ", "HETATM") and not is_hydrogen(line)])
+    refix, runs = interface_segments(topology, xyz, ligand_xyz, settings["interface_cutoff"])
+
+    # the interface as its own small structure: template heavy atoms of each run, then the ligand
+    residues = list(topology.residues())
+    part = Topology()
+    part_xyz = []
+    for run in runs:
+        chain = part.addChain(residues[run[0]].chain.id)
+        for k in run:
+            residue = part.addResidue(residues[k].name, chain, residues[k].id, residues[k].insertionCode)
+            for atom in residues[k].atoms():
+                if atom.element is not None and atom.element.symbol != "H":
+                    part.addAtom(atom.name, atom.element, residue)
+                    part_xyz.append(xyz[atom.index])
+    out = io.StringIO()
+    if runs:
+        PDBFile.writeFile(part, np.array(part_xyz) * nanometer, out, keepIds=True)
+    text = [line for line in out.getvalue().splitlines() if line[:6] in ("ATOM  ", "HETATM") or line.startswith("TER")]
+    options = structure_settings(settings)
+    options["missing_residues"] = "none"    # gaps are modelled in the template; docked ligands carry no SEQRES
+    fixed = PDBFile(io.StringIO(fix_structure("\n".join(text + ligand_lines + ["END", ""]), **options)))
+    fixed_xyz = fixed.getPositions(asNumpy=True).value_in_unit(nanometer)
+
+    fixed_chains = list(fixed.topology.chains())
+    fixed_residue = {}
+    for run, chain in zip(runs, fixed_chains):
+        chain_residues = list(chain.residues())
+        if len(chain_residues) != len(run):
+            raise ValueError("interface residues changed while fixing; fix this complex without the template")
+        fixed_residue.update(zip(run, chain_residues))
+    ligand_chains = fixed_chains[len(runs):]
+
+    # template with the refixed residues swapped in, the ligand before or after it as in the input
+    merged = Topology()
+    merged_xyz = []
+    atom_map = {}
+    merged_residues = {}
+    def copy_residue(residue, chain, source_xyz):
+        new = merged.addResidue(residue.name, chain, residue.id, residue.insertionCode)
+        for atom in residue.atoms():
+            atom_map[atom] = merged.addAtom(atom.name, atom.element, new)
+            merged_xyz.append(source_xyz[atom.index])
+        return new
+    def copy_ligand():
+        for chain in ligand_chains:
+            new_chain = merged.addChain(ligand_chain)
+            for residue in chain.residues():
+                copy_residue(residue, new_chain, fixed_xyz)
+
+    if ligand_first:
+        copy_ligand()
+    for chain in topology.chains():
+        new_chain = merged.addChain(chain.id)
+        for residue in chain.residues():
+            if residue.index in refix:
+                merged_residues[residue.index] = copy_residue(fixed_residue[residue.index], new_chain, fixed_xyz)
+            else:
+                merged_residues[residue.index] = copy_residue(residue, new_chain, xyz)
+    if not ligand_first:
+        copy_ligand()
+
+    for source in (topology, fixed.topology):
+        for atom1, atom2 in source.bonds():
+            if atom1 in atom_map and atom2 in atom_map:
+                merged.addBond(atom_map[atom1], atom_map[atom2])
+    # peptide bonds between a refixed residue and a template neighbour
+    for r in refix:
+        for first, second in ((r - 1, r), (r, r + 1)):
+            if first in refix and second in refix or first < 0 or second >= len(residues):
+                continue
+            if residues[first].chain is not residues[second].chain:
+                continue
+            c = [atom for atom in merged_residues[first].atoms() if atom.name == "C"]
+            n = [atom for atom in merged_residues[second].atoms() if atom.name == "N"]
+            if c and n:
+                merged.addBond(c[0], n[0])
+
+    out = io.StringIO()
+    PDBFile.writeFile(merged, np.array(merged_xyz) * nanometer, out)
+    return out.getvalue(), len(refix)
 
-        # Save the fixed PDB file
-        with open(output_path, "w") as out_file:
-            PDBFile.writeFile(fixer.topology, fixer.positions, out_file)
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + ".pdb")
 
-        print(f"✅ Successfully fixed and saved: {output_path}")
+def write_text(path, text):
+    partial = path + ".part"
+    with open(partial, "w") as f:
+        f.write(text)
+    os.replace(partial, path)
 
+def publish(cached_file, output_file):
+    # copy rather than hard link, so editing an output can never change the cache
+    partial = output_file + ".part"
+    shutil.copyfile(cached_file, partial)
+    os.replace(partial, output_file)
+
+def read_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, newline="") as f:
+        return {row["file"]: row for row in csv.DictReader(f)}
+
+def write_manifest(output_dir, rows):
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + ".part", "w", newline="") as f:
+        writer = csv.DictWriter(f, MANIFEST_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(path + ".part", path)
+
+# per-process settings, set once by init_worker
+_settings = None
+_cache_dir = None
+_cache_results = True
+# receptor templates of this process, parsed from the cache once: key -> (topology, positions in nm)
+_templates = {}
+
+def init_worker(settings, cache_dir, cache_results=True):
+    global _settings, _cache_dir, _cache_results
+    # one OpenMM thread per worker; the pool already uses every core
+    os.environ.setdefault("OPENMM_CPU_THREADS", "1")
+    _settings = settings
+    _cache_dir = cache_dir
+    _cache_results = cache_results
+
+def load_template(key):
+    if key not in _templates:
+        pdb = PDBFile(cache_path(_cache_dir, key))
+        _templates[key] = (pdb.topology, pdb.getPositions(asNumpy=True).value_in_unit(nanometer))
+    return _templates[key]
+
+def fix_receptor(task):
+    # runs in a worker process; fixes one receptor template into the cache
+    key, receptor_text = task
+    t0 = time.time()
+    try:
+        path = cache_path(_cache_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_text(path, fix_structure(receptor_text, **structure_settings(_settings)))
     except Exception as e:
-        print(f"❌ Error processing {pdb_file}: {e}")
+        return key, time.time() - t0, f"{type(e).__name__}: {e}"
+    return key, time.time() - t0, None
+
+def fix_text(task):
+    # runs in a worker process; returns (input file, key, seconds, error message or None, fixed PDB text or None)
+    input_file, key, template_key = task
+    t0 = time.time()
+    try:
+        with open(input_file) as f:
+            if template_key is None:
+                fixed = fix_structure(f.read(), **structure_settings(_settings))
+            else:
+                fixed, _ = fix_with_template(f.read(), load_template(template_key), _settings)
+        if _cache_results:
+            path = cache_path(_cache_dir, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_text(path, fixed)
+    except Exception as e:
+        return input_file, key, time.time() - t0, f"{type(e).__name__}: {e}", None
+    return input_file, key, time.time() - t0, None, fixed
+
+def fix_file(task):
+    # as fix_text, without sending the fixed structure back to the parent
+    return fix_text(task)[:4]
+
+def fix_directory(input_dir=INPUT_DIR, output_dir=OUTPUT_DIR, workers=None, cache_dir=None,
+                  on_fixed=None, keep_output=True, cache_results=True, max_pending=None, **settings):
+    """Fix every PDB file of input_dir into output_dir; returns the files that failed.
+
+    on_fixed(pdb_file, fixed_text) is called in this process for every file as soon as its
+    fixed structure is ready (from the cache or from a worker), so a later stage can start on
+    it right away; it may block, which pauses the fixing. keep_output=False leaves the fixed
+    files out of output_dir (the manifest is still written). cache_results=False only reads
+    the cache and stores no new results in it, apart from receptor templates, which the
+    workers load from there; with keep_output=False as well, fixed structures only reach
+    on_fixed. At most max_pending files (default: twice the workers) are being fixed at any time.
+    """
+    settings = fix_settings(**settings)
+    if cache_dir is None:
+        cache_dir = os.path.join(output_dir, ".fix_cache")
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    pdb_files = sorted(f for f in os.listdir(input_dir) if f.lower().endswith(".pdb"))
+    if not pdb_files:
+        print("❌ No PDB files found in", input_dir)
+        return []
+
+    previous = read_manifest(output_dir)
+    rows = {}
+    from_cache = deque()    # (file, cached result) still to hand to on_fixed
+    to_fix = {}    # key -> files with that content; identical inputs are fixed once
+    for pdb_file in pdb_files:
+        output_file = os.path.join(output_dir, pdb_file)
+        with open(os.path.join(input_dir, pdb_file), "rb") as f:
+            key = fix_key(f.read(), settings)
+        cached = cache_path(cache_dir, key)
+        if os.path.isfile(cached):
+            up_to_date = previous.get(pdb_file, {}).get("key") == key and os.path.isfile(output_file)
+            if keep_output and not up_to_date:
+                publish(cached, output_file)
+            rows[pdb_file] = {"file": pdb_file, "key": key, "status": "cached", "seconds": "0.00", "error": ""}
+            if on_fixed is not None:
+                from_cache.append((pdb_file, cached))
+        else:
+            to_fix.setdefault(key, []).append(pdb_file)
+    n_fix = sum(len(files) for files in to_fix.values())
+    print(f"🔄 {len(pdb_files) - n_fix} of {len(pdb_files)} files served from the cache, {n_fix} to fix")
+
+    failed = []
+    def fail(key, seconds, error):
+        for pdb_file in to_fix.pop(key):
+            print(f"❌ Error processing {pdb_file}: {error}")
+            rows[pdb_file] = {"file": pdb_file, "key": key, "status": "failed",
+                              "seconds": f"{seconds:.2f}", "error": error}
+            failed.append(pdb_file)
+
+    def send_cached():
+        pdb_file, cached = from_cache.popleft()
+        with open(cached) as f:
+            on_fixed(pdb_file, f.read())
+
+    # receptor template mode: which template every complex is fixed against, and which templates to fix first
+    template_keys = dict.fromkeys(to_fix)
+    receptors = {}
+    if settings["ligand_chain"] is not None:
+        for key, files in list(to_fix.items()):
+            with open(os.path.join(input_dir, files[0])) as f:
+                try:
+                    receptor_text, _, _ = split_complex(f.read(), settings["ligand_chain"])
+                except ValueError as e:
+                    fail(key, 0.0, f"ValueError: {e}")
+                    continue
+            template_keys[key] = receptor_key(receptor_text, settings)
+            if not os.path.isfile(cache_path(cache_dir, template_keys[key])):
+                receptors[template_keys[key]] = receptor_text
+
+    t0 = time.time()
+    if to_fix:
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(settings, cache_dir, cache_results)) as pool:
+            for template_key, seconds, error in pool.map(fix_receptor, receptors.items()):
+                if error:
+                    for key in [k for k in to_fix if template_keys[k] == template_key]:
+                        fail(key, seconds, f"receptor template: {error}")
+                else:
+                    print(f"✅ Fixed receptor template {template_key[:12]} in {seconds:.1f} s")
+
+            tasks = deque((os.path.join(input_dir, files[0]), key, template_keys[key]) for key, files in to_fix.items())
+            total = len(tasks)
+            window = max_pending or 2 * (workers or os.cpu_count() or 1)
+            task_fn = fix_file if on_fixed is None and cache_results else fix_text
+            running = set()
+            done = 0
+            while tasks or running:
+                while tasks and len(running) < window:
+                    running.add(pool.submit(task_fn, tasks.popleft()))
+                finished = {future for future in running if future.done()}
+                if not finished and from_cache:
+                    # keep the next stage busy with cached files while the workers fix
+                    send_cached()
+                    continue
+                if not finished:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    running.discard(future)
+                    done += 1
+                    input_file, key, seconds, error = future.result()[:4]
+                    if error:
+                        fail(key, seconds, error)
+                        continue
+                    for pdb_file in to_fix[key]:
+                        if keep_output and cache_results:
+                            publish(cache_path(cache_dir, key), os.path.join(output_dir, pdb_file))
+                        elif keep_output:
+                            write_text(os.path.join(output_dir, pdb_file), future.result()[4])
+                        print(f"✅ Fixed {pdb_file} in {seconds:.1f} s ({done}/{total})")
+                        rows[pdb_file] = {"file": pdb_file, "key": key, "status": "fixed",
+                                          "seconds": f"{seconds:.2f}", "error": ""}
+                        if on_fixed is not None:
+                            on_fixed(pdb_file, future.result()[4])
+        print(f"Fixed {n_fix - len(failed)} files in {time.time() - t0:.1f} s, {len(failed)} failed")
+    while from_cache:
+        send_cached()
+
+    write_manifest(output_dir, [rows[f] for f in pdb_files])
+    if keep_output:
+        print(f"🎉 Batch fixing completed! Fixed files are in {output_dir}, see {MANIFEST} for timings and errors.")
+    else:
+        print(f"🎉 Batch fixing completed! See {MANIFEST} in {output_dir} for timings and errors.")
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fix every PDB file in a directory with PDBFixer, reusing cached results")
+    parser.add_argument("input_dir", nargs="?", default=INPUT_DIR)
+    parser.add_argument("output_dir", nargs="?", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: number of cores)")
+    parser.add_argument("--ph", type=float, default=7.4, help="pH for adding hydrogens (default 7.4)")
+    parser.add_argument("--keep_heterogens", choices=("all", "water", "none"), default="all")
+    parser.add_argument("--missing_residues", choices=("all", "internal", "none"), default="all",
+                        help="internal skips missing residues at the chain ends")
+    parser.add_argument("--replace_nonstandard", action="store_true", help="replace nonstandard residues")
+    parser.add_argument("--cache_dir", default=None, help="default: <output_dir>/.fix_cache")
+    parser.add_argument("--no_cache", action="store_true", help="use the cache, but do not add the new results to it")
+    parser.add_argument("--ligand_chain", default=None,
+                        help="chain ID of the docked ligand; fixes the shared receptor once and reuses it")
+    parser.add_argument("--interface_cutoff", type=float, default=5.0,
+                        help="receptor residues within this distance (A) of the ligand are refixed (default 5.0)")
+    args = parser.parse_args()
 
-print("🎉 Batch fixing completed! Check the 'fixed_pdb_files' directory.")
\ No newline at end of file
+    failed = fix_directory(args.input_dir, args.output_dir, args.workers, args.cache_dir,
+                           cache_results=not args.no_cache, ph=args.ph, keep_heterogens=args.keep_heterogens,
+                           missing_residues=args.missing_residues, replace_nonstandard=args.replace_nonstandard,
+                           ligand_chain=args.ligand_chain, interface_cutoff=args.interface_cutoff)
+    sys.exit(1 if failed else 0)
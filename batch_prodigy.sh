@@ -1,12 +1,28 @@
 #!/bin/bash
 
+# Chain(s) of the docked peptide, e.g. LIGAND_CHAIN=C ./batch_prodigy.sh
+# When set, interface.py picks the receptor chains that touch the peptide for PRODIGY's --selection
+# (same 5.5 A contact cutoff as PRODIGY), and complexes without any contact are skipped.
+LIGAND_CHAIN="${LIGAND_CHAIN:-}"
+INTERFACE_PY="$(dirname "$0")/interface.py"
+
 # Process all PDB files in directory
 for pdb_file in *.pdb; do
     # Generate base name without extension
     base_name=$(basename "${pdb_file}" .pdb)
     
+    # Restrict Prodigy to the chains in contact with the peptide
+    selection=()
+    if [ -n "${LIGAND_CHAIN}" ]; then
+        if ! chains=$(python3 "${INTERFACE_PY}" "${pdb_file}" all "${LIGAND_CHAIN}" --selection --cutoff 5.5); then
+            echo "${base_name}: no contact with chain ${LIGAND_CHAIN}, skipped"
+            continue
+        fi
+        selection=(--selection ${chains})
+    fi
+
     # Run Prodigy and save to log file
-    prodigy "${pdb_file}" --temperature 25.0 > "${base_name}.log" 2>&1
+    prodigy "${pdb_file}" "${selection[@]}" --temperature 25.0 > "${base_name}.log" 2>&1
 
     # Extract relevant data from log file
     predicted_affinity=$(grep -oP 'Predicted affinity: \K[-\d.]+' "${base_name}.log")
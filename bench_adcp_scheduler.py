@@ -0,0 +1,101 @@
+## Benchmark: compares the old 1-second poll loop of runADCP with the event-driven ADCPScheduler.
+## A fake adcp binary that sleeps for a random short time stands in for adcp_Linux-x86_64,
+## so the benchmark runs anywhere and only measures scheduling overhead.
+# command: python bench_adcp_scheduler.py [nbRuns] [ncores]
+## ex: python bench_adcp_scheduler.py 50 8
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import subprocess
+from time import time, sleep
+
+from ADCPdock import ADCPScheduler
+
+FAKE_ADCP = """#!%s
+import sys, time, random
+seed = int(sys.argv[sys.argv.index('-s') + 1])
+rng = random.Random(seed)
+duration = rng.uniform(%f, %f)
+time.sleep(duration)
+print('best target energy %%.3f' %% rng.uniform(-30.0, -10.0))
+print('slept %%.4f' %% duration)
+"""
+
+def make_fake_adcp(workdir, min_time=0.2, max_time=1.5):
+    path = os.path.join(workdir, 'adcp_fake')
+    with open(path, 'w') as f:
+        f.write(FAKE_ADCP % (sys.executable, min_time, max_time))
+    os.chmod(path, 0o755)
+    return path
+
+def make_commands(binary, nbRuns, jobName='bench', seed=1):
+    commands = []
+    for jobNum in range(1, nbRuns+1):
+        commands.append('%s -t 2 sscsscplsk -r 1x100 -s %d -o %s_%d.pdb > %s_%d.out 2>&1'
+                        % (binary, seed+jobNum-1, jobName, jobNum, jobName, jobNum))
+    return commands
+
+def busy_time(workdir, nbRuns, jobName='bench'):
+    # total time the fake children actually spent working
+    total = 0.0
+    for jobNum in range(1, nbRuns+1):
+        with open(os.path.join(workdir, '%s_%d.out' % (jobName, jobNum))) as f:
+            for ln in f:
+                if ln.startswith('slept'):
+                    total += float(ln.split()[1])
+    return total
+
+def run_poll_loop(commands, ncores, workdir):
+    # the scheduling loop runADCP.__call__ used before ADCPScheduler
+    procToRun = {}
+    nbStart = 0
+    nbDone = 0
+    for cmd in commands[:ncores]:
+        proc = subprocess.Popen(cmd, shell=True, cwd=workdir)
+        procToRun[proc] = nbStart
+        nbStart += 1
+    while nbDone < len(commands):
+        for proc, jnum in list(procToRun.items()):
+            if proc.poll() is not None:
+                nbDone += 1
+                del procToRun[proc]
+                if nbStart < len(commands):
+                    newProc = subprocess.Popen(commands[nbStart], shell=True, cwd=workdir)
+                    procToRun[newProc] = nbStart
+                    nbStart += 1
+        sleep(1)
+
+def run_scheduler(commands, ncores, workdir):
+    scheduler = ADCPScheduler(ncores)
+    futures = [scheduler.submit(cmd, workdir, jnum) for jnum, cmd in enumerate(commands)]
+    for future in futures:
+        future.result()
+    scheduler.shutdown()
+
+def benchmark(name, runner, nbRuns, ncores):
+    workdir = tempfile.mkdtemp(prefix='adcpbench_')
+    try:
+        binary = make_fake_adcp(workdir)
+        commands = make_commands(binary, nbRuns)
+        t0 = time()
+        runner(commands, ncores, workdir)
+        wall = time()-t0
+        busy = busy_time(workdir, nbRuns)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    utilisation = busy/(ncores*wall)
+    print('%-12s wall %7.2f s   busy %7.2f core-s   core utilisation %5.1f%%'
+          % (name, wall, busy, 100*utilisation))
+    return wall, utilisation
+
+if __name__ == '__main__':
+    nbRuns = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    ncores = int(sys.argv[2]) if len(sys.argv) > 2 else min(8, os.cpu_count())
+    random.seed(0)
+    print('%d fake ADCP runs on %d cores' % (nbRuns, ncores))
+    before = benchmark('poll loop', run_poll_loop, nbRuns, ncores)
+    after = benchmark('scheduler', run_scheduler, nbRuns, ncores)
+    print('speedup %.2fx' % (before[0]/after[0]))
@@ -0,0 +1,45 @@
+## Benchmark: cost of the PyMOL visualisation hooks in AAscan.scanning.
+## Runs the same scan headless (--PyMOLMover_ip=off), with every mutant sent to PyMOL,
+## and with only every Nth mutant sent. PyMOLMover sends UDP packets, so no PyMOL
+## needs to be listening; the timings show what the packets and rescoring cost.
+# command: python bench_scan_pymol.py complex.pdb [partners] [amino acids] [every] [workers]
+## ex: python bench_scan_pymol.py ../test/data/test_dock.pdb A_B AVW 20 4
+
+import os
+import sys
+import shutil
+import tempfile
+from time import time
+
+from AAscan import scanning
+
+def run_scan(pdb_filename, partners, mutant_aa_list, pymol_ip, pymol_every, workers):
+    workdir = tempfile.mkdtemp(prefix='scanbench_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        t0 = time()
+        scanning(pdb_filename, partners, mutant_aa_list, trial_output='bench',
+                 workers=workers, pymol_ip=pymol_ip, pymol_every=pymol_every)
+        return time()-t0
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    pdb_filename = os.path.abspath(sys.argv[1])
+    partners = sys.argv[2] if len(sys.argv) > 2 else 'A_B'
+    mutant_aa_list = list(sys.argv[3]) if len(sys.argv) > 3 else ['A']
+    every = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+    workers = int(sys.argv[5]) if len(sys.argv) > 5 else None
+
+    timings = []
+    for name, pymol_ip, pymol_every in (('headless', 'off', 1),
+                                        ('pymol all', 'on', 1),
+                                        ('pymol 1/%d' % every, 'on', every)):
+        timings.append((name, run_scan(pdb_filename, partners, mutant_aa_list,
+                                       pymol_ip, pymol_every, workers)))
+    print('='*80)
+    headless = timings[0][1]
+    for name, wall in timings:
+        print('%-12s wall %8.2f s   %+6.1f%% vs headless' % (name, wall, 100*(wall-headless)/headless))
@@ -1,39 +1,23 @@
-## Function: Code converts all pdb files in a directory into pdbqt at a particular residue position 
-# command: python convert_to_pdbqt.py 1699
+## Function: Code converts all pdb files in a directory into pdbqt at a particular residue position
+## The files go through the pooled in-process converter of convert_pdbqt_dir.py (same settings as
+## obabel -xr -p 7.4 --partialcharge gasteiger --kekulize); finished files are skipped on a rerun.
+# command: python convert_pdbqt_1res.py 1699 [workers]
 # (1699) = residue position
 
-import os
-import subprocess
+import sys
 
-def convert_to_pdbqt(residue_pos):
+from convert_pdbqt_dir import convert_directory
+
+def convert_to_pdbqt(residue_pos, workers=None):
     mutants_dir = f"Mutants_{residue_pos}"
     pdbqt_dir = f"PDBQT_{residue_pos}"
-
-    os.makedirs(pdbqt_dir, exist_ok=True)
-
-    for pdb_file in os.listdir(mutants_dir):
-        if pdb_file.endswith(".pdb"):
-            input_file = os.path.join(mutants_dir, pdb_file)
-            output_file = os.path.join(pdbqt_dir, pdb_file.replace(".pdb", ".pdbqt"))
-            
-            command = [
-                "obabel",
-                input_file,
-                "-O", output_file,
-                "-xr",
-                "-p", "7.4",
-                "--partialcharge", "gasteiger", 
-                "--kekulize"
-            ]
-            
-            subprocess.run(command, check=True)
-
-    print(f"Conversion complete. PDBQT files are in {pdbqt_dir}")
+    return convert_directory(mutants_dir, pdbqt_dir, workers)
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 2:
-        print("Usage: python convert_to_pdbqt.py <residue_position>")
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python convert_pdbqt_1res.py <residue_position> [workers]")
         sys.exit(1)
-    
-    convert_to_pdbqt(sys.argv[1])
\ No newline at end of file
+
+    workers = int(sys.argv[2]) if len(sys.argv) == 3 else None
+    failed = convert_to_pdbqt(sys.argv[1], workers)
+    sys.exit(1 if failed else 0)
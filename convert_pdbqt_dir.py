@@ -1,34 +1,106 @@
 ## Func: converts an entire directory of pdb files into pdbqts
-# Command: python convert_pdbqt_dir.py <directory>
+## Conversion service: each of N worker processes sets up one Open Babel converter (the same settings as
+## obabel -xr -p 7.4 --partialcharge gasteiger --kekulize) and the files are streamed through the pool,
+## so there is no obabel start-up or plugin loading per file.
+## Outputs are written as .part and renamed into place; files already converted are skipped, so an
+## interrupted directory can simply be run again.
+# Command: python convert_pdbqt_dir.py <directory> [--output_dir PDBQT_<directory>] [--workers N] [--overwrite]
 
-import openbabel
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-def convert_to_pdbqt_with_kekulization(input_dir):
+try:
+    from openbabel import openbabel    # Open Babel 3
+except ImportError:
+    import openbabel                   # Open Babel 2
+
+# general options, as on the obabel command line
+GENERAL_OPTIONS = (("p", "7.4"),                  # add hydrogens for pH 7.4
+                   ("partialcharge", "gasteiger"),
+                   ("kekulize", None))
+
+def make_converter():
     obConversion = openbabel.OBConversion()
     obConversion.SetInAndOutFormats("pdb", "pdbqt")
-    
-    pdbqt_dir = f"PDBQT_{input_dir}"
+    obConversion.AddOption("r", openbabel.OBConversion.OUTOPTIONS)  # rigid molecule, no torsion tree
+    for option, value in GENERAL_OPTIONS:
+        if value is None:
+            obConversion.AddOption(option, openbabel.OBConversion.GENOPTIONS)
+        else:
+            obConversion.AddOption(option, openbabel.OBConversion.GENOPTIONS, value)
+    return obConversion
+
+# per-process converter, created once by init_worker
+_converter = None
+
+def init_worker():
+    global _converter
+    openbabel.obErrorLog.SetOutputLevel(openbabel.obError)
+    _converter = make_converter()
+
+def convert_file(task):
+    # runs in a worker process; returns (input file, error message or None)
+    input_file, output_file = task
+    try:
+        mol = openbabel.OBMol()
+        if not _converter.ReadFile(mol, input_file) or mol.NumAtoms() == 0:
+            return input_file, "could not read structure"
+        # ReadFile/WriteFile skip the general options obabel applies, so run them here
+        mol.DoTransformations(_converter.GetOptions(openbabel.OBConversion.GENOPTIONS), _converter)
+        partial = output_file + ".part"
+        if not _converter.WriteFile(mol, partial):
+            return input_file, "could not write PDBQT"
+        _converter.CloseOutFile()
+        os.replace(partial, output_file)
+    except Exception as e:
+        return input_file, str(e)
+    return input_file, None
+
+def convert_directory(input_dir, pdbqt_dir=None, workers=None, overwrite=False):
+    if pdbqt_dir is None:
+        pdbqt_dir = f"PDBQT_{os.path.basename(os.path.normpath(input_dir))}"
     os.makedirs(pdbqt_dir, exist_ok=True)
 
-    for file in os.listdir(input_dir):
+    tasks = []
+    total = 0
+    for file in sorted(os.listdir(input_dir)):
         if file.endswith(".pdb"):
-            input_file = os.path.join(input_dir, file)
+            total += 1
             output_file = os.path.join(pdbqt_dir, file.replace(".pdb", ".pdbqt"))
-            
-            mol = openbabel.OBMol()
-            obConversion.ReadFile(mol, input_file)
-            
-            # Perform kekulization
-            openbabel.OBKekulize(mol)
-            
-            # Set options for PDBQT conversion
-            obConversion.AddOption("r", openbabel.OBConversion.OUTOPTIONS)  # Remove hydrogens
-            obConversion.AddOption("p", openbabel.OBConversion.OUTOPTIONS)  # Add polar hydrogens
-            obConversion.AddOption("x", openbabel.OBConversion.OUTOPTIONS)  # Compute partial charges
-            
-            # Convert to PDBQT
-            obConversion.WriteFile(mol, output_file)
-            
-            print(f"Converted {file} to {output_file} with kekulization.")
-
-    print(f"Conversion complete. PDBQT files are in {pdbqt_dir}")
\ No newline at end of file
+            if overwrite or not os.path.isfile(output_file):
+                tasks.append((os.path.join(input_dir, file), output_file))
+    print(f"{total - len(tasks)} of {total} files already converted, {len(tasks)} to go")
+
+    failed = []
+    t0 = time.time()
+    with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+        for done, (input_file, error) in enumerate(pool.map(convert_file, tasks, chunksize=16), 1):
+            if error:
+                print(f"Failed: {input_file}: {error}")
+                failed.append(input_file)
+            if done % 500 == 0:
+                print(f"{done}/{len(tasks)} files, {done / (time.time() - t0):.1f} files/s")
+    seconds = time.time() - t0
+    if tasks:
+        print(f"Converted {len(tasks) - len(failed)} files in {seconds:.1f} s "
+              f"({len(tasks) / seconds:.1f} files/s), {len(failed)} failed")
+    print(f"Conversion complete. PDBQT files are in {pdbqt_dir}")
+    return failed
+
+# kept for existing callers
+def convert_to_pdbqt_with_kekulization(input_dir):
+    return convert_directory(input_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert every PDB file in a directory to PDBQT")
+    parser.add_argument("input_dir")
+    parser.add_argument("--output_dir", default=None, help="default: PDBQT_<input_dir>")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: number of cores)")
+    parser.add_argument("--overwrite", action="store_true", help="convert files that already have a PDBQT")
+    args = parser.parse_args()
+
+    failed = convert_directory(args.input_dir, args.output_dir, args.workers, args.overwrite)
+    sys.exit(1 if failed else 0)
@@ -1,18 +1,34 @@
 """
 multi_rmsdByRes.py
 Author: Docking & Dynamics GPT (2025)
-Purpose: Batch per-residue RMSD analysis in PyMOL for multiple PDBs vs a single reference.
+Purpose: Batch per-residue RMSD analysis for multiple PDBs vs a single reference.
 
-Usage (headless):
-    pymol -cq multi_rmsdByRes.py
+Usage (headless, no PyMOL needed):
+    python multi_rmsdByRes.py
 
 Dependencies:
-    - PyMOL (>=2.4)
-    - Your original rmsdByRes() function must be defined or loaded before this script.
+    - NumPy
+    - superpose.py (in this directory) for the batched alignment
+
+How it works:
+    The reference and every model are parsed once into coordinate arrays
+    keyed by (chain, resi, atom name). All models are stacked into one
+    (models, atoms, 3) array, so the all-atom, CA, backbone and
+    symmetry-corrected RMSD of every residue of every model comes out of a
+    handful of array operations instead of one PyMOL call per selection.
+
+    With perform_alignment, every model is superposed on the fit chains
+    (the receptor by default: every chain except the peptide), and the
+    peptide RMSD is measured in that frame, so it reports how far the docked
+    peptide is displaced from the reference one. Only when the reference has
+    no fit chain is the peptide fitted onto itself, which measures shape
+    differences alone.
 """
 
 import os, glob
-from pymol import cmd
+import numpy as np
+
+from superpose import superpose
 
 ### === USER PARAMETERS ======================================================
 
@@ -22,98 +38,282 @@ target_chain = "A"                   # peptide chain in docked models
 target_folder = "targets"            # folder containing target PDB files
 output_csv = "rmsdByRes_allModels.csv"
 perform_alignment = True             # set False if already pre-aligned
-selection = f"chain {reference_chain} and polymer"  # region of interest
+alignment_cycles = 5                 # outlier rejection cycles (as PyMOL align)
+alignment_cutoff = 2.0               # reject atoms deviating > cutoff * RMSD
+alignment_csv = "alignment_allModels.csv"  # global RMSD of every model's fit
+fit_reference_chains = None          # chains the fit is computed on in the reference, e.g. "AB";
+                                     # None: every chain except reference_chain (the receptor)
+fit_target_chains = None             # the same chains in the docked models, matched in order
+fit_atom_names = ('CA',)             # atoms of the fit chains used for the fit; None for all
 
 ### =========================================================================
 
-# Load the reference structure
-cmd.load(reference_file, "reference")
-ref_chain_sel = f"reference and chain {reference_chain}"
+BACKBONE = ('N', 'CA', 'C', 'O')
+
+# Symmetric (or ambiguously assigned) side chains. Each residue type maps to
+# independent flip groups; a group is a list of atom-name pairs that are
+# swapped together, hydrogens included so protonated models stay consistent.
+# HIS, ASN and GLN are not truly symmetric, but their ring/amide flips are
+# ambiguous in crystal structures and are treated the same way.
+SYMMETRY_TABLE = {
+    'ASP': [[('OD1', 'OD2')]],
+    'GLU': [[('OE1', 'OE2')]],
+    'ARG': [[('NH1', 'NH2'), ('HH11', 'HH21'), ('HH12', 'HH22')]],
+    'PHE': [[('CD1', 'CD2'), ('CE1', 'CE2'), ('HD1', 'HD2'), ('HE1', 'HE2')]],
+    'TYR': [[('CD1', 'CD2'), ('CE1', 'CE2'), ('HD1', 'HD2'), ('HE1', 'HE2')]],
+    'LEU': [[('CD1', 'CD2'), ('HD11', 'HD21'), ('HD12', 'HD22'), ('HD13', 'HD23')]],
+    'VAL': [[('CG1', 'CG2'), ('HG11', 'HG21'), ('HG12', 'HG22'), ('HG13', 'HG23')]],
+    'HIS': [[('ND1', 'CD2'), ('CE1', 'NE2'), ('HD1', 'HD2'), ('HE1', 'HE2')]],
+    'ASN': [[('OD1', 'ND2'), ('HD21', 'HD22')]],
+    'GLN': [[('OE1', 'NE2'), ('HE21', 'HE22')]],
+}
+
+
+def symmetry_permutations(resn, names):
+    """Return every equivalent atom ordering of one residue as an index array
+    of shape (permutations, atoms); row 0 is the identity.
+
+    Pairs whose atoms are not both present are ignored, and all 2**groups
+    combinations of the residue's flip groups are enumerated.
+    """
+    position = {name: i for i, name in enumerate(names)}
+    perms = [np.arange(len(names))]
+    for group in SYMMETRY_TABLE.get(resn, []):
+        pairs = [(position[a], position[b]) for a, b in group
+                 if a in position and b in position]
+        if not pairs:
+            continue
+        flipped = []
+        for perm in perms:
+            perm = perm.copy()
+            for i, j in pairs:
+                perm[i], perm[j] = perm[j], perm[i]
+            flipped.append(perm)
+        perms.extend(flipped)
+    return np.array(perms)
+
+
+def read_chain(pdb_file, chain):
+    """Return {(chain, resi, atom name): (resn, xyz)} for the polymer atoms of one chain.
+
+    Alternate locations other than blank/A are skipped (PyMOL's "not alt B").
+    An empty chain ID reads every chain; several IDs ("AB") read each of them.
+    """
+    atoms = {}
+    with open(pdb_file) as f:
+        for line in f:
+            if not line.startswith('ATOM'):
+                continue
+            if chain and line[21] not in chain:
+                continue
+            if line[16] not in (' ', 'A'):
+                continue
+            key = (line[21], line[22:27].strip(), line[12:16].strip())
+            if key in atoms:
+                continue
+            xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+            atoms[key] = (line[17:20].strip(), xyz)
+    return atoms
+
+
+def fit_atoms(atoms, peptide_chain, fit_chains):
+    """Return {(k, resi, atom name): xyz} of the atoms the superposition is
+    computed on, k being the chain's position in fit_chains so that receptors
+    with different chain IDs in the reference and the models still match.
+    fit_chains None means every chain except the peptide, in alphabetical order.
+    """
+    chains = fit_chains or sorted({chain for chain, resi, name in atoms} - {peptide_chain})
+    return {(chains.index(chain), resi, name): xyz
+            for (chain, resi, name), (resn, xyz) in atoms.items()
+            if chain in chains and (fit_atom_names is None or name in fit_atom_names)}
+
+
+def pick_chain(atoms, chain):
+    """The atoms of one chain of a read_chain dict."""
+    return {key: value for key, value in atoms.items() if key[0] == chain}
+
+
+class ResidueLayout:
+    """Atom ordering of the reference chain, grouped residue by residue.
+
+    Residues without a CA in the reference are left out, as the PyMOL
+    version only iterated over reference CA atoms.
+    """
+
+    def __init__(self, ref_atoms):
+        by_residue = {}
+        order = []
+        for (chain, resi, name), (resn, xyz) in ref_atoms.items():
+            if resi not in by_residue:
+                by_residue[resi] = (resn, [])
+                order.append(resi)
+            by_residue[resi][1].append((name, xyz))
 
-# Prepare output
-if os.path.exists(output_csv):
-    os.remove(output_csv)
-header = "modelID,resName,resID,allAtomRMSD,rmsdResCa,rmsdResBackbone,allAtomRMSDMin\n"
-with open(output_csv, 'w') as f:
-    f.write(header)
+        self.resi = []
+        self.resn = []
+        self.names = []
+        coords = []
+        starts = []
+        for resi in order:
+            resn, atoms = by_residue[resi]
+            if 'CA' not in [name for name, xyz in atoms]:
+                continue
+            starts.append(len(self.names))
+            self.resi.append(resi)
+            self.resn.append(resn)
+            for name, xyz in atoms:
+                self.names.append(name)
+                coords.append(xyz)
 
-# Collect target files
-target_files = sorted(glob.glob(os.path.join(target_folder, "*.pdb")))
-print(f"\nFound {len(target_files)} target structures to process.\n")
+        self.coords = np.array(coords, dtype=float)
+        self.starts = np.array(starts, dtype=int)
+        self.residue_of_atom = np.repeat(np.arange(len(starts)),
+                                         np.diff(np.append(self.starts, len(self.names))))
+        self.counts = np.bincount(self.residue_of_atom, minlength=len(starts))
+        self.index = {(self.resi[r], name): i
+                      for i, (r, name) in enumerate(zip(self.residue_of_atom, self.names))}
+        self.ca = np.array([self.index[(resi, 'CA')] for resi in self.resi])
+        self.backbone = np.array([name in BACKBONE for name in self.names])
+        self.symmetry_groups = self._symmetry_groups()
 
-for target_file in target_files:
-    model_name = os.path.splitext(os.path.basename(target_file))[0]
-    cmd.load(target_file, model_name)
-    target_sel = f"{model_name} and chain {reference_chain}"
+    def _symmetry_groups(self):
+        """Group the symmetric residues by (type, atom names).
 
-    print(f"→ Processing {model_name}")
+        Each group is (residue numbers, atom indices (residues, atoms),
+        permutations (permutations, atoms)), so one gather covers every
+        residue of the group and every permutation at once.
+        """
+        groups = {}
+        for r, resn in enumerate(self.resn):
+            if resn not in SYMMETRY_TABLE:
+                continue
+            atoms = np.arange(self.starts[r], self.starts[r] + self.counts[r])
+            key = (resn, tuple(self.names[i] for i in atoms))
+            groups.setdefault(key, ([], []))
+            groups[key][0].append(r)
+            groups[key][1].append(atoms)
+        result = []
+        for (resn, names), (residues, atoms) in groups.items():
+            perms = symmetry_permutations(resn, names)
+            if len(perms) > 1:
+                result.append((np.array(residues), np.array(atoms), perms))
+        return result
 
-    # Optional: Align target to reference
+    def stack(self, model_atoms):
+        """Return the model's coordinates in reference atom order (NaN where
+        missing) and the number of atoms it has in each reference residue."""
+        coords = np.full((len(self.names), 3), np.nan)
+        present = np.zeros(len(self.resi), dtype=int)
+        residue_index = {resi: r for r, resi in enumerate(self.resi)}
+        for (chain, resi, name), (resn, xyz) in model_atoms.items():
+            if resi in residue_index:
+                present[residue_index[resi]] += 1
+            i = self.index.get((resi, name))
+            if i is not None:
+                coords[i] = xyz
+        return coords, present
+
+
+def per_residue_rmsd(layout, models, present):
+    """Return (all-atom, CA, backbone, symmetry-corrected) RMSD arrays of shape
+    (models, residues) and a mask of the residues whose atoms match."""
+    ref = layout.coords
+    d2 = ((models - ref) ** 2).sum(axis=2)
+
+    complete = ~np.add.reduceat(np.isnan(d2), layout.starts, axis=1).astype(bool)
+    valid = complete & (present == layout.counts)
+    d2 = np.nan_to_num(d2)
+
+    rms_all = np.sqrt(np.add.reduceat(d2, layout.starts, axis=1) / layout.counts)
+    rms_min = symmetric_min_rmsd(layout, models, rms_all)
+    rms_ca = np.sqrt(d2[:, layout.ca])
+    bb_counts = np.add.reduceat(layout.backbone.astype(float), layout.starts)
+    rms_bb = np.sqrt(np.add.reduceat(d2 * layout.backbone, layout.starts, axis=1)
+                     / np.maximum(bb_counts, 1))
+    return rms_all, rms_ca, rms_bb, rms_min, valid
+
+
+def symmetric_min_rmsd(layout, models, rms_all):
+    """Minimum all-atom RMSD over every symmetry-equivalent atom ordering.
+
+    For each residue group the model coordinates are gathered as
+    (models, residues, permutations, atoms, 3) in one indexing operation and
+    compared with the reference, so no permuted copies of structures are made.
+    """
+    rms_min = rms_all.copy()
+    for residues, atoms, perms in layout.symmetry_groups:
+        ref = layout.coords[atoms]                         # (R, A, 3)
+        mob = models[:, atoms[:, perms]]                   # (M, R, P, A, 3)
+        d2 = np.nan_to_num(((mob - ref[:, None]) ** 2).sum(axis=-1)).sum(axis=-1)
+        rms_min[:, residues] = np.sqrt(d2.min(axis=-1) / atoms.shape[1])
+    return rms_min
+
+
+def main():
+    ref_atoms = read_chain(reference_file, '')
+    layout = ResidueLayout(pick_chain(ref_atoms, reference_chain))
+    ref_fit = fit_atoms(ref_atoms, reference_chain, fit_reference_chains)
+    fit_keys = list(ref_fit)
+    if perform_alignment and not fit_keys:
+        print("⚠️ No fit chain in the reference: fitting each peptide onto itself "
+              "(the RMSD then only measures shape differences)")
+
+    # Collect target files
+    target_files = sorted(glob.glob(os.path.join(target_folder, "*.pdb")))
+    print(f"\nFound {len(target_files)} target structures to process.\n")
+
+    model_names = []
+    coords = []
+    present = []
+    fit_coords = []
+    for target_file in target_files:
+        model_names.append(os.path.splitext(os.path.basename(target_file))[0])
+        atoms = read_chain(target_file, '')
+        xyz, n = layout.stack(pick_chain(atoms, target_chain))
+        coords.append(xyz)
+        present.append(n)
+        model_fit = fit_atoms(atoms, target_chain, fit_target_chains)
+        fit_coords.append([model_fit.get(key, (np.nan,) * 3) for key in fit_keys])
+    if not target_files:
+        return
+    coords = np.array(coords)
+    present = np.array(present)
+
+    # Optional: Align targets to reference. The fit is computed on the fit
+    # chains and applied to the peptide as well, so its RMSD is measured in
+    # the receptor frame
     if perform_alignment:
-        try:
-            cmd.align(target_sel, ref_chain_sel)
-        except Exception as e:
-            print(f"  ⚠️ Alignment failed for {model_name}: {e}")
-
-# Create temporary clean copies
-ref_chain_sel = f"reference and chain {reference_chain}" if reference_chain else "reference"
-target_sel = f"{model_name} and chain {target_chain}" if reference_chain else model_name
-
-cmd.create("ref_gzt", ref_chain_sel + " and polymer and not alt B")
-cmd.create("target_gzt", target_sel + " and polymer and not alt B")
-cmd.alter("ref_gzt", "segi=''")
-cmd.alter("target_gzt", "segi=''")
-cmd.sort()
-
-# Residues to check for symmetric sidechain flips
-res2Check = ['HIS','ASP','ARG','PHE','GLN','GLU','LEU','ASN','TYR','VAL']
-calpha = cmd.get_model(f"{ref_chain_sel} and name CA and not alt B")
-
-for g in calpha.atom:
-    ref_sel = f"ref_gzt and polymer and resi {g.resi}"
-    tgt_sel = f"target_gzt and polymer and resi {g.resi}"
-
-    if cmd.count_atoms(ref_sel) == 0 or cmd.count_atoms(tgt_sel) == 0:
-        print(f"⚠️ Missing atoms for residue {g.resi} ({g.resn}) in {model_name}")
-        continue
-
-    output_lines = []
-    for g in calpha.atom:
-        ref_sel = f"ref_gzt and polymer and resi {g.resi}"
-        tgt_sel = f"target_gzt and polymer and resi {g.resi}"
-
-        if cmd.count_atoms(ref_sel) == cmd.count_atoms(tgt_sel):
-            rms_all = cmd.rms_cur(ref_sel, tgt_sel)
-            rms_ca = cmd.rms_cur(ref_sel + " and name ca", tgt_sel + " and name ca")
-            rms_bb = cmd.rms_cur(ref_sel + " and name ca+n+c+o", tgt_sel + " and name ca+n+c+o")
-
-            rms_min = rms_all
-            if g.resn in res2Check:
-                # flip symmetric sidechains and recompute
-                cmd.create("flipped", tgt_sel)
-                # example flipping — adapt from your original function if needed
-                # (shortened for brevity)
-                if g.resn in ['ASP','GLU']:
-                    cmd.alter("flipped and name OD1", "name='TEMP'")
-                    cmd.alter("flipped and name OD2", "name='OD1'")
-                    cmd.alter("flipped and name TEMP", "name='OD2'")
-                cmd.sort()
-                rms_flipped = cmd.rms_cur(ref_sel, "flipped")
-                cmd.delete("flipped")
-                if rms_flipped < rms_min:
-                    rms_min = rms_flipped
-
-            line = f"{model_name},{g.resn},{g.resi},{rms_all:.3f},{rms_ca:.3f},{rms_bb:.3f},{rms_min:.3f}\n"
-            output_lines.append(line)
-
-    # Write results for this model
-    with open(output_csv, 'a') as f:
-        f.writelines(output_lines)
-
-    # Clean up for next iteration
-    cmd.delete(model_name)
-    cmd.delete("ref_gzt")
-    cmd.delete("target_gzt")
-
-print(f"\n✅ RMSD calculations complete. Results saved to: {output_csv}\n")
-cmd.quit()
\ No newline at end of file
+        n_fit = len(fit_keys)
+        if n_fit:
+            fit_coords = np.array(fit_coords, dtype=float).reshape(len(model_names), n_fit, 3)
+            reference = np.concatenate([np.array([ref_fit[key] for key in fit_keys]), layout.coords])
+            mask = np.arange(n_fit + len(layout.names)) < n_fit
+        else:
+            reference, mask = layout.coords, None
+            fit_coords = np.empty((len(model_names), 0, 3))
+        fitted, global_rmsd, used = superpose(np.concatenate([fit_coords, coords], axis=1), reference,
+                                              mask=mask, cycles=alignment_cycles, cutoff=alignment_cutoff)
+        coords = fitted[:, n_fit:]
+        with open(alignment_csv, 'w') as f:
+            f.write("modelID,globalRMSD,atomsAligned\n")
+            for m, model_name in enumerate(model_names):
+                f.write(f"{model_name},{global_rmsd[m]:.3f},{used[m].sum()}\n")
+
+    rms_all, rms_ca, rms_bb, rms_min, valid = per_residue_rmsd(layout, coords, present)
+
+    with open(output_csv, 'w') as f:
+        f.write("modelID,resName,resID,allAtomRMSD,rmsdResCa,rmsdResBackbone,allAtomRMSDMin\n")
+        for m, model_name in enumerate(model_names):
+            missing = [f"{layout.resi[r]} ({layout.resn[r]})"
+                       for r in np.flatnonzero(~valid[m])]
+            if missing:
+                print(f"⚠️ Missing atoms for residues {', '.join(missing)} in {model_name}")
+            for r in np.flatnonzero(valid[m]):
+                f.write(f"{model_name},{layout.resn[r]},{layout.resi[r]},{rms_all[m, r]:.3f},"
+                        f"{rms_ca[m, r]:.3f},{rms_bb[m, r]:.3f},{rms_min[m, r]:.3f}\n")
+
+    print(f"\n✅ RMSD calculations complete. Results saved to: {output_csv}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,532 @@
+"""
+peptide_pdbqt.py
+Purpose: Write AutoDock PDBQT files for peptides without Open Babel.
+
+For peptides built from the 20 standard residues everything Open Babel is
+used for (protonation at pH 7.4, polar hydrogens, AD4 atom types and Gasteiger
+charges) follows from residue templates:
+
+    - every residue is typed from its template (charged termini, Lys, Arg,
+      Asp, Glu; neutral His with H on NE2; disulfide-bonded Cys lose HG);
+    - polar hydrogens are placed from the heavy-atom geometry, all of them
+      in one vectorised call per placement rule;
+    - Gasteiger-Marsili (PEOE) charges are iterated on one graph holding
+      every molecule of the library, with the non-polar hydrogens as graph
+      nodes, and their charges are merged into the carbons they sit on, as
+      AutoDock expects.
+
+A whole mutant library is typed and charged in bulk: converting thousands of
+tripeptides takes seconds and needs no external binaries. Files with residues
+outside the templates or missing heavy atoms are reported and skipped (send
+those through convert_pdbqt_dir.py).
+
+Compared with Open Babel 3.1 (convert_pdbqt_dir.py) on 300 random 3-10mers,
+93% of the heavy-atom types are identical. The rest are Open Babel conventions
+that differ from AutoDock's: sulfur typed S instead of SA, Lys NZ and
+unprotonated His/Trp ring nitrogens typed NA, and Trp/His rings not aromatic.
+Open Babel also assigns the charges before it adds hydrogens, so its polar
+hydrogens carry no charge.
+
+Usage:
+    python peptide_pdbqt.py Mutants_1_2_3 [--output_dir PDBQT_Mutants_1_2_3]
+    python peptide_pdbqt.py Mutants_1_2_3 --validate PDBQT_openbabel   # compare with Open Babel output
+
+Dependencies:
+    - NumPy
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+from functools import lru_cache
+import numpy as np
+
+# Gasteiger-Marsili parameters (a, b, c) as in Open Babel's gasteiger.txt
+GASTEIGER = {
+    'H': (7.17, 6.24, -0.56),
+    'C3': (7.98, 9.18, 1.88),
+    'C2': (8.79, 9.32, 1.51),
+    'N3': (11.54, 10.82, 1.36),
+    'N2': (12.87, 11.15, 0.85),
+    'O3': (14.18, 12.92, 1.39),
+    'O2': (17.07, 13.79, 0.47),
+    'S3': (10.14, 9.13, 1.38),
+}
+GASTEIGER_DENOM_H = 20.02
+GASTEIGER_ITERATIONS = 6
+
+# Heavy atoms as (name, kind, attached hydrogens). kind is element + hybridisation
+# (3 = sp3, 2 = sp2, a = aromatic, A = aromatic nitrogen accepting H bonds).
+BACKBONE = [('N', 'N2', 1), ('CA', 'C3', 1), ('C', 'C2', 0), ('O', 'O2', 0)]
+SIDE_CHAINS = {
+    'ALA': [('CB', 'C3', 3)],
+    'ARG': [('CB', 'C3', 2), ('CG', 'C3', 2), ('CD', 'C3', 2), ('NE', 'N2', 1), ('CZ', 'C2', 0),
+            ('NH1', 'N2', 2), ('NH2', 'N2', 2)],
+    'ASN': [('CB', 'C3', 2), ('CG', 'C2', 0), ('OD1', 'O2', 0), ('ND2', 'N2', 2)],
+    'ASP': [('CB', 'C3', 2), ('CG', 'C2', 0), ('OD1', 'O2', 0), ('OD2', 'O2', 0)],
+    'CYS': [('CB', 'C3', 2), ('SG', 'S3', 1)],
+    'GLN': [('CB', 'C3', 2), ('CG', 'C3', 2), ('CD', 'C2', 0), ('OE1', 'O2', 0), ('NE2', 'N2', 2)],
+    'GLU': [('CB', 'C3', 2), ('CG', 'C3', 2), ('CD', 'C2', 0), ('OE1', 'O2', 0), ('OE2', 'O2', 0)],
+    'GLY': [],
+    'HIS': [('CB', 'C3', 2), ('CG', 'Ca', 0), ('ND1', 'NA', 0), ('CD2', 'Ca', 1), ('CE1', 'Ca', 1),
+            ('NE2', 'Na', 1)],
+    'ILE': [('CB', 'C3', 1), ('CG1', 'C3', 2), ('CG2', 'C3', 3), ('CD1', 'C3', 3)],
+    'LEU': [('CB', 'C3', 2), ('CG', 'C3', 1), ('CD1', 'C3', 3), ('CD2', 'C3', 3)],
+    'LYS': [('CB', 'C3', 2), ('CG', 'C3', 2), ('CD', 'C3', 2), ('CE', 'C3', 2), ('NZ', 'N3', 3)],
+    'MET': [('CB', 'C3', 2), ('CG', 'C3', 2), ('SD', 'S3', 0), ('CE', 'C3', 3)],
+    'PHE': [('CB', 'C3', 2), ('CG', 'Ca', 0), ('CD1', 'Ca', 1), ('CD2', 'Ca', 1), ('CE1', 'Ca', 1),
+            ('CE2', 'Ca', 1), ('CZ', 'Ca', 1)],
+    'PRO': [('CB', 'C3', 2), ('CG', 'C3', 2), ('CD', 'C3', 2)],
+    'SER': [('CB', 'C3', 2), ('OG', 'O3', 1)],
+    'THR': [('CB', 'C3', 1), ('OG1', 'O3', 1), ('CG2', 'C3', 3)],
+    'TRP': [('CB', 'C3', 2), ('CG', 'Ca', 0), ('CD1', 'Ca', 1), ('CD2', 'Ca', 0), ('NE1', 'Na', 1),
+            ('CE2', 'Ca', 0), ('CE3', 'Ca', 1), ('CZ2', 'Ca', 1), ('CZ3', 'Ca', 1), ('CH2', 'Ca', 1)],
+    'TYR': [('CB', 'C3', 2), ('CG', 'Ca', 0), ('CD1', 'Ca', 1), ('CD2', 'Ca', 1), ('CE1', 'Ca', 1),
+            ('CE2', 'Ca', 1), ('CZ', 'Ca', 0), ('OH', 'O3', 1)],
+    'VAL': [('CB', 'C3', 1), ('CG1', 'C3', 3), ('CG2', 'C3', 3)],
+}
+SIDE_CHAIN_BONDS = {
+    'ALA': 'CA-CB',
+    'ARG': 'CA-CB CB-CG CG-CD CD-NE NE-CZ CZ-NH1 CZ-NH2',
+    'ASN': 'CA-CB CB-CG CG-OD1 CG-ND2',
+    'ASP': 'CA-CB CB-CG CG-OD1 CG-OD2',
+    'CYS': 'CA-CB CB-SG',
+    'GLN': 'CA-CB CB-CG CG-CD CD-OE1 CD-NE2',
+    'GLU': 'CA-CB CB-CG CG-CD CD-OE1 CD-OE2',
+    'GLY': '',
+    'HIS': 'CA-CB CB-CG CG-ND1 CG-CD2 ND1-CE1 CD2-NE2 CE1-NE2',
+    'ILE': 'CA-CB CB-CG1 CB-CG2 CG1-CD1',
+    'LEU': 'CA-CB CB-CG CG-CD1 CG-CD2',
+    'LYS': 'CA-CB CB-CG CG-CD CD-CE CE-NZ',
+    'MET': 'CA-CB CB-CG CG-SD SD-CE',
+    'PHE': 'CA-CB CB-CG CG-CD1 CG-CD2 CD1-CE1 CD2-CE2 CE1-CZ CE2-CZ',
+    'PRO': 'CA-CB CB-CG CG-CD CD-N',
+    'SER': 'CA-CB CB-OG',
+    'THR': 'CA-CB CB-OG1 CB-CG2',
+    'TRP': 'CA-CB CB-CG CG-CD1 CG-CD2 CD1-NE1 NE1-CE2 CD2-CE2 CD2-CE3 CE2-CZ2 CE3-CZ3 CZ2-CH2 CZ3-CH2',
+    'TYR': 'CA-CB CB-CG CG-CD1 CG-CD2 CD1-CE1 CD2-CE2 CE1-CZ CE2-CZ CZ-OH',
+    'VAL': 'CA-CB CB-CG1 CB-CG2',
+}
+# formal charges at pH 7.4 (the termini are handled in residue_template)
+FORMAL_CHARGES = {('ARG', 'NH2'): 1, ('ASP', 'OD2'): -1, ('GLU', 'OE2'): -1, ('LYS', 'NZ'): 1}
+
+# Polar hydrogens: (name, parent, rule, reference atoms, bond length, angle, torsion).
+# rule 'place': angle b-c-H and torsion a-b-c-H from references (a, b);
+# rule 'bisect': opposite the bisector of the parent's two references.
+# '-C' is the carbonyl carbon of the previous residue.
+POLAR_HYDROGENS = {
+    'ARG': [('HE', 'NE', 'bisect', ('CD', 'CZ'), 1.01, 0, 0),
+            ('HH11', 'NH1', 'place', ('NE', 'CZ'), 1.01, 120, 0),
+            ('HH12', 'NH1', 'place', ('NE', 'CZ'), 1.01, 120, 180),
+            ('HH21', 'NH2', 'place', ('NE', 'CZ'), 1.01, 120, 0),
+            ('HH22', 'NH2', 'place', ('NE', 'CZ'), 1.01, 120, 180)],
+    'ASN': [('HD21', 'ND2', 'place', ('OD1', 'CG'), 1.01, 120, 0),
+            ('HD22', 'ND2', 'place', ('OD1', 'CG'), 1.01, 120, 180)],
+    'CYS': [('HG', 'SG', 'place', ('CA', 'CB'), 1.34, 96, 180)],
+    'GLN': [('HE21', 'NE2', 'place', ('OE1', 'CD'), 1.01, 120, 0),
+            ('HE22', 'NE2', 'place', ('OE1', 'CD'), 1.01, 120, 180)],
+    'HIS': [('HE2', 'NE2', 'bisect', ('CD2', 'CE1'), 1.01, 0, 0)],
+    'LYS': [('HZ1', 'NZ', 'place', ('CD', 'CE'), 1.01, 109.5, 60),
+            ('HZ2', 'NZ', 'place', ('CD', 'CE'), 1.01, 109.5, 180),
+            ('HZ3', 'NZ', 'place', ('CD', 'CE'), 1.01, 109.5, 300)],
+    'SER': [('HG', 'OG', 'place', ('CA', 'CB'), 0.96, 109.5, 180)],
+    'THR': [('HG1', 'OG1', 'place', ('CA', 'CB'), 0.96, 109.5, 180)],
+    'TRP': [('HE1', 'NE1', 'bisect', ('CD1', 'CE2'), 1.01, 0, 0)],
+    'TYR': [('HH', 'OH', 'place', ('CE1', 'CZ'), 0.96, 109.5, 0)],
+}
+AMIDE_H = ('H', 'N', 'bisect', ('-C', 'CA'), 1.01, 0, 0)
+N_TERMINAL_H = [('H1', 'N', 'place', ('C', 'CA'), 1.01, 109.5, 60),
+                ('H2', 'N', 'place', ('C', 'CA'), 1.01, 109.5, 180),
+                ('H3', 'N', 'place', ('C', 'CA'), 1.01, 109.5, 300)]
+PRO_N_TERMINAL_H = [('H1', 'N', 'place', ('C', 'CA'), 1.01, 109.5, 120),
+                    ('H2', 'N', 'place', ('C', 'CA'), 1.01, 109.5, 240)]
+
+PEPTIDE_BOND = 2.0      # max C(i)-N(i+1) distance for residues to be linked
+DISULFIDE_BOND = 2.5    # max SG-SG distance for a disulfide
+
+
+def ad4_type(kind, has_h):
+    element, hyb = kind[0], kind[1]
+    if element == 'C':
+        return 'A' if hyb == 'a' else 'C'
+    if element == 'N':
+        return 'NA' if hyb == 'A' and not has_h else 'N'
+    return {'O': 'OA', 'S': 'SA'}[element]
+
+
+def gasteiger_key(kind):
+    element, hyb = kind[0], kind[1]
+    if element == 'S':
+        return 'S3'
+    return element + ('3' if hyb == '3' else '2')
+
+
+@lru_cache(maxsize=None)
+def residue_template(resn, n_terminal, c_terminal, disulfide):
+    """Heavy atoms (names, Gasteiger keys, AD4 types, formal charges,
+    non-polar hydrogen counts), local bonds and polar hydrogen rules of one
+    residue variant. c_terminal means an OXT atom is present."""
+    atoms = list(BACKBONE) + SIDE_CHAINS[resn]
+    if resn == 'GLY':
+        atoms[1] = ('CA', 'C3', 2)
+    if c_terminal:
+        atoms.append(('OXT', 'O2', 0))
+    names = [name for name, kind, nh in atoms]
+    index = {name: i for i, name in enumerate(names)}
+
+    hydrogens = list(POLAR_HYDROGENS.get(resn, []))
+    if disulfide:
+        hydrogens = [h for h in hydrogens if h[1] != 'SG']
+    if n_terminal:
+        hydrogens = (PRO_N_TERMINAL_H if resn == 'PRO' else N_TERMINAL_H) + hydrogens
+    elif resn != 'PRO':
+        hydrogens = [AMIDE_H] + hydrogens
+    polar_parents = set(h[1] for h in hydrogens)
+
+    formal = np.zeros(len(atoms))
+    for (res, name), charge in FORMAL_CHARGES.items():
+        if res == resn:
+            formal[index[name]] = charge
+    if n_terminal:
+        formal[index['N']] = 1
+    if c_terminal:
+        formal[index['OXT']] = -1
+
+    kinds = [kind for name, kind, nh in atoms]
+    if n_terminal:
+        kinds[0] = 'N3'
+    nonpolar = np.array([nh if kind[0] == 'C' else 0 for name, kind, nh in atoms])
+
+    bonds = [('N', 'CA'), ('CA', 'C'), ('C', 'O')] + [tuple(b.split('-')) for b in SIDE_CHAIN_BONDS[resn].split()]
+    if c_terminal:
+        bonds.append(('C', 'OXT'))
+    return {
+        'names': names,
+        'gasteiger': [gasteiger_key(kind) for kind in kinds],
+        'types': [ad4_type(kind, name in polar_parents) for (name, k, nh), kind in zip(atoms, kinds)],
+        'formal': formal,
+        'nonpolar': nonpolar,
+        'bonds': np.array([(index[a], index[b]) for a, b in bonds]),
+        'hydrogens': hydrogens,
+    }
+
+
+def read_peptide(pdb_file):
+    """Residues of the first model as a list of (chain, resi, resn, {atom name: xyz})."""
+    residues = []
+    current = None
+    with open(pdb_file) as f:
+        for line in f:
+            if line.startswith('ENDMDL'):
+                break
+            if not line.startswith(('ATOM', 'HETATM')) or line[16] not in ' A':
+                continue
+            name = line[12:16].strip()
+            element = line[76:78].strip() or name.lstrip('0123456789')[:1]
+            if element == 'H':
+                continue
+            key = (line[21], line[22:27].strip(), line[17:20].strip())
+            if current is None or current[:3] != key:
+                current = key + ({},)
+                residues.append(current)
+            current[3].setdefault(name, (float(line[30:38]), float(line[38:46]), float(line[46:54])))
+    return residues
+
+
+class Library:
+    """Typed, charged and protonated molecules, built in bulk.
+
+    add() instantiates residue templates for one file; finish() places every
+    polar hydrogen and runs the Gasteiger iterations once for the whole
+    library. Heavy atoms and hydrogens share one global atom numbering.
+    """
+
+    def __init__(self):
+        self.molecules = []     # (name, atom index array)
+        self.xyz = []           # heavy atom coordinates, filled per molecule
+        self.names = []
+        self.residue = []       # (chain, resi, resn) of every atom
+        self.types = []
+        self.gasteiger = []
+        self.formal = []
+        self.nonpolar = []
+        self.bonds = []
+        self.h_rules = []       # (global H index, rule, ref a, ref b, parent, bond, angle, torsion)
+        self.n_atoms = 0
+
+    def _new_atoms(self, n):
+        start = self.n_atoms
+        self.n_atoms += n
+        return start
+
+    def add(self, name, residues):
+        """Instantiate the templates of one molecule; raises ValueError (and
+        adds nothing) for unknown residues or missing heavy atoms."""
+        linked = []
+        for r, (chain, resi, resn, coords) in enumerate(residues):
+            if resn not in SIDE_CHAINS:
+                raise ValueError(f"no template for residue {resn}{resi}")
+            prev = residues[r - 1] if r else None
+            linked.append(prev is not None and prev[0] == chain and 'C' in prev[3] and 'N' in coords and
+                          np.linalg.norm(np.subtract(prev[3]['C'], coords['N'])) <= PEPTIDE_BOND)
+        templates = []
+        for r, (chain, resi, resn, coords) in enumerate(residues):
+            next_linked = r + 1 < len(residues) and linked[r + 1]
+            disulfide = resn == 'CYS' and 'SG' in coords and any(
+                np.linalg.norm(np.subtract(coords['SG'], other[3]['SG'])) <= DISULFIDE_BOND
+                for other in residues if other[2] == 'CYS' and other[3] is not coords and 'SG' in other[3])
+            template = residue_template(resn, not linked[r], 'OXT' in coords and not next_linked, disulfide)
+            missing = [atom for atom in template['names'] if atom not in coords]
+            if missing:
+                raise ValueError(f"{resn}{resi} is missing {' '.join(missing)}")
+            templates.append((template, disulfide))
+
+        order = []
+        ca_c = {}          # residue number in the molecule -> global index of its C, for peptide bonds
+        sg = []
+        for r, (chain, resi, resn, coords) in enumerate(residues):
+            template, disulfide = templates[r]
+            start = self._new_atoms(len(template['names']))
+            index = {atom: start + i for i, atom in enumerate(template['names'])}
+            self.xyz.extend(coords[atom] for atom in template['names'])
+            self.names.extend(template['names'])
+            self.residue.extend([(chain, resi, resn)] * len(template['names']))
+            self.types.extend(template['types'])
+            self.gasteiger.extend(template['gasteiger'])
+            self.formal.append(template['formal'])
+            self.nonpolar.append(template['nonpolar'])
+            self.bonds.append(template['bonds'] + start)
+            if linked[r]:
+                self.bonds.append(np.array([[ca_c[r - 1], index['N']]]))
+            ca_c[r] = index['C']
+            if disulfide:
+                sg.append(index['SG'])
+            order.extend(range(start, start + len(template['names'])))
+
+            for h_name, parent, rule, (ref_a, ref_b), bond, angle, torsion in template['hydrogens']:
+                h = self._new_atoms(1)
+                self.xyz.append((np.nan, np.nan, np.nan))
+                self.names.append(h_name)
+                self.residue.append((chain, resi, resn))
+                self.types.append('HD')
+                self.gasteiger.append('H')
+                self.formal.append(np.zeros(1))
+                self.nonpolar.append(np.zeros(1, dtype=int))
+                self.bonds.append(np.array([[index[parent], h]]))
+                a = ca_c[r - 1] if ref_a == '-C' else index[ref_a]
+                self.h_rules.append((h, rule, a, index[ref_b], index[parent], bond, angle, torsion))
+                order.append(h)
+
+        sg_xyz = np.array([self.xyz[i] for i in sg]).reshape(-1, 3)
+        for i in range(len(sg)):
+            for j in range(i + 1, len(sg)):
+                if np.linalg.norm(sg_xyz[i] - sg_xyz[j]) <= DISULFIDE_BOND:
+                    self.bonds.append(np.array([[sg[i], sg[j]]]))
+        self.molecules.append((name, np.array(order)))
+
+    def finish(self):
+        self.xyz = np.array(self.xyz, dtype=float).reshape(-1, 3)
+        self.place_hydrogens()
+        self.charges = self.gasteiger_charges()
+
+    def place_hydrogens(self):
+        if not self.h_rules:
+            return
+        h, rule, a, b, c, bond, angle, torsion = (np.array(col) for col in zip(*self.h_rules))
+        xa, xb, xc = self.xyz[a], self.xyz[b], self.xyz[c]
+        bond = bond.astype(float)[:, None]
+
+        # 'place': H at the given bond length, angle b-c-H and torsion a-b-c-H
+        bc = xc - xb
+        bc /= np.linalg.norm(bc, axis=1)[:, None]
+        n = np.cross(xb - xa, bc)
+        n /= np.linalg.norm(n, axis=1)[:, None]
+        m = np.cross(n, bc)
+        angle = np.radians(angle.astype(float))[:, None]
+        torsion = np.radians(torsion.astype(float))[:, None]
+        placed = xc + bond * (-np.cos(angle) * bc + np.sin(angle) * (np.cos(torsion) * m + np.sin(torsion) * n))
+
+        # 'bisect': H along the bisector pointing away from the parent's two neighbours
+        ua = xc - xa
+        ub = xc - xb
+        away = ua / np.linalg.norm(ua, axis=1)[:, None] + ub / np.linalg.norm(ub, axis=1)[:, None]
+        bisected = xc + bond * away / np.linalg.norm(away, axis=1)[:, None]
+
+        self.xyz[h] = np.where((rule == 'place')[:, None], placed, bisected)
+
+    def gasteiger_charges(self):
+        """Gasteiger-Marsili charges of every atom in the library, with the
+        charges of the implicit non-polar hydrogens merged into their carbons."""
+        nonpolar = np.concatenate(self.nonpolar)
+        heavy_of_h = np.repeat(np.arange(self.n_atoms), nonpolar)
+        n_nodes = self.n_atoms + len(heavy_of_h)
+        implicit = np.arange(self.n_atoms, n_nodes)
+        bonds = np.concatenate(self.bonds + [np.stack([heavy_of_h, implicit], axis=1)])
+
+        params = np.array([GASTEIGER[key] for key in self.gasteiger] + [GASTEIGER['H']] * len(heavy_of_h))
+        a, b, c = params.T
+        denom = a + b + c
+        is_h = np.array([key == 'H' for key in self.gasteiger] + [True] * len(heavy_of_h))
+        denom[is_h] = GASTEIGER_DENOM_H
+        q = np.concatenate(self.formal + [np.zeros(len(heavy_of_h))])
+
+        i, j = bonds[:, 0], bonds[:, 1]
+        alpha = 1.0
+        for step in range(GASTEIGER_ITERATIONS):
+            alpha *= 0.5
+            chi = a + q * (b + q * c)
+            # charge flows towards the more electronegative atom, scaled by
+            # the other atom's electronegativity at +1
+            dq = alpha * (chi[i] - chi[j]) / np.where(chi[i] >= chi[j], denom[j], denom[i])
+            q = q - np.bincount(i, dq, n_nodes) + np.bincount(j, dq, n_nodes)
+
+        charges = q[:self.n_atoms].copy()
+        np.add.at(charges, heavy_of_h, q[implicit])
+        return charges
+
+    def pdbqt(self, m):
+        """PDBQT text of molecule m, as a rigid ligand."""
+        name, order = self.molecules[m]
+        lines = [f"REMARK  Name = {name}\n", "ROOT\n"]
+        for serial, i in enumerate(order, 1):
+            chain, resi, resn = self.residue[i]
+            atom = self.names[i]
+            atom = atom if len(atom) == 4 else f" {atom:<3s}"
+            number, icode = (resi[:-1], resi[-1]) if resi[-1:].isalpha() else (resi, ' ')
+            x, y, z = self.xyz[i]
+            lines.append(f"ATOM  {serial:5d} {atom:4s} {resn:3s} {chain:1s}{number:>4s}{icode:1s}   "
+                         f"{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00    {self.charges[i]:+6.3f} {self.types[i]:<2s}\n")
+        lines.extend(["ENDROOT\n", "TORSDOF 0\n"])
+        return ''.join(lines)
+
+
+def build_library(pdb_files):
+    """Type, protonate and charge every file; returns (library, skipped files with reasons)."""
+    library = Library()
+    skipped = []
+    for pdb_file in pdb_files:
+        name = os.path.splitext(os.path.basename(pdb_file))[0]
+        try:
+            residues = read_peptide(pdb_file)
+            if not residues:
+                raise ValueError("no atoms")
+            library.add(name, residues)
+        except ValueError as e:
+            skipped.append((pdb_file, str(e)))
+    library.finish()
+    return library, skipped
+
+
+def convert_directory(input_dir, pdbqt_dir=None):
+    if pdbqt_dir is None:
+        pdbqt_dir = f"PDBQT_{os.path.basename(os.path.normpath(input_dir))}"
+    os.makedirs(pdbqt_dir, exist_ok=True)
+    pdb_files = sorted(glob.glob(os.path.join(input_dir, "*.pdb")))
+
+    t0 = time.time()
+    library, skipped = build_library(pdb_files)
+    for m, (name, order) in enumerate(library.molecules):
+        output_file = os.path.join(pdbqt_dir, name + ".pdbqt")
+        with open(output_file + ".part", 'w') as f:
+            f.write(library.pdbqt(m))
+        os.replace(output_file + ".part", output_file)
+    seconds = time.time() - t0
+
+    for pdb_file, reason in skipped:
+        print(f"Skipped: {pdb_file}: {reason}")
+    print(f"Wrote {len(library.molecules)} PDBQT files in {seconds:.2f} s "
+          f"({len(library.molecules) / max(seconds, 1e-9):.0f} files/s), {len(skipped)} skipped")
+    print(f"PDBQT files are in {pdbqt_dir}")
+    return skipped
+
+
+def read_pdbqt(pdbqt_file):
+    """Heavy atoms as {coordinate columns: (AD4 type, charge)} and the
+    polar hydrogens as a (n, 3) coordinate array."""
+    atoms = {}
+    hydrogens = []
+    with open(pdbqt_file) as f:
+        for line in f:
+            if not line.startswith(('ATOM', 'HETATM')):
+                continue
+            ad_type = line[77:79].strip()
+            if ad_type in ('HD', 'H'):
+                hydrogens.append((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+                continue
+            atoms[line[30:54]] = (ad_type, float(line[70:76]))
+    return atoms, np.array(hydrogens).reshape(-1, 3)
+
+
+def validate(input_dir, reference_dir):
+    """Compare the native typing with Open Babel PDBQT files of the same
+    structures (matched by file name). Heavy atoms are matched by their
+    coordinates, which Open Babel writes back unchanged while it may rename
+    atoms and residues; its hydrogens are counted on the residue of the
+    nearest heavy atom."""
+    pdb_files = sorted(glob.glob(os.path.join(input_dir, "*.pdb")))
+    library, skipped = build_library(pdb_files)
+    n_atoms = same_type = compared_files = 0
+    h_residues = same_h = 0
+    diffs = []
+    mismatches = {}
+    for m, (name, order) in enumerate(library.molecules):
+        reference = os.path.join(reference_dir, name + ".pdbqt")
+        if not os.path.isfile(reference):
+            continue
+        compared_files += 1
+        ref_atoms, ref_h = read_pdbqt(reference)
+        mine_h = {}
+        heavy = []
+        for i in order:
+            chain, resi, resn = library.residue[i]
+            if library.types[i] == 'HD':
+                mine_h[(chain, resi)] = mine_h.get((chain, resi), 0) + 1
+                continue
+            heavy.append(i)
+            ref = ref_atoms.get('%8.3f%8.3f%8.3f' % tuple(library.xyz[i]))
+            if ref is None:
+                continue
+            n_atoms += 1
+            if ref[0] == library.types[i]:
+                same_type += 1
+            else:
+                key = (resn, library.names[i], library.types[i], ref[0])
+                mismatches[key] = mismatches.get(key, 0) + 1
+            diffs.append(library.charges[i] - ref[1])
+        theirs_h = {}
+        if len(ref_h):
+            nearest = np.argmin(((ref_h[:, None] - library.xyz[heavy][None]) ** 2).sum(axis=2), axis=1)
+            for k in nearest:
+                chain, resi, _ = library.residue[heavy[k]]
+                theirs_h[(chain, resi)] = theirs_h.get((chain, resi), 0) + 1
+        for residue in set(library.residue[i][:2] for i in heavy):
+            h_residues += 1
+            same_h += mine_h.get(residue, 0) == theirs_h.get(residue, 0)
+
+    if not n_atoms:
+        print(f"No matching Open Babel files in {reference_dir}")
+        return
+    diffs = np.abs(diffs)
+    print(f"{compared_files} structures, {n_atoms} heavy atoms compared")
+    print(f"AD4 types identical: {100.0 * same_type / n_atoms:.2f}%")
+    print(f"Gasteiger charges: mean |diff| {diffs.mean():.4f} e, max |diff| {diffs.max():.4f} e")
+    print(f"Polar hydrogen count identical for {100.0 * same_h / max(h_residues, 1):.2f}% of residues")
+    for (resn, atom, mine, ref), count in sorted(mismatches.items(), key=lambda item: -item[1])[:10]:
+        print(f"  type mismatch {resn} {atom}: {mine} here, {ref} in Open Babel ({count}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write PDBQT files for a directory of standard-residue peptides")
+    parser.add_argument("input_dir")
+    parser.add_argument("--output_dir", default=None, help="default: PDBQT_<input_dir>")
+    parser.add_argument("--validate", default=None, metavar="OB_PDBQT_DIR",
+                        help="compare with Open Babel PDBQT files of the same structures instead of writing")
+    args = parser.parse_args()
+
+    if args.validate:
+        validate(args.input_dir, args.validate)
+    else:
+        skipped = convert_directory(args.input_dir, args.output_dir)
+        sys.exit(1 if skipped else 0)
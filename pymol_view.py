@@ -0,0 +1,35 @@
+## PyMOL visualisation shared by the scanning scripts (AAscan.py, AlaScan.py, AminoAcidScan.py).
+## Scans run headless by default: no PyMOLMover is created and mutants are not rescored just to
+## send their energies. With --PyMOLMover_ip=on (or host[:port]) the starting pose and every
+## --PyMOL_every-th mutant are sent, so large scans only pay for a trickle of packets.
+## The state is per process, so every scan worker calls setup_pymol itself.
+
+from pyrosetta import PyMOLMover
+
+_pymol = {'mover': None, 'every': 1, 'count': 0}
+
+def setup_pymol(pymol_ip = 'off', every = 1):
+    _pymol['mover'] = None
+    _pymol['every'] = max(1, int(every))
+    _pymol['count'] = 0
+    if pymol_ip in (None, '', 'off'):
+        return
+    if pymol_ip == 'on':
+        pymover = PyMOLMover()
+    else:
+        host, _, port = pymol_ip.partition(':')
+        pymover = PyMOLMover(host, int(port or 65000))
+    pymover.keep_history(True)    # for multiple trajectories
+    _pymol['mover'] = pymover
+
+def show_pose(pose, scorefxn = None, always = False):
+    pymover = _pymol['mover']
+    if pymover is None:
+        return
+    _pymol['count'] += 1
+    if not always and (_pymol['count'] - 1) % _pymol['every']:
+        return
+    if scorefxn:
+        scorefxn(pose)
+    pymover.apply(pose)
+    pymover.send_energy(pose)
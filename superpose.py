@@ -0,0 +1,82 @@
+"""
+superpose.py
+Purpose: Batched Kabsch superposition of many models onto one reference.
+
+All models are stacked into one (models, atoms, 3) array of matched atoms and
+every optimal rotation is solved with a single batched SVD. Like PyMOL's
+align, the fit can be refined by rejecting outlier atoms and refitting.
+
+Usage:
+    from superpose import superpose
+    fitted, rmsd, used = superpose(models, reference, cycles=5, cutoff=2.0)
+
+Dependencies:
+    - NumPy
+"""
+
+import numpy as np
+
+
+def kabsch(mobile, reference, weights):
+    """Optimal rotations and centroids for every model at once.
+
+    mobile is (models, atoms, 3) with no NaNs, reference (atoms, 3) and
+    weights (models, atoms). Returns R (models, 3, 3), the mobile centroids
+    and the reference centroids, so that (mobile - Pc) @ R + Qc is the fit.
+    """
+    w = weights[..., None]
+    total = np.maximum(w.sum(axis=1), 1e-12)
+    Pc = (w * mobile).sum(axis=1) / total
+    Qc = (w * reference).sum(axis=1) / total
+    H = np.einsum('nai,naj->nij', w * (mobile - Pc[:, None]), reference - Qc[:, None])
+    U, S, Vt = np.linalg.svd(H)
+    # flip the last singular vector where needed so R is a proper rotation
+    d = np.sign(np.linalg.det(U @ Vt))
+    d[d == 0] = 1.0
+    U[:, :, 2] *= d[:, None]
+    return U @ Vt, Pc, Qc
+
+
+def superpose(models, reference, mask=None, cycles=5, cutoff=2.0):
+    """Fit every model onto the reference.
+
+    models: (models, atoms, 3), NaN where a model lacks an atom.
+    reference: (atoms, 3).
+    mask: optional (atoms,) or (models, atoms) boolean array of the atoms used
+        for fitting; all matched atoms are used by default.
+    cycles, cutoff: after each fit, atoms deviating by more than cutoff times
+        the model's RMSD are dropped and the model is refitted, for at most
+        cycles rounds (cycles=0 disables outlier rejection).
+
+    Returns the transformed models (all atoms, NaNs kept), the RMSD of each
+    model over the atoms kept in its final fit, and the (models, atoms) mask
+    of those atoms. Models with fewer than 3 usable atoms are returned as is.
+    """
+    models = np.asarray(models, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    missing = np.isnan(models).any(axis=2)
+    used = ~missing
+    if mask is not None:
+        used &= np.broadcast_to(mask, used.shape)
+    mobile = np.where(missing[..., None], 0.0, models)
+
+    for cycle in range(cycles + 1):
+        R, Pc, Qc = kabsch(mobile, reference, used.astype(float))
+        fitted = np.einsum('nai,nij->naj', mobile - Pc[:, None], R) + Qc[:, None]
+        d2 = ((fitted - reference) ** 2).sum(axis=2)
+        n = used.sum(axis=1)
+        rmsd = np.sqrt((d2 * used).sum(axis=1) / np.maximum(n, 1))
+        if cycle == cycles:
+            break
+        keep = used & (d2 <= (cutoff * rmsd[:, None]) ** 2)
+        # stop rejecting for models that would drop below 3 atoms
+        keep[keep.sum(axis=1) < 3] = used[keep.sum(axis=1) < 3]
+        if (keep == used).all():
+            break
+        used = keep
+
+    degenerate = used.sum(axis=1) < 3
+    fitted[degenerate] = mobile[degenerate]
+    rmsd[degenerate] = np.nan
+    fitted[missing] = np.nan
+    return fitted, rmsd, used